@@ -0,0 +1,45 @@
+"""
+Evaluation time of the graph style queries in tests/core/graphqueries with
+DFSEval, with BatchEval, with closures from the Compiler and with generated
+python source (of the query as is and after the Optimizer).
+
+    python -m benchmarks.bench_exprs [number]
+"""
+import sys, json, timeit
+from modelzero import utils
+from modelzero.core import evals, env, querygen, optimizer
+from modelzero.core.batching import BatchEval
+from modelzero.core.compiler import Compiler
+from tests.core import graphqueries
+
+def evaluators(query):
+    body = query.body
+    dfseval = evals.DFSEval()
+    batcheval = BatchEval()
+    compiled = Compiler().compile(body)
+    generated = querygen.compile_query(query)
+    optimized = querygen.compile_query(optimizer.optimize_func(query))
+    assert generated.source is not None and optimized.source is not None
+    return dict(dfseval = lambda: dfseval(body, env.DefaultEnv()).value,
+                batched = lambda: batcheval(body, env.DefaultEnv()).value,
+                compiled = lambda: compiled.run(env.DefaultEnv()),
+                generated = generated,
+                optimized = optimized)
+
+def main(number = 200, repeat = 5):
+    print(f"{'query':<18}{'evaluator':<12}{'us/eval':>12}{'speedup':>10}")
+    for name, make in graphqueries.QUERIES.items():
+        runs = evaluators(make())
+        results = {evaluator: run() for evaluator, run in runs.items()}
+        assert results["compiled"] == results["dfseval"] == results["generated"]
+        for evaluator in ("batched", "optimized"):
+            assert json.dumps(results[evaluator], cls = utils.NEJsonEncoder, sort_keys = True) == \
+                    json.dumps(results["dfseval"], cls = utils.NEJsonEncoder, sort_keys = True)
+        baseline = None
+        for evaluator, run in runs.items():
+            best = min(timeit.repeat(run, number = number, repeat = repeat)) / number
+            baseline = baseline or best
+            print(f"{name:<18}{evaluator:<12}{best * 1e6:>12.1f}{baseline / best:>10.2f}")
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,30 @@
+"""
+Throughput of serializing Member records to json with NEJsonEncoder and
+with RecordJsonEncoder (per record class generated serializers).
+
+    python -m benchmarks.bench_json [count]
+"""
+import sys, json, timeit, datetime
+from modelzero import utils
+from modelzero.members.entities import Member
+
+def make(count):
+    now = datetime.datetime(2020, 1, 1)
+    return [Member(fullname = "Member %d" % i, date_of_birth = now,
+                   phone = "5551234", email = "m@modelzero.com",
+                   created_at = now, updated_at = now, is_active = True,
+                   __key__ = i)
+            for i in range(count)]
+
+def main(count = 10000, repeat = 5):
+    members = make(count)
+    expected = json.dumps(members, cls = utils.NEJsonEncoder, sort_keys = True)
+    assert json.dumps(members, cls = utils.RecordJsonEncoder, sort_keys = True) == expected
+    print(f"{'encoder':<20}{'records/s':>14}{'us/record':>12}")
+    for encoder in (utils.NEJsonEncoder, utils.RecordJsonEncoder):
+        best = min(timeit.repeat(lambda: json.dumps(members, cls = encoder),
+                                 number = 1, repeat = repeat))
+        print(f"{encoder.__name__:<20}{count / best:>14.0f}{best * 1e6 / count:>12.2f}")
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""
+Memory, construction and attribute access benchmark for the dict and compact
+(slot backed) record layouts, with and without compiled record methods.
+
+    python -m benchmarks.bench_records [count]
+"""
+import sys, timeit, tracemalloc
+from modelzero.core.records import Field
+from modelzero.core.types import MZTypes
+from modelzero.core.entities import Entity
+
+class DictMember(Entity):
+    fullname = Field(MZTypes.String)
+    phone = Field(MZTypes.String, default = "")
+    email = Field(MZTypes.String, default = "")
+    score = Field(MZTypes.Int, optional = True)
+    is_active = Field(MZTypes.Bool, default = True, optional = True)
+
+class CompactMember(Entity):
+    __compact__ = True
+    fullname = Field(MZTypes.String)
+    phone = Field(MZTypes.String, default = "")
+    email = Field(MZTypes.String, default = "")
+    score = Field(MZTypes.Int, optional = True)
+    is_active = Field(MZTypes.Bool, default = True, optional = True)
+
+class CompiledMember(DictMember):
+    __compiled__ = True
+
+class CompiledCompactMember(CompactMember):
+    __compiled__ = True
+
+def make(record_class, count):
+    return [record_class(fullname = "Member", phone = "5551234",
+                         email = "m@modelzero.com", score = i,
+                         is_active = True)
+            for i in range(count)]
+
+def measure_memory(record_class, count):
+    tracemalloc.start()
+    records = make(record_class, count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current
+
+def measure_access(record_class, number = 200000):
+    record = make(record_class, 1)[0]
+    get = timeit.timeit(lambda: record.fullname, number = number)
+    put = timeit.timeit(lambda: setattr(record, "score", 3), number = number)
+    return get, put
+
+def measure_construction(record_class, number = 20000):
+    return timeit.timeit(lambda: make(record_class, 1), number = number) / number
+
+def main(count = 100000):
+    print(f"{'layout':<20}{'bytes/record':>14}{'new (us)':>12}{'get (ns)':>12}{'set (ns)':>12}")
+    layouts = (("dict", DictMember), ("compact", CompactMember),
+               ("compiled", CompiledMember),
+               ("compiled+compact", CompiledCompactMember))
+    for label, record_class in layouts:
+        memory = measure_memory(record_class, count)
+        new = measure_construction(record_class)
+        get, put = measure_access(record_class)
+        print(f"{label:<20}{memory / count:>14.1f}{new * 1e6:>12.2f}"
+              f"{get * 1e9 / 200000:>12.1f}{put * 1e9 / 200000:>12.1f}")
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -246,7 +246,5 @@ class RecordFromBody(object):
         self.record_class = record_class
 
     def __call__(self, req, *args, **kwargs):
-        d = dict(req.params.items())
-        record = self.record_class()
-        record.apply_patch(req.params)
-        return record
+        from modelzero.core import decoding
+        return decoding.decode_record(self.record_class, req.params.body)
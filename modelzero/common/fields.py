@@ -1,5 +1,6 @@
 
 from ipdb import set_trace
+import datetime
 from modelzero.core import types
 from modelzero.core.types import MZTypes
 from modelzero.core.records import *
@@ -28,7 +29,7 @@ class DateTimeField(Field):
             except:
                 value = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
         elif type(value) is int:
-            value = datetime.datetime.utcfromtimeoffset(value)
+            value = datetime.datetime.utcfromtimestamp(value)
         else:
             value = value.replace(tzinfo = None)
         return super().validate(value)
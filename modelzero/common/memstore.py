@@ -3,6 +3,8 @@ from typing import TypeVar, Generic, List, Type
 from modelzero.core import errors
 from modelzero.core.store import *
 from modelzero.core.entities import Key
+from modelzero.core.keyencoding import key_encoder, prefix_end
+import bisect
 
 T = TypeVar("T")
 
@@ -22,6 +24,10 @@ class MemTable(Table[T]):
     def __init__(self, entity_class : Type[T] = T):
         self._entity_class = entity_class
         self._entries = {}
+        # Encoded (order preserving) keys of all entries in sorted order.
+        # Only built by the first scan since not every key can be ordered.
+        self._index = None
+        self._index_keys = None
 
     # GET methods
     def get_by_key(self, key : Key, nothrow = True) -> T:
@@ -37,6 +43,10 @@ class MemTable(Table[T]):
     # Update methods
     def put(self, entity : T, validate = True) -> T:
         """ Updates this entity by first validating it and then persisting it. """
+        changed_fields = entity.changed_fields
+        if changed_fields is not None and not changed_fields:
+            # Nothing has changed since this was last saved
+            return entity
         if not entity.getkey():
             # Create one - this means our entity needs auto generated keys
             import time
@@ -44,8 +54,36 @@ class MemTable(Table[T]):
             entity.setkey(now)
         if validate:
             entity.validate()
-        self._entries[entity.getkey()] = entity
-        return entity
+        key = entity.getkey()
+        stored = self._entries.get(key, None)
+        if changed_fields is not None and stored is not None and stored is not entity:
+            # Only copy over the fields that have changed
+            for fieldname in changed_fields:
+                if fieldname in entity.__field_values__:
+                    stored.__field_values__[fieldname] = entity.__field_values__[fieldname]
+                elif fieldname in stored.__field_values__:
+                    del stored.__field_values__[fieldname]
+        else:
+            if key not in self._entries and self._index is not None:
+                self._add_to_index(key)
+            self._entries[key] = entity
+        return entity.mark_clean()
+
+    def _add_to_index(self, key):
+        encoded = key_encoder(self._entity_class).encode(key)
+        bisect.insort(self._index, encoded)
+        self._index_keys[encoded] = key
+
+    def _build_index(self):
+        encoder = key_encoder(self._entity_class)
+        self._index_keys = {encoder.encode(key): key for key in self._entries}
+        self._index = sorted(self._index_keys)
+
+    def _remove_from_index(self, key):
+        encoded = key_encoder(self._entity_class).encode(key)
+        index = bisect.bisect_left(self._index, encoded)
+        del self._index[index]
+        del self._index_keys[encoded]
 
     # Delete methods
     def delete_by_key(self, key : Key):
@@ -54,6 +92,25 @@ class MemTable(Table[T]):
             key = self._entity_class.Key(key)
         if key in self._entries:
             del self._entries[key]
+            if self._index is not None:
+                self._remove_from_index(key)
+
+    def scan(self, prefix = (), start = None, end = None, limit = None) -> List[T]:
+        if self._index is None:
+            self._build_index()
+        encoder = key_encoder(self._entity_class)
+        lo = encoder.encode_parts(prefix)
+        hi = prefix_end(lo) if prefix else None
+        if start is not None:
+            lo = max(lo, encoder.encode_parts(start))
+        if end is not None:
+            encoded_end = encoder.encode_parts(end)
+            hi = encoded_end if hi is None else min(hi, encoded_end)
+        first = bisect.bisect_left(self._index, lo)
+        last = len(self._index) if hi is None else bisect.bisect_left(self._index, hi)
+        if limit is not None:
+            last = min(last, first + limit)
+        return [self._entries[self._index_keys[encoded]] for encoded in self._index[first:last]]
 
     def fetch(self, query : Query[T]) -> List[T]:
         """ Queries the table for entries that match a certain conditions and then sorting (if required) and returns results in a particular window. """
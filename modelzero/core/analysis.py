@@ -0,0 +1,243 @@
+"""
+Structural analyses of expressions shared by the expression compilers and
+the optimizer.
+"""
+
+from ipdb import set_trace
+from modelzero.core import exprs
+from taggedunion import CaseMatcher, case
+
+class FreeVars(CaseMatcher):
+    """ Names of the variables an expression reads from its environment. """
+    __caseon__ = exprs.Expr
+
+    def __init__(self):
+        self._exprs = {}
+        self._funcs = {}
+
+    def __call__(self, expr):
+        key = id(expr)
+        if key not in self._exprs:
+            self._exprs[key] = (expr, frozenset(super().__call__(expr)))
+        return self._exprs[key][1]
+
+    def of_func(self, func):
+        key = id(func)
+        if key not in self._funcs:
+            self._funcs[key] = (func, frozenset())     # Recursive calls add nothing
+            body = func.body
+            names = set() if type(body) is exprs.Native else set(self(body)) - func.input_names
+            self._funcs[key] = (func, frozenset(names))
+        return self._funcs[key][1]
+
+    def union(self, *exprs_):
+        out = set()
+        for expr in exprs_: out.update(self(expr))
+        return out
+
+    @case("native")
+    def ofNative(self, native): return ()
+
+    @case("new")
+    def ofNew(self, new): return ()
+
+    @case("var")
+    def ofVar(self, var): return (var.name,)
+
+    @case("ref")
+    def ofRef(self, ref): return (ref.expr,) if ref.is_var else self(ref.expr)
+
+    @case("let")
+    def ofLet(self, let):
+        return self.union(*let.mappings.values()) | (self(let.body) - set(let.mappings.keys()))
+
+    @case("istype")
+    def ofIsType(self, istype):
+        out = self(istype.expr)
+        if issubclass(istype.type_or_expr.__class__, exprs.Expr):
+            out = out | self(istype.type_or_expr)
+        return out
+
+    @case("ifelse")
+    def ofIfElse(self, ifelse): return self.union(ifelse.cond, ifelse.exp1, ifelse.exp2)
+
+    @case("andexp")
+    def ofAnd(self, andexp): return self.union(*andexp.exprs)
+
+    @case("orexp")
+    def ofOr(self, orexp): return self.union(*orexp.exprs)
+
+    @case("notexp")
+    def ofNot(self, notexp): return self(notexp.expr)
+
+    @case("func")
+    def ofFunc(self, func): return self.of_func(func)
+
+    @case("fmap")
+    def ofFMap(self, fmap): return self.union(fmap.func_expr, fmap.src_expr)
+
+    @case("call")
+    def ofCall(self, call): return self.union(call.operator, *call.kwargs.values())
+
+    @case("getter")
+    def ofGetter(self, getter): return self(getter.src_expr)
+
+    @case("setter")
+    def ofSetter(self, setter): return self.union(setter.src_expr, *setter.keys_and_values.values())
+
+def child_exprs(expr):
+    """ The expressions directly under an expression (not function bodies). """
+    value = expr._variant_value
+    if expr.is_let: return list(value.mappings.values()) + [value.body]
+    if expr.is_istype:
+        return [value.expr] + ([value.type_or_expr] if issubclass(value.type_or_expr.__class__, exprs.Expr) else [])
+    if expr.is_ifelse: return [value.cond, value.exp1, value.exp2]
+    if expr.is_andexp or expr.is_orexp: return list(value.exprs)
+    if expr.is_notexp: return [value.expr]
+    if expr.is_fmap: return [value.func_expr, value.src_expr]
+    if expr.is_call: return [value.operator] + list(value.kwargs.values())
+    if expr.is_getter: return [value.src_expr]
+    if expr.is_setter: return [value.src_expr] + list(value.keys_and_values.values())
+    if expr.is_ref and not value.is_var: return [value.expr]
+    return []
+
+def with_children(expr, children):
+    """ Returns a copy of an expression with the given children (in the
+    order of child_exprs), or the expression itself if they are the same. """
+    current = child_exprs(expr)
+    if all(new is old for new, old in zip(children, current)):
+        return expr
+    value = expr._variant_value
+    if expr.is_let:
+        out = exprs.Expr.as_let(**dict(zip(value.mappings.keys(), children)))
+        out.let.set_body(children[-1])
+        return out
+    if expr.is_istype:
+        return exprs.Expr.as_istype(children[0], children[1] if len(children) > 1 else value.type_or_expr)
+    if expr.is_ifelse: return exprs.Expr.as_ifelse(*children)
+    if expr.is_andexp: return exprs.Expr.as_andexp(*children)
+    if expr.is_orexp: return exprs.Expr.as_orexp(*children)
+    if expr.is_notexp: return exprs.Expr.as_notexp(children[0])
+    if expr.is_fmap: return exprs.Expr.as_fmap(*children)
+    if expr.is_call: return exprs.Expr.as_call(children[0], **dict(zip(value.kwargs.keys(), children[1:])))
+    if expr.is_getter: return exprs.Expr.as_getter(children[0], value.key)
+    if expr.is_setter: return exprs.Expr.as_setter(children[0], **dict(zip(value.keys_and_values.keys(), children[1:])))
+    if expr.is_ref: return exprs.Expr.as_ref(children[0])
+    return expr
+
+def contains(expr, target):
+    """ Tells if target (the same object) occurs within expr. """
+    stack, seen = [expr], set()
+    while stack:
+        curr = stack.pop()
+        if curr is target: return True
+        if id(curr) in seen: continue
+        seen.add(id(curr))
+        stack.extend(child_exprs(curr))
+    return False
+
+def node_count(expr):
+    """ Number of nodes in an expression tree (shared nodes are counted
+    every time they occur as that is how often they are evaluated). """
+    counts = {}
+    def count(curr):
+        key = id(curr)
+        if key not in counts:
+            counts[key] = 1 + sum(count(child) for child in child_exprs(curr))
+        return counts[key]
+    return count(expr)
+
+def count_uses(expr, name):
+    """ Number of times a variable is read in an expression (not counting
+    reads of other variables with the same name bound inside it). """
+    counts = {}
+    def count(curr):
+        key = id(curr)
+        if key not in counts:
+            if curr.is_var:
+                counts[key] = 1 if curr.var.name == name else 0
+            elif curr.is_ref and curr.ref.is_var:
+                counts[key] = 1 if curr.ref.expr == name else 0
+            elif curr.is_let:
+                let = curr.let
+                total = sum(count(mapping) for mapping in let.mappings.values())
+                if name not in let.mappings:
+                    total += count(let.body)
+                counts[key] = total
+            else:
+                counts[key] = sum(count(child) for child in child_exprs(curr))
+        return counts[key]
+    return count(expr)
+
+def bound_names(expr):
+    """ Names of all variables bound by Lets within an expression. """
+    out, stack, seen = set(), [expr], set()
+    while stack:
+        curr = stack.pop()
+        if id(curr) in seen: continue
+        seen.add(id(curr))
+        if curr.is_let: out.update(curr.let.mappings.keys())
+        stack.extend(child_exprs(curr))
+    return out
+
+def called_funcs(expr):
+    """ Functions called (or mapped) within an expression. """
+    out, stack, seen = [], [expr], set()
+    while stack:
+        curr = stack.pop()
+        if id(curr) in seen: continue
+        seen.add(id(curr))
+        if curr.is_func: out.append(curr.func)
+        stack.extend(child_exprs(curr))
+    return out
+
+def is_pure(expr):
+    """ Tells if evaluating an expression has no effects, so it can be
+    moved or dropped without changing a query's result. """
+    if expr.is_native or expr.is_var or expr.is_new:
+        return True
+    if expr.is_getter or expr.is_notexp or expr.is_andexp or expr.is_orexp or expr.is_ifelse:
+        return all(is_pure(child) for child in child_exprs(expr))
+    if expr.is_istype:
+        return not issubclass(expr.istype.type_or_expr.__class__, exprs.Expr) and is_pure(expr.istype.expr)
+    if expr.is_call:
+        # Only native functions are annotated
+        operator = expr.call.operator
+        return operator.is_func and getattr(operator.func, "is_pure", False) and \
+                all(is_pure(value) for value in expr.call.kwargs.values())
+    return False
+
+LITERAL_TYPES = (str, int, float, bool, type(None))
+
+def structural_key(expr, memo = None):
+    """ A hashable key that is equal for expressions with the same structure
+    (and that refer to the same functions, types and non literal values). """
+    memo = {} if memo is None else memo
+    def key_of(curr):
+        key = memo.get(id(curr), None)
+        if key is not None: return key[1]
+        value = curr._variant_value
+        if curr.is_native:
+            literal = type(value.value) in LITERAL_TYPES
+            key = ("native", type(value.value), value.value if literal else id(value.value))
+        elif curr.is_var:
+            key = ("var", value.name)
+        elif curr.is_func:
+            key = ("func", id(value))
+        elif curr.is_getter:
+            key = ("getter", key_of(value.src_expr), value.key)
+        elif curr.is_call:
+            key = ("call", key_of(value.operator),
+                   tuple(sorted((name, key_of(arg)) for name, arg in value.kwargs.items())))
+        elif curr.is_istype:
+            target = value.type_or_expr
+            target = key_of(target) if issubclass(target.__class__, exprs.Expr) else id(target)
+            key = ("istype", key_of(value.expr), target)
+        elif curr.is_notexp or curr.is_andexp or curr.is_orexp or curr.is_ifelse or curr.is_fmap:
+            key = (type(value).__name__,) + tuple(key_of(child) for child in child_exprs(curr))
+        else:
+            # New records, Lets, Setters and Refs are never the same as another
+            key = ("unique", id(curr))
+        memo[id(curr)] = (curr, key)
+        return key
+    return key_of(expr)
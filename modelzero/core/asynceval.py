@@ -0,0 +1,149 @@
+"""
+Evaluates expressions with asyncio so independent calls run concurrently.
+
+Native functions may be coroutine functions (async def), eg ones that do
+I/O.  AsyncEval awaits the values of a Setter (the sibling selectors of a
+query), the arguments of a Call, the bindings of a Let and the iterations of
+an FMap together with asyncio.gather.  Everything else is evaluated in the
+same order as DFSEval: conditions before branches, And/Or short circuit and
+a function body only after its arguments.
+
+    result = await AsyncEval()(query.body, env.DefaultEnv())     # a Native
+    result = asyncio.run(AsyncEval()(query.body, env.DefaultEnv()))
+
+Plain native functions are called as is (and block the event loop while
+they run).  Since siblings are evaluated concurrently, a Setter only
+updates its record after the record and all its values are evaluated.
+"""
+
+from ipdb import set_trace
+import asyncio, inspect
+from typing import Dict
+from modelzero.core import exprs
+from modelzero.core.evals import ensure_native, NativeNone
+from taggedunion import CaseMatcher, case
+
+class AsyncEval(CaseMatcher):
+    """ An evaluator whose cases are coroutines. """
+    __caseon__ = exprs.Expr
+
+    async def gather(self, exprs_and_envs):
+        """ Evaluates (expr, env) pairs concurrently and returns their values. """
+        return await asyncio.gather(*[self(expr, env) for expr, env in exprs_and_envs])
+
+    @case("let")
+    async def valueOfLet(self, let: exprs.Let, env) -> exprs.Native:
+        names = list(let.mappings.keys())
+        values = await self.gather((let.mappings[name], env) for name in names)
+        return await self(let.body, env.extend(**dict(zip(names, values))))
+
+    @case("istype")
+    async def execIsType(self, istype: exprs.IsType, env) -> exprs.Native:
+        result = await self(istype.expr, env)
+        target_type = istype.type_or_expr
+        if issubclass(target_type.__class__, exprs.Expr):
+            target_type = await self(target_type, env)
+        return ensure_native(result.matches_type(target_type))
+
+    @case("var")
+    async def execVar(self, var: exprs.Var, env) -> exprs.Native:
+        return ensure_native(env.get(var.name))
+
+    @case("ref")
+    async def execRef(self, ref: exprs.Ref, env) -> exprs.Native:
+        if not ref.is_var:
+            return self.__caseon__.as_ref(await self(ref.expr, env)).ref
+        return ref
+
+    @case("native")
+    async def execNative(self, native: exprs.Native, env) -> exprs.Native:
+        return native
+
+    @case("ifelse")
+    async def execIfElse(self, ifelse: exprs.IfElse, env) -> exprs.Native:
+        result = await self(ifelse.cond, env)
+        return await self(ifelse.exp1 if result.value else ifelse.exp2, env)
+
+    @case("andexp")
+    async def execAndExpr(self, andexp: exprs.And, env) -> exprs.Native:
+        for expr in andexp.exprs:
+            result = await self(expr, env)
+            if not result.value: return ensure_native(False)
+        return ensure_native(True)
+
+    @case("orexp")
+    async def execOrExpr(self, orexp: exprs.Or, env) -> exprs.Native:
+        for expr in orexp.exprs:
+            result = await self(expr, env)
+            if result.value: return ensure_native(True)
+        return ensure_native(False)
+
+    @case("notexp")
+    async def execNotExpr(self, notexp: exprs.Not, env) -> exprs.Native:
+        result = await self(notexp.expr, env)
+        return ensure_native(not result.value)
+
+    @case("new")
+    async def execNew(self, new: exprs.New, env) -> exprs.Native:
+        return ensure_native(new.obj_type.record_class())
+
+    @case("func")
+    async def execFunc(self, func: exprs.Func, env) -> exprs.Native:
+        return func.bind(env)
+
+    @case("fmap")
+    async def execFMap(self, fmap, env) -> exprs.Native:
+        assert len(fmap.func_expr.func.input_names) == 1
+        boundfunc = await self(fmap.func_expr, env)
+        src = await self(fmap.src_expr, env)
+        param = list(fmap.func_expr.func.input_names)[0]
+        results = await asyncio.gather(*[self.apply_proc(boundfunc, {param: ensure_native(item)})
+                                         for item in src.value])
+        return ensure_native([result.value for result in results])
+
+    @case("getter")
+    async def execGetter(self, getter: exprs.Getter, env) -> exprs.Native:
+        src = await self(getter.src_expr, env)
+        if src is None or src.value is None:
+            return NativeNone
+        return ensure_native(getattr(src.value, getter.key))
+
+    @case("setter")
+    async def execSetter(self, setter: exprs.Setter, env) -> exprs.Native:
+        # Chained setters (as built by selects) are evaluated concurrently too
+        keys = list(setter.keys_and_values.keys())
+        src, *values = await self.gather([(setter.src_expr, env)] +
+                                         [(setter.keys_and_values[key], env) for key in keys])
+        if src is not None:
+            for key, result in zip(keys, values):
+                if result.value is None:
+                    delattr(src.value, key)
+                else:
+                    setattr(src.value, key, result.value)
+        return src
+
+    @case("call")
+    async def execCall(self, call: exprs.Call, env) -> exprs.Native:
+        boundfunc = await self(call.operator, env)
+        names = list(call.kwargs.keys())
+        values = await self.gather((call.kwargs[name], env) for name in names)
+        return await self.apply_proc(boundfunc, dict(zip(names, values)))
+
+    async def apply_proc(self, boundfunc : exprs.Function.BoundFunc, kwargs: Dict[str, exprs.Native]) -> exprs.Native:
+        curr_func, curr_env = boundfunc.func, boundfunc.env
+        new_args = {}
+        for input in curr_func.input_names:
+            if input in kwargs:
+                new_args[input] = kwargs[input]
+            elif curr_func.has_default_value(input):
+                new_args[input] = ensure_native(curr_func.get_default_value(input))
+            else:
+                raise Exception(f"Value for arg '{input}' in function '{curr_func.fqn}' not found")
+
+        if type(curr_func.body) is exprs.Native:
+            new_args = {k:native.value for k,native in new_args.items()}
+            result = curr_func.body.value(**new_args)
+            if inspect.isawaitable(result):
+                result = await result
+            return ensure_native(result)
+        return await self(curr_func.body, curr_env.extend(**new_args))
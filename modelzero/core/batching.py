@@ -0,0 +1,244 @@
+"""
+Evaluates expressions while batching calls to native functions.
+
+DFSEval calls a native function as soon as it reaches a call, so a query
+that FMaps over a list of friends calls (say) GetProfilePic once per
+friend.  A NativeFunc can also declare a batch implementation that takes a
+list of argument dicts and returns the list of their results:
+
+    def get_profile_pics(args_list):
+        return datastore.fetch_pics([args["id"] for args in args_list])
+
+    GetProfilePic = NativeFunc(get_profile_pic, batch = get_profile_pics)
+
+BatchEval evaluates the iterations of an FMap, the values of a Setter (the
+sibling selectors of a query) and the arguments of a Call and the bindings
+of a Let concurrently as tasks.  A call to a function with a batch
+implementation suspends its task.  Once no task can make progress, every
+function with pending calls is dispatched once with all of them and the
+results are fanned back out to the waiting tasks.  Functions without a
+batch implementation are called immediately, as in DFSEval.
+
+    result = BatchEval()(query.body, env.DefaultEnv())      # a Native
+
+Since siblings are evaluated concurrently, a Setter only updates its record
+after the record and all its values are evaluated.
+"""
+
+from ipdb import set_trace
+from collections import deque
+from typing import Dict, List
+from modelzero.core import exprs
+from modelzero.core.evals import ensure_native, NativeNone
+from taggedunion import CaseMatcher, case
+
+class Load(object):
+    """ A pending call to a function with a batch implementation. """
+    def __init__(self, func : exprs.NativeFunc, kwargs : Dict):
+        self.func = func
+        self.kwargs = kwargs
+
+class Gather(object):
+    """ Evaluates a list of task generators concurrently. """
+    def __init__(self, tasks : List):
+        self.tasks = tasks
+
+class Task(object):
+    def __init__(self, gen, parent = None, index = 0):
+        self.gen = gen
+        self.parent = parent
+        self.index = index
+        self.results = None
+        self.remaining = 0
+
+class BatchEval(CaseMatcher):
+    """ An evaluator that batches calls to native functions. """
+    __caseon__ = exprs.Expr
+
+    def __init__(self):
+        self.stats = dict(calls = 0, batches = 0)
+
+    def __call__(self, expr, env) -> exprs.Native:
+        return self.run(self.visit(exprs.ensure_expr(expr), env))
+
+    def visit(self, expr, env):
+        """ Returns the task (a generator) evaluating expr in env. """
+        return CaseMatcher.__call__(self, expr, env)
+
+    def run(self, gen):
+        """ Runs a task (and all the tasks it gathers) to completion. """
+        root = Task(gen)
+        ready = deque([(root, None)])
+        pending : Dict[int, List] = {}
+        result = None
+        while ready or pending:
+            while ready:
+                task, value = ready.popleft()
+                try:
+                    request = task.gen.send(value)
+                except StopIteration as stop:
+                    parent = task.parent
+                    if parent is None:
+                        result = stop.value
+                        continue
+                    parent.results[task.index] = stop.value
+                    parent.remaining -= 1
+                    if parent.remaining == 0:
+                        ready.append((parent, parent.results))
+                    continue
+                if type(request) is Gather:
+                    if not request.tasks:
+                        ready.append((task, []))
+                        continue
+                    task.results = [None] * len(request.tasks)
+                    task.remaining = len(request.tasks)
+                    for index, gen in enumerate(request.tasks):
+                        ready.append((Task(gen, task, index), None))
+                else:
+                    key = id(request.func)
+                    if key not in pending: pending[key] = (request.func, [])
+                    pending[key][1].append((task, request.kwargs))
+            for func, loads in pending.values():
+                ready.extend(zip([task for task,_ in loads], self.dispatch(func, [kwargs for _,kwargs in loads])))
+            pending = {}
+        return result
+
+    def dispatch(self, func : exprs.NativeFunc, args_list : List[Dict]) -> List:
+        self.stats["batches"] += 1
+        self.stats["calls"] += len(args_list)
+        results = list(func.batch_func(args_list))
+        if len(results) != len(args_list):
+            raise Exception(f"Batch of '{func.fqn}' returned {len(results)} results for {len(args_list)} calls")
+        return results
+
+    def gather(self, exprs_and_envs):
+        """ Evaluates (expr, env) pairs concurrently and returns their values. """
+        values = yield Gather([self.visit(expr, env) for expr, env in exprs_and_envs])
+        return values
+
+    @case("let")
+    def valueOfLet(self, let: exprs.Let, env) -> exprs.Native:
+        names = list(let.mappings.keys())
+        values = yield from self.gather((let.mappings[name], env) for name in names)
+        result = yield from self.visit(let.body, env.extend(**dict(zip(names, values))))
+        return result
+
+    @case("istype")
+    def execIsType(self, istype: exprs.IsType, env) -> exprs.Native:
+        result = yield from self.visit(istype.expr, env)
+        target_type = istype.type_or_expr
+        if issubclass(target_type.__class__, exprs.Expr):
+            target_type = yield from self.visit(target_type, env)
+        return ensure_native(result.matches_type(target_type))
+
+    @case("var")
+    def execVar(self, var: exprs.Var, env) -> exprs.Native:
+        return ensure_native(env.get(var.name))
+        yield
+
+    @case("ref")
+    def execRef(self, ref: exprs.Ref, env) -> exprs.Native:
+        if not ref.is_var:
+            value = yield from self.visit(ref.expr, env)
+            return self.__caseon__.as_ref(value).ref
+        return ref
+
+    @case("native")
+    def execNative(self, native: exprs.Native, env) -> exprs.Native:
+        return native
+        yield
+
+    @case("ifelse")
+    def execIfElse(self, ifelse: exprs.IfElse, env) -> exprs.Native:
+        result = yield from self.visit(ifelse.cond, env)
+        value = yield from self.visit(ifelse.exp1 if result.value else ifelse.exp2, env)
+        return value
+
+    @case("andexp")
+    def execAndExpr(self, andexp: exprs.And, env) -> exprs.Native:
+        for expr in andexp.exprs:
+            result = yield from self.visit(expr, env)
+            if not result.value: return ensure_native(False)
+        return ensure_native(True)
+
+    @case("orexp")
+    def execOrExpr(self, orexp: exprs.Or, env) -> exprs.Native:
+        for expr in orexp.exprs:
+            result = yield from self.visit(expr, env)
+            if result.value: return ensure_native(True)
+        return ensure_native(False)
+
+    @case("notexp")
+    def execNotExpr(self, notexp: exprs.Not, env) -> exprs.Native:
+        result = yield from self.visit(notexp.expr, env)
+        return ensure_native(not result.value)
+
+    @case("new")
+    def execNew(self, new: exprs.New, env) -> exprs.Native:
+        return ensure_native(new.obj_type.record_class())
+        yield
+
+    @case("func")
+    def execFunc(self, func: exprs.Func, env) -> exprs.Native:
+        return func.bind(env)
+        yield
+
+    @case("fmap")
+    def execFMap(self, fmap, env) -> exprs.Native:
+        assert len(fmap.func_expr.func.input_names) == 1
+        boundfunc = yield from self.visit(fmap.func_expr, env)
+        src = yield from self.visit(fmap.src_expr, env)
+        param = list(fmap.func_expr.func.input_names)[0]
+        results = yield Gather([self.apply_proc(boundfunc, {param: ensure_native(item)})
+                                for item in src.value])
+        return ensure_native([result.value for result in results])
+
+    @case("getter")
+    def execGetter(self, getter: exprs.Getter, env) -> exprs.Native:
+        src = yield from self.visit(getter.src_expr, env)
+        if src is None or src.value is None:
+            return NativeNone
+        return ensure_native(getattr(src.value, getter.key))
+
+    @case("setter")
+    def execSetter(self, setter: exprs.Setter, env) -> exprs.Native:
+        # Chained setters (as built by selects) are evaluated concurrently too
+        keys = list(setter.keys_and_values.keys())
+        src, *values = yield from self.gather([(setter.src_expr, env)] +
+                                              [(setter.keys_and_values[key], env) for key in keys])
+        if src is not None:
+            for key, result in zip(keys, values):
+                if result.value is None:
+                    delattr(src.value, key)
+                else:
+                    setattr(src.value, key, result.value)
+        return src
+
+    @case("call")
+    def execCall(self, call: exprs.Call, env) -> exprs.Native:
+        boundfunc = yield from self.visit(call.operator, env)
+        names = list(call.kwargs.keys())
+        values = yield from self.gather((call.kwargs[name], env) for name in names)
+        result = yield from self.apply_proc(boundfunc, dict(zip(names, values)))
+        return result
+
+    def apply_proc(self, boundfunc : exprs.Function.BoundFunc, kwargs: Dict[str, exprs.Native]):
+        curr_func, curr_env = boundfunc.func, boundfunc.env
+        new_args = {}
+        for input in curr_func.input_names:
+            if input in kwargs:
+                new_args[input] = kwargs[input]
+            elif curr_func.has_default_value(input):
+                new_args[input] = ensure_native(curr_func.get_default_value(input))
+            else:
+                raise Exception(f"Value for arg '{input}' in function '{curr_func.fqn}' not found")
+
+        if type(curr_func.body) is exprs.Native:
+            new_args = {k:native.value for k,native in new_args.items()}
+            if getattr(curr_func, "batch_func", None) is not None:
+                result = yield Load(curr_func, new_args)
+            else:
+                result = curr_func.body.value(**new_args)
+            return ensure_native(result)
+        result = yield from self.visit(curr_func.body, curr_env.extend(**new_args))
+        return result
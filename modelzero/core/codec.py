@@ -0,0 +1,508 @@
+"""
+A schema driven binary codec for records.
+
+Values are encoded by walking the record's RecordMetadata and the Type of
+each of its fields so nothing but the values themselves end up in the
+output - no field names or type tags.  For every record class (and every
+other type that is encoded at the top level) a plan of encoder/decoder
+functions is built once and reused.
+
+Top level encodings start with a fingerprint of the schema they were
+written with.  Decoding with a schema that has since changed raises
+errors.SchemaMismatch instead of returning garbage.
+
+Values that are stored (eg in SQL columns) outlive the schema they were
+written with so they are encoded with encode_named instead: every value
+carries a tag and record fields are stored by name, so they can be decoded
+after fields are added to or removed from their records.
+"""
+
+from ipdb import set_trace
+import datetime, hashlib, struct
+from modelzero.core import errors
+from modelzero.core.records import RecordMetadata, RecordBase
+from modelzero.core.types import Type, MZTypes
+
+VERSION = 1
+NAMED_VERSION = 2
+FINGERPRINT_SIZE = 8
+
+_epoch = datetime.datetime(1970, 1, 1)
+_utc = datetime.timezone.utc
+_double = struct.Struct("<d")
+
+def encode(record) -> bytes:
+    """ Encodes a record along with the fingerprint of its class. """
+    plan = plan_for_record(record.__class__)
+    out = bytearray(plan.header)
+    plan.encode(record, out)
+    return bytes(out)
+
+def decode(data : bytes, record_class):
+    """ Decodes a record of the given class encoded with encode. """
+    plan = plan_for_record(record_class)
+    value, pos = plan.decode(memoryview(data), _check_header(data, plan))
+    return value
+
+def encode_value(value, thetype) -> bytes:
+    """ Encodes a value of any encodable type (eg a List[...] field's value). """
+    plan = plan_for_type(thetype)
+    out = bytearray(plan.header)
+    plan.encode(value, out)
+    return bytes(out)
+
+def decode_value(data : bytes, thetype):
+    plan = plan_for_type(thetype)
+    value, pos = plan.decode(memoryview(data), _check_header(data, plan))
+    return value
+
+def encode_named(value) -> bytes:
+    """ Encodes a value with tags and record fields by name instead of a
+    schema fingerprint.  Larger and slower than encode_value, but it can
+    still be decoded after the schemas of its records change. """
+    out = bytearray([NAMED_VERSION])
+    encode_any(value, out)
+    return bytes(out)
+
+def decode_named(data : bytes, thetype):
+    """ Decodes a value encoded with encode_named (or encode_value) as a
+    value of thetype.  Fields its records no longer have are dropped and
+    fields they have gained are left unset. """
+    if data[:1] == bytes([VERSION]):
+        return decode_value(data, thetype)
+    if data[:1] != bytes([NAMED_VERSION]):
+        raise errors.SchemaMismatch(f"Unsupported encoding version: {data[0] if data else None}")
+    value, pos = decode_any(memoryview(data), 1)
+    return from_named(value, thetype)
+
+def from_named(value, thetype):
+    """ Converts a value decoded by decode_any (where records are dicts of
+    field values by name) to a value of thetype. """
+    if value is None:
+        return None
+    if thetype.is_type_ref:
+        return from_named(value, thetype.target)
+    if thetype.is_optional_type:
+        return from_named(value, thetype.optional_type.base_type)
+    if thetype.is_record_type and type(value) is dict:
+        from modelzero.core.entities import KEY_FIELD
+        record_class = thetype.record_class
+        rmeta = record_class.__record_metadata__
+        values = {name: from_named(fvalue, rmeta[name].logical_type)
+                  for name, fvalue in value.items() if name in rmeta}
+        out = record_class.from_values(values)
+        if KEY_FIELD in value and _has_auto_key(record_class):
+            object.__setattr__(out, KEY_FIELD, value[KEY_FIELD])
+        return out
+    if thetype.is_type_app:
+        type_app = thetype.type_app
+        if type_app.origin_type == MZTypes.List:
+            return [from_named(item, type_app.type_args[0]) for item in value]
+        if type_app.origin_type == MZTypes.Map:
+            key_type, value_type = type_app.type_args
+            return {from_named(k, key_type): from_named(v, value_type) for k,v in value.items()}
+    return value
+
+def fingerprint(record_class_or_type) -> bytes:
+    """ A short hash of everything about a schema that affects its encoding. """
+    thetype = record_class_or_type
+    if type(thetype) is not Type:
+        thetype = Type.as_record_type(thetype)
+    desc = describe(thetype).encode("utf-8")
+    return hashlib.sha1(desc).digest()[:FINGERPRINT_SIZE]
+
+def describe(thetype, seen = None) -> str:
+    """ Canonical description of a type's encoding that the fingerprint is derived from. """
+    seen = seen if seen is not None else set()
+    if thetype.is_type_ref:
+        return describe(thetype.target, seen)
+    if thetype.is_optional_type:
+        return "?" + describe(thetype.optional_type.base_type, seen)
+    if thetype.is_opaque_type:
+        return thetype.opaque_type.name
+    if thetype.is_type_app:
+        type_app = thetype.type_app
+        if type_app.origin_type == MZTypes.Key:
+            return "key(%s)" % _key_class(type_app).__fqn__
+        args = ",".join(describe(arg, seen) for arg in type_app.type_args)
+        return "%s(%s)" % (describe(type_app.origin_type, seen), args)
+    if thetype.is_record_type:
+        record_class = thetype.record_class
+        if record_class in seen:
+            return "@" + record_class.__fqn__
+        seen.add(record_class)
+        fields = ",".join("%s:%s" % (name, describe(field.logical_type, seen))
+                          for name,field in record_class.__record_metadata__.items())
+        key = "#" if _has_auto_key(record_class) else ""
+        return "%s%s{%s}" % (record_class.__fqn__, key, fields)
+    raise TypeError(f"Type cannot be encoded: {thetype}")
+
+class Plan(object):
+    """ How values of a type are encoded and decoded.
+
+    encode(value, out) appends the encoding of value to the bytearray out.
+    decode(buf, pos) returns the value at pos in buf and the position after it.
+    """
+    def __init__(self, encode, decode, header = b""):
+        self.encode = encode
+        self.decode = decode
+        self.header = header
+
+_plans = {}
+_plans_generation = -1
+
+def plan_for_record(record_class) -> Plan:
+    return _plan(record_class, lambda: Type.as_record_type(record_class))
+
+def plan_for_type(thetype) -> Plan:
+    if thetype.is_record_type:
+        return plan_for_record(thetype.record_class)
+    return _plan(("type", describe(thetype)), lambda: thetype)
+
+def _plan(cachekey, get_type):
+    global _plans_generation
+    if _plans_generation != RecordMetadata.generation:
+        # Some record's fields changed so all plans (and fingerprints) have to be rebuilt
+        _plans.clear()
+        _plans_generation = RecordMetadata.generation
+    plan = _plans.get(cachekey, None)
+    if plan is None:
+        thetype = get_type()
+        encoder, decoder = PlanBuilder()(thetype)
+        header = bytes([VERSION]) + fingerprint(thetype)
+        plan = _plans[cachekey] = Plan(encoder, decoder, header)
+    return plan
+
+def _check_header(data, plan):
+    header = plan.header
+    if data[:len(header)] != header:
+        if data[:1] != header[:1]:
+            raise errors.SchemaMismatch(f"Unsupported encoding version: {data[0] if data else None}")
+        raise errors.SchemaMismatch("Data was encoded with a different schema")
+    return len(header)
+
+class PlanBuilder(object):
+    """ Builds the encoder and decoder functions for a type. """
+    def __init__(self):
+        # Record classes whose plans are being built - for recursive records
+        self._building = {}
+
+    def __call__(self, thetype):
+        if thetype.is_type_ref:
+            return self(thetype.target)
+        if thetype.is_optional_type:
+            return self.for_optional(thetype.optional_type.base_type)
+        if thetype.is_opaque_type:
+            return self.for_opaque(thetype)
+        if thetype.is_type_app:
+            return self.for_type_app(thetype.type_app)
+        if thetype.is_record_type:
+            return self.for_record(thetype.record_class)
+        raise TypeError(f"Type cannot be encoded: {thetype}")
+
+    def for_optional(self, base_type):
+        encoder, decoder = self(base_type)
+        def encode_optional(value, out):
+            if value is None:
+                out.append(0)
+            else:
+                out.append(1)
+                encoder(value, out)
+        def decode_optional(buf, pos):
+            if buf[pos] == 0: return None, pos + 1
+            return decoder(buf, pos + 1)
+        return encode_optional, decode_optional
+
+    def for_opaque(self, thetype):
+        if thetype == MZTypes.Bool: return encode_bool, decode_bool
+        if thetype == MZTypes.Int or thetype == MZTypes.Long: return encode_int, decode_int
+        if thetype == MZTypes.Float or thetype == MZTypes.Double: return encode_float, decode_float
+        if thetype == MZTypes.String or thetype == MZTypes.URL: return encode_str, decode_str
+        if thetype == MZTypes.Bytes: return encode_bytes, decode_bytes
+        if thetype == MZTypes.DateTime: return encode_datetime, decode_datetime
+        # Untyped containers and keys
+        return encode_any, decode_any
+
+    def for_type_app(self, type_app):
+        origin_type = type_app.origin_type
+        if origin_type == MZTypes.List:
+            return self.for_list(type_app.type_args[0])
+        if origin_type == MZTypes.Map:
+            return self.for_map(type_app.type_args[0], type_app.type_args[1])
+        if origin_type == MZTypes.Key:
+            return self.for_key(type_app)
+        raise TypeError(f"Generic type cannot be encoded: {origin_type}")
+
+    def for_list(self, child_type):
+        encoder, decoder = self(child_type)
+        def encode_list(value, out):
+            encode_uint(len(value), out)
+            for item in value: encoder(item, out)
+        def decode_list(buf, pos):
+            count, pos = decode_uint(buf, pos)
+            out = []
+            for i in range(count):
+                item, pos = decoder(buf, pos)
+                out.append(item)
+            return out, pos
+        return encode_list, decode_list
+
+    def for_map(self, key_type, value_type):
+        key_encoder, key_decoder = self(key_type)
+        value_encoder, value_decoder = self(value_type)
+        def encode_map(value, out):
+            encode_uint(len(value), out)
+            for k,v in value.items():
+                key_encoder(k, out)
+                value_encoder(v, out)
+        def decode_map(buf, pos):
+            count, pos = decode_uint(buf, pos)
+            out = {}
+            for i in range(count):
+                k, pos = key_decoder(buf, pos)
+                out[k], pos = value_decoder(buf, pos)
+            return out, pos
+        return encode_map, decode_map
+
+    def for_key(self, type_app):
+        from modelzero.core.entities import Key
+        key_class = []
+        def entity_class():
+            # Resolved on first use as key targets are often not defined yet
+            if not key_class: key_class.append(_key_class(type_app))
+            return key_class[0]
+        def encode_key(value, out):
+            if type(value) is not Key:
+                # Fields can also hold the raw value of a key
+                out.append(0)
+                encode_any(value, out)
+                return
+            encode_uint(len(value.parts), out)
+            for part in value.parts: encode_any(part, out)
+        def decode_key(buf, pos):
+            count, pos = decode_uint(buf, pos)
+            if count == 0: return decode_any(buf, pos)
+            parts = []
+            for i in range(count):
+                part, pos = decode_any(buf, pos)
+                parts.append(part)
+            # Parts were validated before they were encoded
+            return Key.from_parts(entity_class(), parts), pos
+        return encode_key, decode_key
+
+    def for_record(self, record_class):
+        # Nested and recursive references to a record share the one plan
+        # which is only complete once the outermost call returns
+        if record_class in self._building:
+            plan = self._building[record_class]
+            return (lambda value, out: plan[0](value, out)), (lambda buf, pos: plan[1](buf, pos))
+        plan = self._building[record_class] = [None, None]
+
+        from modelzero.core.entities import KEY_FIELD
+        fields = [(name,) + self(field.logical_type) for name,field in record_class.__record_metadata__.items()]
+        has_key = _has_auto_key(record_class)
+        nbytes = (len(fields) + 7) // 8
+
+        def encode_record(record, out):
+            values = record.__field_values__
+            # Presence bitmap of the fields that are set
+            start = len(out)
+            out.extend(bytes(nbytes))
+            for i,(name, encoder, decoder) in enumerate(fields):
+                if name in values:
+                    out[start + (i >> 3)] |= 1 << (i & 7)
+                    encoder(values[name], out)
+            if has_key: encode_any(getattr(record, KEY_FIELD), out)
+
+        def decode_record(buf, pos):
+            bitmap = buf[pos:pos + nbytes]
+            pos += nbytes
+            values = {}
+            for i,(name, encoder, decoder) in enumerate(fields):
+                if bitmap[i >> 3] & (1 << (i & 7)):
+                    values[name], pos = decoder(buf, pos)
+            # Values were validated when encoded so set them directly
+            out = record_class.from_values(values)
+            if has_key:
+                key, pos = decode_any(buf, pos)
+                object.__setattr__(out, KEY_FIELD, key)
+            return out, pos
+
+        plan[0], plan[1] = encode_record, decode_record
+        del self._building[record_class]
+        return encode_record, decode_record
+
+def _has_auto_key(record_class):
+    """ Entities without key fields carry their key outside of their fields. """
+    return hasattr(record_class, "key_fields") and not record_class.key_fields()
+
+def _key_class(type_app):
+    typearg = type_app.type_args[0]
+    if typearg.is_type_ref:
+        typearg = typearg.target
+    return typearg.record_class
+
+# Encoders for opaque values
+
+def encode_uint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_uint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80: return result, pos
+        shift += 7
+
+def encode_int(value, out):
+    # Zigzag so small negative numbers stay small
+    encode_uint(value << 1 if value >= 0 else ((-value) << 1) - 1, out)
+
+def decode_int(buf, pos):
+    value, pos = decode_uint(buf, pos)
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+
+def encode_bool(value, out):
+    out.append(1 if value else 0)
+
+def decode_bool(buf, pos):
+    return buf[pos] != 0, pos + 1
+
+def encode_float(value, out):
+    out.extend(_double.pack(value))
+
+def decode_float(buf, pos):
+    return _double.unpack_from(buf, pos)[0], pos + 8
+
+def encode_bytes(value, out):
+    encode_uint(len(value), out)
+    out.extend(value)
+
+def decode_bytes(buf, pos):
+    size, pos = decode_uint(buf, pos)
+    return bytes(buf[pos:pos + size]), pos + size
+
+def encode_str(value, out):
+    encode_bytes(value.encode("utf-8"), out)
+
+def decode_str(buf, pos):
+    size, pos = decode_uint(buf, pos)
+    return str(buf[pos:pos + size], "utf-8"), pos + size
+
+def encode_datetime(value, out):
+    # Naive datetimes in UTC as microseconds since the epoch
+    if value.tzinfo is not None:
+        value = value.astimezone(_utc).replace(tzinfo = None)
+    delta = value - _epoch
+    encode_int((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds, out)
+
+def decode_datetime(buf, pos):
+    micros, pos = decode_int(buf, pos)
+    return _epoch + datetime.timedelta(microseconds = micros), pos
+
+# Values whose type is not known from the schema (eg keys, untyped lists)
+# carry a tag saying what they are.
+
+TAG_NONE, TAG_FALSE, TAG_TRUE, TAG_INT, TAG_FLOAT, TAG_STR, TAG_BYTES, TAG_DATETIME, TAG_LIST, TAG_MAP, TAG_KEY, TAG_RECORD = range(12)
+
+def encode_any(value, out):
+    T = type(value)
+    if value is None: out.append(TAG_NONE)
+    elif T is bool: out.append(TAG_TRUE if value else TAG_FALSE)
+    elif T is int:
+        out.append(TAG_INT)
+        encode_int(value, out)
+    elif T is float:
+        out.append(TAG_FLOAT)
+        encode_float(value, out)
+    elif T is str:
+        out.append(TAG_STR)
+        encode_str(value, out)
+    elif T is bytes:
+        out.append(TAG_BYTES)
+        encode_bytes(value, out)
+    elif T is datetime.datetime:
+        out.append(TAG_DATETIME)
+        encode_datetime(value, out)
+    elif T in (list, tuple):
+        out.append(TAG_LIST)
+        encode_uint(len(value), out)
+        for item in value: encode_any(item, out)
+    elif T is dict:
+        out.append(TAG_MAP)
+        encode_uint(len(value), out)
+        for k,v in value.items():
+            encode_any(k, out)
+            encode_any(v, out)
+    elif hasattr(value, "entity_class") and hasattr(value, "parts"):
+        out.append(TAG_KEY)
+        encode_str(value.entity_class.__fqn__, out)
+        encode_any(list(value.parts), out)
+    elif isinstance(value, RecordBase):
+        # Fields by name (see encode_named)
+        from modelzero.core.entities import KEY_FIELD
+        values = value.__field_values__
+        has_key = _has_auto_key(value.__class__)
+        out.append(TAG_RECORD)
+        encode_uint(len(values) + (1 if has_key else 0), out)
+        for name in values:
+            encode_str(name, out)
+            encode_any(values[name], out)
+        if has_key:
+            encode_str(KEY_FIELD, out)
+            encode_any(getattr(value, KEY_FIELD), out)
+    else:
+        raise TypeError(f"Value of type {T} cannot be encoded")
+
+def decode_any(buf, pos):
+    tag = buf[pos]
+    pos += 1
+    if tag == TAG_NONE: return None, pos
+    if tag == TAG_FALSE: return False, pos
+    if tag == TAG_TRUE: return True, pos
+    if tag == TAG_INT: return decode_int(buf, pos)
+    if tag == TAG_FLOAT: return decode_float(buf, pos)
+    if tag == TAG_STR: return decode_str(buf, pos)
+    if tag == TAG_BYTES: return decode_bytes(buf, pos)
+    if tag == TAG_DATETIME: return decode_datetime(buf, pos)
+    if tag == TAG_LIST:
+        count, pos = decode_uint(buf, pos)
+        out = []
+        for i in range(count):
+            item, pos = decode_any(buf, pos)
+            out.append(item)
+        return out, pos
+    if tag == TAG_MAP:
+        count, pos = decode_uint(buf, pos)
+        out = {}
+        for i in range(count):
+            k, pos = decode_any(buf, pos)
+            out[k], pos = decode_any(buf, pos)
+        return out, pos
+    if tag == TAG_RECORD:
+        # Field values by name, see from_named
+        count, pos = decode_uint(buf, pos)
+        out = {}
+        for i in range(count):
+            name, pos = decode_str(buf, pos)
+            out[name], pos = decode_any(buf, pos)
+        return out, pos
+    if tag == TAG_KEY:
+        from modelzero.core.entities import Key
+        from modelzero.utils import resolve_fqn
+        fqn, pos = decode_str(buf, pos)
+        parts, pos = decode_any(buf, pos)
+        try:
+            if "." not in fqn: raise ImportError(fqn)
+            resolved, entity_class = resolve_fqn(fqn)
+        except (ImportError, AttributeError, ValueError):
+            resolved = False
+        if not resolved:
+            raise errors.SchemaMismatch(f"Key refers to an unknown entity class: {fqn}")
+        return Key.from_parts(entity_class, parts), pos
+    raise errors.SchemaMismatch(f"Invalid value tag: {tag}")
@@ -0,0 +1,256 @@
+import itertools, keyword, linecache
+
+_counter = itertools.count()
+
+def is_name(name):
+    """ Whether a (field) name can be used as is in generated source, ie is
+    an identifier and not a keyword like "class". """
+    return name.isidentifier() and not keyword.iskeyword(name)
+
+class Source(object):
+    """ A small builder for python source that is compiled at runtime. """
+    def __init__(self, name):
+        self.name = name
+        self.lines = []
+        self.level = 0
+        self.consts = {}
+
+    def const(self, value, prefix = "_c"):
+        """ Makes a value available to the compiled code and returns the name it is bound to. """
+        for name, existing in self.consts.items():
+            if existing is value: return name
+        name = f"__mz{prefix}{len(self.consts)}"
+        self.consts[name] = value
+        return name
+
+    def line(self, text):
+        self.lines.append("    " * self.level + text)
+        return self
+
+    def indent(self):
+        class Indenter:
+            def __enter__(ind): self.level += 1
+            def __exit__(ind, *args): self.level -= 1
+        return Indenter()
+
+    @property
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+    def compile_code(self, filename = None):
+        filename = filename or f"<modelzero-codegen-{self.name}-{next(_counter)}>"
+        return compile(self.text, filename, "exec")
+
+    def compile(self, namespace = None, code = None):
+        """ Compiles the source (unless its code is given) and returns all
+        globals it defines. """
+        if code is None:
+            code = self.compile_code()
+        text = self.text
+        namespace = dict(namespace or {}, **self.consts)
+        exec(code, namespace)
+        # Lets tracebacks and inspect show the generated source
+        filename = code.co_filename
+        linecache.cache[filename] = (len(text), None, text.splitlines(True), filename)
+        return namespace
+
+    def compile_function(self, funcname, namespace = None):
+        return self.compile(namespace)[funcname]
+
+def compile_record_methods(record_class):
+    """ Generates __init__, validate, __eq__ and to_dict methods specialized
+    to the fields of a record class.  Each field's coercion and validators
+    are inlined instead of going through setfield, the Field descriptor and
+    Field.validate for every value.
+
+    Methods that the class (or a base) has defined itself are left alone.
+    """
+    generators = dict(__init__ = _gen_init, validate = _gen_validate,
+                      __eq__ = _gen_eq, to_dict = _gen_to_dict)
+    for name, generator in generators.items():
+        if _replaceable(record_class, name):
+            _install(record_class, name, generator(record_class))
+
+def _replaceable(record_class, name):
+    from modelzero.core.records import RecordBase
+    method = getattr(record_class, name)
+    return method is getattr(RecordBase, name) or getattr(method, "__generated__", False)
+
+def _install(record_class, name, func):
+    func.__generated__ = True
+    func.__qualname__ = f"{record_class.__qualname__}.{name}"
+    setattr(record_class, name, func)
+
+def _is_compact(record_class):
+    return hasattr(record_class, "__field_members__")
+
+def _default_expr(src, field):
+    default = field._default
+    if default is None: return "None"
+    if hasattr(default, "__call__"):
+        return src.const(default, "_default") + "()"
+    return src.const(default, "_default")
+
+def _gen_coerce(src, field, var, not_none = False):
+    """ Emits the statements that Field.validate would run on 'var'. """
+    from modelzero.core.records import Field
+    if type(field).validate is not Field.validate:
+        src.line(f"{var} = {src.const(field.validate, '_validate')}({var})")
+        return
+    base_type = field.base_type
+    if base_type and base_type.is_opaque_type and base_type.native_type:
+        native = src.const(base_type.native_type, "_native")
+        none_check = "" if not_none else f"{var} is not None and "
+        src.line(f"if {none_check}not isinstance({var}, {native}):")
+        with src.indent():
+            src.line(f"{var} = {native}({var})")
+    for validator in field.validators:
+        src.line(f"{var} = {src.const(validator, '_validator')}({var})")
+
+def _has_coercion(field):
+    from modelzero.core.records import Field
+    if type(field).validate is not Field.validate: return True
+    base_type = field.base_type
+    if base_type and base_type.is_opaque_type and base_type.native_type: return True
+    return len(field.validators) > 0
+
+def _gen_init(record_class):
+    from modelzero.core.records import MISSING
+    rmeta = record_class.__record_metadata__
+    compact = _is_compact(record_class)
+    src = Source(record_class.__name__ + ".__init__")
+    missing = src.const(MISSING, "_missing")
+    # Fields that are not valid parameter names are taken from the other kwargs
+    pynames = {name: name if is_name(name) else f"__mz_field{index}"
+               for index, name in enumerate(rmeta.fieldnames)}
+    params = "".join(f"{name} = {missing}, " for name in rmeta.fieldnames if is_name(name))
+    if params: params = "*, " + params
+    src.line(f"def __init__(__mz_self, {params}**__mz_rest):")
+    with src.indent():
+        for name, pyname in pynames.items():
+            if pyname != name:
+                src.line(f"{pyname} = __mz_rest.pop({name!r}, {missing})")
+        for attr, value in record_class.__init_attrs__.items():
+            if compact or not is_name(attr):
+                src.line(f"_object_setattr(__mz_self, {attr!r}, {src.const(value, '_attr')})")
+            else:
+                src.line(f"__mz_self.{attr} = {src.const(value, '_attr')}")
+        if not compact:
+            src.line("__mz_values = __mz_self.__field_values__ = {}")
+        for name, field in rmeta.items():
+            pyname = pynames[name]
+            src.line(f"if {pyname} is not {missing}:")
+            with src.indent():
+                _gen_coerce(src, field, pyname)
+                if compact:
+                    setter = src.const(record_class.__field_members__[name].__set__, "_set")
+                    src.line(f"{setter}(__mz_self, {pyname})")
+                else:
+                    src.line(f"__mz_values[{name!r}] = {pyname}")
+        src.line("if __mz_rest:")
+        with src.indent():
+            src.line("for __mz_key, __mz_value in __mz_rest.items():")
+            with src.indent():
+                src.line("__mz_self.setfield(__mz_key, __mz_value, True)")
+    return src.compile_function("__init__", {"_object_setattr": object.__setattr__})
+
+def _gen_read(src, record_class, field, name, target, var):
+    """ Emits the read of a field's value (or its default) into 'var'. """
+    if _is_compact(record_class):
+        src.line(f"{var} = {attr(target, name)}")
+    else:
+        src.line(f"{var} = {target}.__field_values__.get({name!r}, {_default_expr(src, field)})")
+
+def attr(target, name):
+    """ Source reading an attribute of target. """
+    return f"{target}.{name}" if is_name(name) else f"getattr({target}, {name!r})"
+
+def _gen_validate(record_class):
+    from modelzero.core import errors
+    rmeta = record_class.__record_metadata__
+    src = Source(record_class.__name__ + ".validate")
+    src.line("def validate(__mz_self):")
+    with src.indent():
+        src.line("field_errors = None")
+        for name, field in rmeta.items():
+            _gen_read(src, record_class, field, name, "__mz_self", "value")
+            if not field.optional:
+                src.line("if value is None:")
+                with src.indent():
+                    src.line("if field_errors is None: field_errors = _defaultdict(list)")
+                    src.line(f"field_errors[{name!r}].append(_ValidationError({'Required field ' + name + ' has no value'!r}))")
+                if _has_coercion(field):
+                    src.line("else:")
+                    with src.indent():
+                        _gen_coerce(src, field, "value", not_none = True)
+            elif _has_coercion(field):
+                _gen_coerce(src, field, "value")
+        src.line("if field_errors:")
+        with src.indent():
+            src.line('raise _ValidationError(f"Validation failed for {__mz_self.__class__}", field_errors)')
+        src.line("return __mz_self")
+    from collections import defaultdict
+    return src.compile_function("validate", {"_defaultdict": defaultdict,
+                                             "_ValidationError": errors.ValidationError})
+
+def _gen_eq(record_class):
+    rmeta = record_class.__record_metadata__
+    src = Source(record_class.__name__ + ".__eq__")
+    src.line("def __eq__(__mz_self, another):")
+    with src.indent():
+        src.line("if another is None: return False")
+        src.line("if type(__mz_self) != type(another): return False")
+        for name, field in rmeta.items():
+            _gen_read(src, record_class, field, name, "__mz_self", "value1")
+            _gen_read(src, record_class, field, name, "another", "value2")
+            src.line("if value1 != value2: return False")
+        src.line("return True")
+    return src.compile_function("__eq__")
+
+def _gen_to_dict(record_class):
+    rmeta = record_class.__record_metadata__
+    src = Source(record_class.__name__ + ".to_dict")
+    src.line("def to_dict(__mz_self):")
+    with src.indent():
+        if _is_compact(record_class):
+            entries = ", ".join(f"{name!r}: {attr('__mz_self', name)}" for name in rmeta.fieldnames)
+        else:
+            src.line("values = __mz_self.__field_values__")
+            entries = ", ".join(f"{name!r}: values.get({name!r}, {_default_expr(src, field)})"
+                                for name, field in rmeta.items())
+        src.line(f"return {{{entries}}}")
+    return src.compile_function("to_dict")
+
+def compile_json_serializer(record_class, format_datetime):
+    """ Generates a function that converts a record into the dict that is
+    serialized as its json.  Like NEJsonEncoder only fields that are set are
+    included.  Fields holding datetimes, bytes and Keys are converted inline
+    so the json encoder does not have to call back for each of them.
+    """
+    from datetime import datetime
+    from modelzero.core.entities import Key
+    from modelzero.core.types import MZTypes
+    rmeta = record_class.__record_metadata__
+    src = Source(record_class.__name__ + ".__json__")
+    src.line("def serialize(__mz_record):")
+    with src.indent():
+        src.line("values = __mz_record.__field_values__")
+        src.line("out = {}")
+        for name, field in rmeta.items():
+            base_type = field.base_type
+            src.line(f"if {name!r} in values:")
+            with src.indent():
+                src.line(f"value = values[{name!r}]")
+                if base_type is None:
+                    # Values of fields without a type are left to the json encoder
+                    pass
+                elif base_type == MZTypes.DateTime:
+                    src.line("if type(value) is _datetime: value = _format_datetime(value)")
+                elif base_type == MZTypes.Bytes:
+                    src.line("if type(value) is bytes: value = value.decode()")
+                elif base_type.is_type_app and base_type.type_app.origin_type == MZTypes.Key:
+                    src.line("if type(value) is _Key: value = value.value")
+                src.line(f"out[{name!r}] = value")
+        src.line("return out")
+    return src.compile_function("serialize", {"_datetime": datetime, "_Key": Key,
+                                              "_format_datetime": format_datetime})
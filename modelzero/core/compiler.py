@@ -0,0 +1,300 @@
+"""
+Compiles expression trees into nested python closures.
+
+DFSEval walks an expression and dispatches on every node each time it is
+evaluated.  The Compiler does that walk once and returns a closure per node
+that only does the node's work.  Closures are called as run(env) and return
+plain python values (instead of Natives) so no wrappers are allocated while
+evaluating.
+
+Variables bound by Lets and function parameters are resolved while
+compiling to a (depth, slot) index into env.Frames, the list backed
+environments compiled code creates.  Other variables (eg the inputs passed
+in a DefaultEnv or names a function body reads from its caller) are looked
+up by name.
+
+    compiled = Compiler().compile(query.body)
+    result = compiled(env.DefaultEnv())         # a Native just like DFSEval
+
+    get_user = Compiler().compile_func(query)
+    record = get_user(user = some_user)         # the plain value
+
+Compiled closures are a snapshot: an expression (or query) that is changed
+after being compiled must be compiled again.
+"""
+
+from ipdb import set_trace
+from typing import Dict
+from modelzero.core import exprs
+from modelzero.core.env import DefaultEnv, Layout, Frame, slot_reader
+from taggedunion import CaseMatcher, case
+
+class CompiledExpr(object):
+    """ A compiled expression that is evaluated like DFSEval. """
+    def __init__(self, expr, run):
+        self.expr = expr
+        self.run = run
+
+    def __call__(self, env = None) -> exprs.Native:
+        value = self.run(env if env is not None else DefaultEnv())
+        if isinstance(value, (exprs.Native, exprs.Ref, exprs.Function.BoundFunc)):
+            return value
+        return exprs.Native(value)
+
+class Compiler(CaseMatcher):
+    """ Turns expressions into closures of the form run(env) -> value. """
+    __caseon__ = exprs.Expr
+
+    def __init__(self):
+        # Compiled appliers of functions by id so each body is compiled once
+        self._appliers = {}
+        # Layout of the frame the expression being compiled runs in
+        self.layout = None
+
+    def compile(self, expr) -> CompiledExpr:
+        expr = exprs.ensure_expr(expr)
+        return CompiledExpr(expr, self(expr))
+
+    def compile_func(self, func : exprs.Function):
+        """ Returns a python callable that applies func to keyword arguments. """
+        apply = self.applier(func)
+        root = DefaultEnv()
+        def call(**kwargs):
+            return apply(root, kwargs)
+        call.__name__ = func.name or "compiled"
+        return call
+
+    def compile_in(self, layout, expr):
+        """ Compiles expr to run in frames of the given layout. """
+        saved, self.layout = self.layout, layout
+        try:
+            return self(expr)
+        finally:
+            self.layout = saved
+
+    def resolve(self, name):
+        return None if self.layout is None else self.layout.resolve(name)
+
+    @case("native")
+    def compileNative(self, native: exprs.Native):
+        value = native.value
+        return lambda env: value
+
+    @case("var")
+    def compileVar(self, var: exprs.Var):
+        name = var.name
+        index = self.resolve(name)
+        if index is not None:
+            return slot_reader(*index)
+        def run_var(env):
+            value = env.get(name)
+            # Envs set up by callers may still hold Natives
+            return value.value if type(value) is exprs.Native else value
+        return run_var
+
+    @case("ref")
+    def compileRef(self, ref: exprs.Ref):
+        if ref.is_var:
+            return lambda env: ref
+        run_expr = self(ref.expr)
+        return lambda env: exprs.Ref(exprs.Native(run_expr(env)))
+
+    @case("let")
+    def compileLet(self, let: exprs.Let):
+        runs = [self(exp) for exp in let.mappings.values()]
+        layout = Layout(let.mappings.keys(), self.layout)
+        run_body = self.compile_in(layout, let.body)
+        def run_let(env):
+            return run_body(Frame(layout, [run(env) for run in runs], env))
+        return run_let
+
+    @case("istype")
+    def compileIsType(self, istype: exprs.IsType):
+        run_expr = self(istype.expr)
+        target_type = istype.type_or_expr
+        if issubclass(target_type.__class__, exprs.Expr):
+            run_type = self(target_type)
+            return lambda env: issubclass(run_expr(env).__class__, run_type(env).record_class)
+        record_class = target_type.record_class
+        return lambda env: issubclass(run_expr(env).__class__, record_class)
+
+    @case("ifelse")
+    def compileIfElse(self, ifelse: exprs.IfElse):
+        run_cond = self(ifelse.cond)
+        run_exp1 = self(ifelse.exp1)
+        run_exp2 = self(ifelse.exp2)
+        def run_ifelse(env):
+            return run_exp1(env) if run_cond(env) else run_exp2(env)
+        return run_ifelse
+
+    @case("andexp")
+    def compileAnd(self, andexp: exprs.And):
+        runs = [self(expr) for expr in andexp.exprs]
+        if len(runs) == 2:
+            first, second = runs
+            return lambda env: bool(first(env)) and bool(second(env))
+        def run_and(env):
+            for run in runs:
+                if not run(env): return False
+            return True
+        return run_and
+
+    @case("orexp")
+    def compileOr(self, orexp: exprs.Or):
+        runs = [self(expr) for expr in orexp.exprs]
+        def run_or(env):
+            for run in runs:
+                if run(env): return True
+            return False
+        return run_or
+
+    @case("notexp")
+    def compileNot(self, notexp: exprs.Not):
+        run_expr = self(notexp.expr)
+        return lambda env: not run_expr(env)
+
+    @case("new")
+    def compileNew(self, new: exprs.New):
+        record_class = new.obj_type.record_class
+        return lambda env: record_class()
+
+    @case("func")
+    def compileFunc(self, func: exprs.Function):
+        return lambda env: func.bind(env)
+
+    @case("getter")
+    def compileGetter(self, getter: exprs.Getter):
+        key = getter.key
+        src_expr = getter.src_expr
+        index = self.resolve(src_expr.var.name) if src_expr.is_var else None
+        if index is not None and index[0] == 0:
+            # Common case of $param/field so skip a closure call
+            slot = index[1]
+            def run_slot_getter(env):
+                src = env.values[slot]
+                return None if src is None else getattr(src, key)
+            return run_slot_getter
+        if src_expr.is_var and index is None:
+            name = src_expr.var.name
+            def run_var_getter(env):
+                src = env.get(name)
+                if type(src) is exprs.Native: src = src.value
+                return None if src is None else getattr(src, key)
+            return run_var_getter
+        run_src = self(src_expr)
+        def run_getter(env):
+            src = run_src(env)
+            return None if src is None else getattr(src, key)
+        return run_getter
+
+    @case("setter")
+    def compileSetter(self, setter: exprs.Setter):
+        run_src = self(setter.src_expr)
+        setters = [(key, self(value)) for key,value in setter.keys_and_values.items()]
+        def run_setter(env):
+            src = run_src(env)
+            for key, run in setters:
+                value = run(env)
+                if value is None:
+                    delattr(src, key)
+                else:
+                    setattr(src, key, value)
+            return src
+        return run_setter
+
+    @case("fmap")
+    def compileFMap(self, fmap: exprs.FMap):
+        func = fmap.func_expr.func
+        assert len(func.input_names) == 1
+        param = list(func.input_names)[0]
+        apply = self.applier(func)
+        run_src = self(fmap.src_expr)
+        def run_fmap(env):
+            return [apply(env, {param: item}) for item in run_src(env)]
+        return run_fmap
+
+    @case("call")
+    def compileCall(self, call: exprs.Call):
+        operator = call.operator
+        args = [(k, self(v)) for k,v in call.kwargs.items()]
+        if operator.is_func:
+            apply = self.applier(operator.func)
+            def run_call(env):
+                return apply(env, {k: run(env) for k,run in args})
+            return run_call
+
+        # Operator only known at runtime
+        run_operator = self(operator)
+        def run_dynamic_call(env):
+            boundfunc = run_operator(env)
+            kwargs = {k: run(env) for k,run in args}
+            return self.applier(boundfunc.func)(boundfunc.env, kwargs)
+        return run_dynamic_call
+
+    def applier(self, func : exprs.Function):
+        """ Returns apply(env, kwargs) that calls func with values for its
+        inputs taken from kwargs (or their defaults) in the given env. """
+        apply = self._appliers.get(id(func), None)
+        if apply is not None: return apply[1]
+
+        # Register a forwarder first so recursive functions can refer to themselves
+        target = []
+        def forward(env, kwargs):
+            return target[0](env, kwargs)
+        self._appliers[id(func)] = (func, forward)
+
+        # No partial application for now
+        inputs = []
+        for input in func.input_names:
+            if func.has_default_value(input):
+                inputs.append((input, True, func.get_default_value(input)))
+            else:
+                inputs.append((input, False, None))
+
+        names = [input for input,_,_ in inputs]
+        def bind_values(kwargs):
+            try:
+                return [kwargs[name] for name in names]
+            except KeyError:
+                pass
+            values = []
+            for input, has_default, default in inputs:
+                if input in kwargs:
+                    values.append(kwargs[input])
+                elif has_default:
+                    values.append(default)
+                else:
+                    raise Exception(f"Value for arg '{input}' in function '{func.fqn}' not found")
+            return values
+
+        def bind_args(kwargs):
+            if len(kwargs) == len(inputs) and all(input in kwargs for input,_,_ in inputs):
+                return kwargs
+            new_args = {}
+            for input, has_default, default in inputs:
+                if input in kwargs:
+                    new_args[input] = kwargs[input]
+                elif has_default:
+                    new_args[input] = default
+                else:
+                    raise Exception(f"Value for arg '{input}' in function '{func.fqn}' not found")
+            return new_args
+
+        body = func.body
+        assert body
+        if type(body) is exprs.Native:
+            # Native functions are called directly
+            target_func = body.value
+            def apply_native(env, kwargs):
+                return target_func(**bind_args(kwargs))
+            target.append(apply_native)
+        else:
+            # Bodies read their caller's variables by name so only the
+            # parameters are resolved statically
+            layout = Layout(names)
+            run_body = self.compile_in(layout, body)
+            def apply_body(env, kwargs):
+                return run_body(Frame(layout, bind_values(kwargs), env))
+            target.append(apply_body)
+        self._appliers[id(func)] = (func, target[0])
+        return target[0]
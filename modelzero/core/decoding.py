@@ -0,0 +1,250 @@
+"""
+Decoding of (json) request bodies into records.
+
+A decoder is built once per record class from its RecordMetadata.  It walks
+the parsed body in a single pass, coercing and validating every field it
+finds (including nested records, lists and maps) and collects all the
+errors so they can be reported together instead of failing on the first.
+"""
+
+from ipdb import set_trace
+from collections import defaultdict
+from modelzero.core import errors
+from modelzero.core.records import Field, RecordMetadata, MISSING
+from modelzero.core.types import MZTypes
+
+def decode_record(record_class, data):
+    """ Creates a record of the given class from a parsed body.
+
+    Raises an errors.ValidationError whose data maps the path of every
+    invalid field (eg "address.city" or "tags.2") to its errors.
+    """
+    field_errors = defaultdict(list)
+    values = decoder_for(record_class)(data, "", field_errors, False)
+    if field_errors:
+        raise errors.ValidationError(f"Invalid {record_class.__name__}", dict(field_errors))
+    return record_class.from_values(values)
+
+def decode_patch(record_class, data):
+    """ Coerces and validates just the fields present in a patch body and
+    returns their values by name. """
+    field_errors = defaultdict(list)
+    values = decoder_for(record_class)(data, "", field_errors, True)
+    if field_errors:
+        raise errors.ValidationError(f"Invalid patch for {record_class.__name__}", dict(field_errors))
+    return values
+
+def apply_patch(record, data):
+    """ Validates a patch body as a whole and then applies it to a record. """
+    return record.set_values(decode_patch(record.__class__, data))
+
+_decoders = {}
+_decoders_generation = -1
+
+def decoder_for(record_class):
+    """ Returns the decoder function for a record class, building it if needed.
+
+    The decoder is called as decoder(data, path, field_errors, partial) and
+    returns the decoded values of the fields in data by name.  Errors are
+    added to field_errors by field path.  Unless partial is set, missing
+    required fields are errors too.
+    """
+    global _decoders_generation
+    if _decoders_generation != RecordMetadata.generation:
+        # Some record's fields changed so rebuild all decoders
+        _decoders.clear()
+        _decoders_generation = RecordMetadata.generation
+    decoder = _decoders.get(record_class, None)
+    if decoder is None:
+        decoder = DecoderBuilder()(record_class)
+    return decoder
+
+class DecoderBuilder(object):
+    """ Builds the value decoders for the fields of a record.
+
+    A value decoder is called as decoder(value, path, field_errors) and
+    returns the coerced value.  If the value is invalid it adds the error to
+    field_errors under path and returns MISSING.
+    """
+    def __call__(self, record_class):
+        if record_class in _decoders: return _decoders[record_class]
+        # Register a forwarder first so recursive records can refer to themselves
+        plan = []
+        def forward(data, path, field_errors, partial):
+            return plan[0](data, path, field_errors, partial)
+        _decoders[record_class] = forward
+
+        fields = []
+        for name, field in record_class.__record_metadata__.items():
+            required = not field.optional and field._default is None
+            fields.append((name, required, self.for_field(field)))
+
+        def decode_fields(data, path, field_errors, partial):
+            if not isinstance(data, dict):
+                field_errors[path.rstrip(".")].append(errors.ValidationError(f"Expected an object, found: {type(data).__name__}"))
+                return {}
+            values = {}
+            for name, required, decoder in fields:
+                value = data.get(name, MISSING)
+                fieldpath = path + name
+                if value is MISSING:
+                    if required and not partial:
+                        field_errors[fieldpath].append(errors.ValidationError(f"Required field {name} has no value"))
+                elif value is None:
+                    if required:
+                        field_errors[fieldpath].append(errors.ValidationError(f"Required field {name} has no value"))
+                    else:
+                        values[name] = None
+                else:
+                    value = decoder(value, fieldpath, field_errors)
+                    if value is not MISSING:
+                        values[name] = value
+            return values
+
+        plan.append(decode_fields)
+        _decoders[record_class] = decode_fields
+        return decode_fields
+
+    def for_field(self, field):
+        if type(field).validate is not Field.validate:
+            # Fields with their own validation (eg DateTimeField) know best
+            return self.checked(field.validate)
+        decoder = self.for_type(field.base_type)
+        validators = field.validators
+        if not validators: return decoder
+        def decode_and_validate(value, path, field_errors):
+            value = decoder(value, path, field_errors)
+            if value is MISSING: return value
+            try:
+                for validator in validators:
+                    value = validator(value)
+            except (ValueError, TypeError, AssertionError, errors.ValidationError) as exc:
+                field_errors[path].append(as_validation_error(exc))
+                return MISSING
+            return value
+        return decode_and_validate
+
+    def for_type(self, thetype):
+        if thetype.is_type_ref:
+            return self.for_type(thetype.target)
+        if thetype.is_optional_type:
+            decoder = self.for_type(thetype.optional_type.base_type)
+            return lambda value, path, field_errors: None if value is None else decoder(value, path, field_errors)
+        if thetype.is_opaque_type:
+            return self.for_opaque(thetype)
+        if thetype.is_record_type:
+            return self.for_record(thetype.record_class)
+        if thetype.is_type_app:
+            type_app = thetype.type_app
+            if type_app.origin_type == MZTypes.List:
+                return self.for_list(type_app.type_args[0])
+            if type_app.origin_type == MZTypes.Map:
+                return self.for_map(type_app.type_args[0], type_app.type_args[1])
+            if type_app.origin_type == MZTypes.Key:
+                return self.for_key(type_app)
+        # Nothing known to check
+        return lambda value, path, field_errors: value
+
+    def for_opaque(self, thetype):
+        if thetype == MZTypes.Bool:
+            return decode_bool
+        native_type = thetype.opaque_type.native_type
+        if native_type is None or native_type is map:
+            return lambda value, path, field_errors: value
+        if native_type in (int, float):
+            def decode_number(value, path, field_errors):
+                if type(value) is native_type: return value
+                if type(value) is bool or not isinstance(value, (int, float, str)):
+                    field_errors[path].append(errors.ValidationError(f"Expected {thetype.opaque_type.name}, found: {type(value).__name__}"))
+                    return MISSING
+                return self.coerce(native_type, value, path, field_errors)
+            return decode_number
+        def decode_native(value, path, field_errors):
+            if isinstance(value, native_type): return value
+            return self.coerce(native_type, value, path, field_errors)
+        return decode_native
+
+    def coerce(self, native_type, value, path, field_errors):
+        try:
+            return native_type(value)
+        except (ValueError, TypeError) as exc:
+            field_errors[path].append(errors.ValidationError(f"Invalid value '{value}': {exc}"))
+            return MISSING
+
+    def checked(self, func):
+        def decode_checked(value, path, field_errors):
+            try:
+                return func(value)
+            except (ValueError, TypeError, AttributeError, AssertionError, errors.ValidationError) as exc:
+                field_errors[path].append(as_validation_error(exc))
+                return MISSING
+        return decode_checked
+
+    def for_record(self, record_class):
+        decode_fields = self(record_class)
+        def decode_nested(value, path, field_errors):
+            if isinstance(value, record_class): return value
+            num_errors = len(field_errors)
+            values = decode_fields(value, path + ".", field_errors, False)
+            if len(field_errors) != num_errors: return MISSING
+            return record_class.from_values(values)
+        return decode_nested
+
+    def for_list(self, child_type):
+        decoder = self.for_type(child_type)
+        def decode_list(value, path, field_errors):
+            if not isinstance(value, (list, tuple)):
+                field_errors[path].append(errors.ValidationError(f"Expected a list, found: {type(value).__name__}"))
+                return MISSING
+            out = []
+            for index, item in enumerate(value):
+                out.append(decoder(item, f"{path}.{index}", field_errors))
+            # Report errors in all items before giving up on the list
+            return MISSING if any(item is MISSING for item in out) else out
+        return decode_list
+
+    def for_map(self, key_type, value_type):
+        key_decoder = self.for_type(key_type)
+        value_decoder = self.for_type(value_type)
+        def decode_map(value, path, field_errors):
+            if not isinstance(value, dict):
+                field_errors[path].append(errors.ValidationError(f"Expected an object, found: {type(value).__name__}"))
+                return MISSING
+            out = {}
+            valid = True
+            for k, v in value.items():
+                itempath = f"{path}.{k}"
+                k = key_decoder(k, itempath, field_errors)
+                v = value_decoder(v, itempath, field_errors)
+                if k is MISSING or v is MISSING:
+                    valid = False
+                else:
+                    out[k] = v
+            return out if valid else MISSING
+        return decode_map
+
+    def for_key(self, type_app):
+        from modelzero.core.entities import Key
+        def make_key(value):
+            if type(value) is Key: return value
+            typearg = type_app.type_args[0]
+            if typearg.is_type_ref: typearg = typearg.target
+            return typearg.record_class.Key(value)
+        return self.checked(make_key)
+
+TRUE_STRINGS = ("true", "yes", "1")
+FALSE_STRINGS = ("false", "no", "0")
+
+def decode_bool(value, path, field_errors):
+    if type(value) is bool: return value
+    if type(value) is int and value in (0, 1): return value == 1
+    if type(value) is str:
+        lowered = value.lower()
+        if lowered in TRUE_STRINGS: return True
+        if lowered in FALSE_STRINGS: return False
+    field_errors[path].append(errors.ValidationError(f"Expected bool, found: {value!r}"))
+    return MISSING
+
+def as_validation_error(exc):
+    if isinstance(exc, errors.ValidationError): return exc
+    return errors.ValidationError(str(exc))
@@ -1,4 +1,5 @@
 
+import weakref
 from typing import List
 from modelzero.core.records import *
 
@@ -8,10 +9,47 @@ KEY_FIELD = "__key__"
 # Advantage of this would be we have more typing and a stronger relationship 
 # between the entity fields this Key is referring to.
 class Key(object):
-    """ Generic Key objects that encapsulate how keys for entities are stored and used. """
+    """ Generic Key objects that encapsulate how keys for entities are stored and used.
+
+    Keys are immutable.  Their hash is computed once from the entity class
+    and the key's parts so they are cheap to use in dicts and sets.
+    """
+    __slots__ = ("entity_class", "parts", "_hash", "__weakref__")
+
+    # Canonical instances of keys handed out by Key.intern
+    _pool = weakref.WeakValueDictionary()
+
     def __init__(self, entity_class, *parts):
-        self.entity_class = entity_class
-        self.fromValue(*parts)
+        object.__setattr__(self, "entity_class", entity_class)
+        self._set_parts(self.fromValue(*parts))
+
+    @classmethod
+    def from_parts(cls, entity_class, parts, intern = False):
+        """ Creates a key from parts that are already validated (eg read back
+        from a store) without parsing or validating them again. """
+        key = object.__new__(cls)
+        object.__setattr__(key, "entity_class", entity_class)
+        key._set_parts(parts)
+        return key.intern() if intern else key
+
+    def _set_parts(self, parts):
+        parts = tuple(parts)
+        object.__setattr__(self, "parts", parts)
+        object.__setattr__(self, "_hash", hash((self.entity_class, parts)))
+
+    def intern(self):
+        """ Returns the one shared instance of keys equal to this one so
+        that many references to the same key do not each hold a copy. """
+        return Key._pool.setdefault((self.entity_class, self.parts), self)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Keys are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Keys are immutable")
+
+    def __reduce__(self):
+        return (Key.from_parts, (self.entity_class, self.parts))
 
     def to_json(self):
         return self.value
@@ -36,6 +74,8 @@ class Key(object):
             return "/".join(map(str, self.parts))
 
     def fromValue(self, *id_or_value):
+        """ Parses and validates the parts of a key given as an id, a "/"
+        separated string or a list/tuple of parts. """
         if len(id_or_value) == 1:
             id_or_value = id_or_value[0]
         T = type(id_or_value)
@@ -49,39 +89,39 @@ class Key(object):
             set_trace()
             assert False, "id_or_value must be str, int, list or tuple"
         kf = self.entity_class.key_fields()
-        self.parts = []
         if not kf:
             if len(parts) != 1:
                 set_trace()
                 assert False
-            self.parts = parts
-        else:
-            if len(parts) != len(kf):
-                set_trace()
-            assert len(parts) == len(kf), "Number of parts in key is not same as number of key fields"
-            for f,v in zip(kf, parts):
-                # Validate field 
-                value = self.entity_class.__record_metadata__[f].validate(v)
-                self.parts.append(value)
+            return parts
+        if len(parts) != len(kf):
+            set_trace()
+        assert len(parts) == len(kf), "Number of parts in key is not same as number of key fields"
+        # Validate fields
+        rmeta = self.entity_class.__record_metadata__
+        return [rmeta[f].validate(v) for f,v in zip(kf, parts)]
 
     def __eq__(self, another):
-        if another is None or type(another) is not Key: return False
+        if self is another: return True
+        if type(another) is not Key or self._hash != another._hash: return False
         return self.entity_class == another.entity_class and self.parts == another.parts
 
+    def __ne__(self, another):
+        return not self.__eq__(another)
+
     def __str__(self):
         return str(self.value)
 
     def __hash__(self):
-        return hash(str(self))
+        return self._hash
 
     @property
     def uri(self):
         return self.entity_class.__name__.lower() + ":" + str(self)
 
 class Entity(Record):
-    def __init__(self, **kwargs):
-        setattr(self, KEY_FIELD, None)
-        super(Entity, self).__init__(**kwargs)
+    __slots__ = ()
+    __init_attrs__ = {KEY_FIELD: None}
 
     @classmethod
     def Key(cls, *parts):
@@ -109,15 +149,20 @@ class Entity(Record):
             for kv in keyvals:
                 if kv is None:
                     return None
-            return Key(self.__class__, *keyvals)
+            # Field values are already validated
+            return Key.from_parts(self.__class__, keyvals)
         else:
-            if getattr(self, KEY_FIELD) is None: return None
-            return Key(self.__class__, getattr(self, KEY_FIELD))
+            value = getattr(self, KEY_FIELD)
+            if value is None: return None
+            return Key.from_parts(self.__class__, (value,))
 
     def setkey(self, key : Key):
         """ Set's the value of the key for this entity.  This will result in the change of the entity itself being represented in the table. """
         if type(key) is not Key:
             key = Key(self.__class__, key)
+        if self.dirty_fields is not None and key != self.getkey():
+            # A different key is a different row so all of it has to be written
+            self.__dirty_fields__ = None
         kf = self.key_fields()
         if not kf:
             assert key.size == 1, "Number of parts of key of default type must be 1"
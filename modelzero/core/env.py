@@ -56,3 +56,58 @@ class DefaultEnv(IEnv):
     def setone(self, key, value):
         self.refs[key] = Ref(value)
         return self
+
+class Layout(object):
+    """ The names a frame binds and their slots, known when compiling.
+    Layouts are chained like the frames created for them. """
+    __slots__ = ("names", "slots", "parent")
+
+    def __init__(self, names, parent = None):
+        self.names = tuple(names)
+        self.slots = {name: slot for slot, name in enumerate(self.names)}
+        self.parent = parent
+
+    def resolve(self, var):
+        """ Returns the (depth, slot) of a variable or None if it is not bound
+        by any of these layouts (and has to be looked up by name). """
+        depth, layout = 0, self
+        while layout is not None:
+            slot = layout.slots.get(var, None)
+            if slot is not None: return depth, slot
+            layout, depth = layout.parent, depth + 1
+        return None
+
+class Frame(object):
+    """ An environment holding its values in a list at the slots of its
+    layout.  Compiled code reads values by (depth, slot) while get looks up
+    names dynamically, continuing into a parent that may be any environment
+    (eg a DefaultEnv). """
+    __slots__ = ("layout", "values", "parent")
+
+    def __init__(self, layout, values, parent = None):
+        self.layout = layout
+        self.values = values
+        self.parent = parent
+
+    def get(self, var):
+        env = self
+        while type(env) is Frame:
+            slot = env.layout.slots.get(var, None)
+            if slot is not None: return env.values[slot]
+            env = env.parent
+        if env is None:
+            raise Exception("Unresolved symbol: %s" % var)
+        return env.get(var)
+
+def slot_reader(depth, slot):
+    """ Returns read(frame) for the value at a (depth, slot) index. """
+    if depth == 0:
+        return lambda frame: frame.values[slot]
+    if depth == 1:
+        return lambda frame: frame.parent.values[slot]
+    if depth == 2:
+        return lambda frame: frame.parent.parent.values[slot]
+    def read(frame):
+        for _ in range(depth): frame = frame.parent
+        return frame.values[slot]
+    return read
@@ -9,3 +9,4 @@ class Unauthorized(SLException): pass
 class NotFound(SLException): pass
 class NotAllowed(SLException): pass
 class ValidationError(SLException): pass
+class SchemaMismatch(SLException): pass
@@ -1,7 +1,9 @@
 
 from ipdb import set_trace
+import functools
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Union, Dict, Tuple
-from modelzero.core import exprs, bp, records
+from modelzero.core import exprs, bp, records, parallel
 from taggedunion import Variant
 from taggedunion import Union as TUnion, CaseMatcher, case
 
@@ -15,6 +17,15 @@ class DFSEval(CaseMatcher):
     """ Super class for expression evaluators. """
     __caseon__ = exprs.Expr
 
+    def __init__(self, executor = None, chunk_size : int = None, memo = None):
+        """ Elements of FMaps are evaluated in chunks of chunk_size on the
+        given concurrent.futures executor if one is provided.  Calls to
+        cacheable native functions are memoized in memo (a memo.Memo). """
+        CaseMatcher.__init__(self)
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.memo = memo
+
     @case("let")
     def valueOfLet(self, let: exprs.Let, env) -> exprs.Native:
         expvals = {var: self(exp, env) for var,exp in let.mappings.items()}
@@ -52,20 +63,20 @@ class DFSEval(CaseMatcher):
     @case("ifelse")
     def execIfElse(self, ifelse: exprs.IfElse, env) -> exprs.Native:
         result = self(ifelse.cond, env)
-        return self(ifelse.exp1 if result else ifelse.exp2, env)
+        return self(ifelse.exp1 if result.value else ifelse.exp2, env)
 
     @case("andexp")
     def execAndExpr(self, andexp: exprs.And, env) -> exprs.Native:
         for expr in andexp.exprs:
             result = self(expr, env)
-            if not result.value: ensure_native(False)
+            if not result.value: return ensure_native(False)
         return ensure_native(True)
 
     @case("orexp")
     def execOrExpr(self, orexp: exprs.Or, env) -> exprs.Native:
         for expr in orexp.exprs:
             result = self(expr, env)
-            if result.value: ensure_native(True)
+            if result.value: return ensure_native(True)
         return ensure_native(False)
 
     @case("notexp")
@@ -89,8 +100,24 @@ class DFSEval(CaseMatcher):
         src : Native = self(fmap.src_expr, env)
         elements : list = src.value
         param = list(fmap.func_expr.func.input_names)[0]
-        results = [self.apply_proc(boundfunc, {param: item}) for item in elements]
-        return exprs.Expr.as_native(results)
+        apply = self.element_applier(boundfunc, param)
+        if apply is None or len(elements) < 2:
+            results = [self.apply_proc(boundfunc, {param: ensure_native(item)}).value for item in elements]
+        else:
+            results = parallel.map_in_chunks(self.executor, apply, elements, self.chunk_size)
+        return ensure_native(results)
+
+    def element_applier(self, boundfunc, param):
+        """ Returns the function applied to each FMap element on the executor
+        (or None to evaluate elements in this thread). """
+        if self.executor is None:
+            return None
+        if isinstance(self.executor, ProcessPoolExecutor):
+            func = boundfunc.func
+            if type(func.body) is not exprs.Native or not getattr(func, "is_pure", False):
+                return None
+            return functools.partial(parallel.call_with, func.body.value, param)
+        return lambda item: self.apply_proc(boundfunc, {param: ensure_native(item)}).value
 
     @case("getter")
     def execGetter(self, getter: exprs.Getter, env) -> exprs.Native:
@@ -150,6 +177,8 @@ class DFSEval(CaseMatcher):
             # We have a native function so call it
             target_func = curr_func.body.value
             new_args = {k:native.value for k,native in new_args.items()}
+            if self.memo is not None:
+                return ensure_native(self.memo.call(curr_func, target_func, new_args))
             return ensure_native(target_func(**new_args))
         newenv = curr_env.extend(**new_args)
         return self(curr_func.body, newenv)
@@ -265,10 +265,35 @@ class Func(Function):
         """ Returns the body expression of the function. """
         return self._body
 
+def pure(func):
+    """ Marks a python function as pure, ie its result only depends on its
+    arguments and calling it has no effects, so NativeFuncs of it are pure. """
+    func.__pure__ = True
+    return func
+
 class NativeFunc(Function):
-    """ Funcs that are "external" and not directly evaluatable by our executors. Typical system functions. """
+    """ Funcs that are "external" and not directly evaluatable by our executors. Typical system functions.
+
+    Native functions are assumed to have effects (eg reading a datastore)
+    unless they are explicitly marked pure (with pure = True or the pure
+    decorator).  Only calls to pure functions may be shared, moved or dropped
+    by optimizations.
+
+    A native function can also have a batch implementation that is called
+    with a list of argument dicts (one per call) and returns the list of
+    their results.  Evaluators that batch calls (see batching.BatchEval) use
+    it to make one call for many.
+
+    Results of pure functions are cached for the duration of a request by
+    evaluators given a memo (see memo.Memo).  cache picks the scope
+    ("request" or "process") of a function's cached results or turns caching
+    off (False) and can also make impure functions cacheable.
+    """
     def __init__(self, func_or_fqn : Union[str, "function"],
-                 annotated_type : types.Type = None):
+                 annotated_type : types.Type = None,
+                 pure : bool = None,
+                 batch : "function" = None,
+                 cache : Union[str, bool] = None):
         if type(func_or_fqn) is str:
             self._name = func_or_fqn
             self._func = resolve_fqn(func_or_fqn)
@@ -277,6 +302,11 @@ class NativeFunc(Function):
             self._name = func_or_fqn.__name__
         self._body = Native(self._func)
         super().__init__(f"{self._func.__module__}.{self._name}")
+        self.is_pure = getattr(self._func, "__pure__", False) if pure is None else pure
+        self.batch_func = batch
+        if cache is None:
+            cache = self.is_pure
+        self.cache_scope = "request" if cache is True else (cache or None)
         self.analyse_function()
 
     @property
@@ -391,6 +421,21 @@ class Expr(TUnion):
         if self._variant_value: return self._variant_value.annotated_type
         else: return None
 
+    # Table this node is interned in and its structural hash (see interning)
+    _interned_in = None
+    _structural_hash = None
+
+    def __hash__(self):
+        if self._structural_hash is not None: return self._structural_hash
+        return TUnion.__hash__(self)
+
+    def __eq__(self, another):
+        if self is another: return True
+        if self._interned_in is not None and self._interned_in is getattr(another, "_interned_in", None):
+            # Interned nodes are only equal to themselves
+            return False
+        return TUnion.__eq__(self, another)
+
     @property
     def inferred_type(self):
         if self._variant_value: return self._variant_value.inferred_type
@@ -405,8 +450,31 @@ class Expr(TUnion):
         self._variant_value.inferred_type = value
 
 class TypeInfer(CaseMatcher):
+    """ Infers the types of expressions within a stack of queries.
+
+    Types inferred are cached in expr_types (by node id, with the node so
+    ids stay unique) if given, so subexpressions shared by selectors and
+    fragments are only inferred once.  The type of a node depends on the
+    query stack (eg of its variables) so each derivation keeps its own
+    cache (see Query.invalidate).
+    """
     __caseon__ = Expr
 
+    def __init__(self, expr_types : Dict[int, Tuple["Expr", "Type"]] = None):
+        CaseMatcher.__init__(self)
+        self.expr_types = expr_types
+
+    def __call__(self, expr, query_stack: List["Query"]):
+        expr_types = self.expr_types
+        if expr_types is not None:
+            entry = expr_types.get(id(expr), None)
+            if entry is not None:
+                return entry[1]
+        result = CaseMatcher.__call__(self, expr, query_stack)
+        if result is not None and expr_types is not None:
+            expr_types[id(expr)] = (expr, result)
+        return result
+
     @case("fmap")
     def typeOfFMap(self, fmap, query_stack: List["Query"]):
         func_expr_type = self(fmap.func_expr, query_stack)
@@ -467,19 +535,9 @@ class TypeInfer(CaseMatcher):
         if src_type.is_optional_type:
             optional = True
             src_type = src_type.base_type
-        if src_type.is_record_type:
-            rec_class = src_type.record_type.record_class
-            if getter.key in rec_class.__record_metadata__:
-                field = rec_class.__record_metadata__[getter.key]
-                return_type = field.logical_type
-            else:   # See if a property matches
-                memb = [(k,v) for k,v in inspect.getmembers(rec_class) if k == getter.key]
-                if not memb:
-                    raise Exception(f"Attribute '{getter.key}' not found in '{rec_class}'")
-                func = memb[0][1]
-                if type(func) is property:
-                    sig = inspect.signature(func.fget)
-                    return_type = ensure_type(sig.return_annotation)
+        if src_type.is_record_type or src_type.is_sum_type:
+            # Fields, annotated properties and fields common to all variants
+            return_type = src_type.type_for_field_path(getter.key)
         if not return_type:
             set_trace()
             assert False
@@ -0,0 +1,86 @@
+"""
+Hash consing of expressions.
+
+Interning an expression returns an equivalent expression in which all
+structurally equal subexpressions are one shared node:
+
+    body = interning.intern(query.body)
+
+Interned nodes carry a structural hash and compare by identity (with other
+nodes interned in the same table), so they can be used as dict keys in
+compile and memo caches and equal subtrees (eg of fragments inlined into
+several queries) are only stored once.  Equality of nodes that are not
+interned is still structural.
+
+Interned nodes are shared so they must not be modified (eg with
+Let.set_body) after being interned.
+"""
+
+from ipdb import set_trace
+import weakref
+from modelzero.core import exprs
+from modelzero.core.analysis import child_exprs, with_children
+
+def node_attrs(expr):
+    """ The parts of a node (other than its children) that identify it. """
+    value = expr._variant_value
+    if expr.is_native:
+        try:
+            hash(value.value)
+            return (type(value.value), value.value)
+        except TypeError:
+            return (type(value.value), id(value.value))
+    if expr.is_var: return value.name
+    if expr.is_ref: return value.expr if value.is_var else None
+    if expr.is_new: return value.obj_type
+    if expr.is_func: return id(value)
+    if expr.is_let: return tuple(value.mappings.keys())
+    if expr.is_call: return tuple(value.kwargs.keys())
+    if expr.is_setter: return tuple(value.keys_and_values.keys())
+    if expr.is_getter: return value.key
+    if expr.is_istype:
+        target = value.type_or_expr
+        return None if issubclass(target.__class__, exprs.Expr) else target
+    return None
+
+class ExprTable(object):
+    """ A table of interned expressions by their structure. """
+    def __init__(self):
+        # Nodes are only kept while they are in use
+        self.nodes = weakref.WeakValueDictionary()
+        self.stats = dict(hits = 0, misses = 0)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def intern(self, expr : exprs.Expr) -> exprs.Expr:
+        """ Returns the interned node equal to expr (which may be expr itself). """
+        expr = exprs.ensure_expr(expr)
+        memo = {}
+        def intern_node(curr):
+            out = memo.get(id(curr), None)
+            if out is not None: return out
+            if curr._interned_in is self:
+                out = curr
+            else:
+                children = [intern_node(child) for child in child_exprs(curr)]
+                # Children are interned so their identities stand for their structure
+                key = (curr._variant_type, node_attrs(curr), tuple(map(id, children)))
+                out = self.nodes.get(key, None)
+                if out is not None:
+                    self.stats["hits"] += 1
+                else:
+                    self.stats["misses"] += 1
+                    out = with_children(curr, children)
+                    out._structural_hash = hash(key)
+                    out._interned_in = self
+                    self.nodes[key] = out
+            memo[id(curr)] = out
+            return out
+        return intern_node(expr)
+
+table = ExprTable()
+
+def intern(expr : exprs.Expr) -> exprs.Expr:
+    """ Interns an expression in the process wide table. """
+    return table.intern(expr)
@@ -0,0 +1,164 @@
+"""
+Order preserving byte encoding of entity keys.
+
+The encoding of a key's parts compares (as bytes) the same way the parts
+themselves do, part by part.  This lets stores keep keys in a sorted index
+and answer prefix and range scans over composite keys, eg all Channels
+whose login_type is "phone".
+
+Each key field is encoded according to its type:
+
+    int         8 bytes, big endian with the sign bit flipped
+    float       8 bytes of the IEEE double, flipped so negatives sort first
+    bool        1 byte
+    str, bytes  the bytes with 0x00 escaped as 0x00 0xff and ended by 0x00 0x01
+    DateTime    microseconds since the epoch as an int
+
+Entities without key fields have a single auto assigned part that is either
+an int or a str and is prefixed by a tag byte (ints sort before strs).
+"""
+
+from ipdb import set_trace
+import datetime, struct
+from modelzero.core.types import MZTypes
+
+_int = struct.Struct(">Q")
+_double = struct.Struct(">d")
+_epoch = datetime.datetime(1970, 1, 1)
+_utc = datetime.timezone.utc
+SIGN_BIT = 1 << 63
+
+TAG_INT = 1
+TAG_STR = 2
+
+def encode_int(value, out):
+    if not -SIGN_BIT <= value < SIGN_BIT:
+        raise ValueError(f"Int key part out of range: {value}")
+    out.extend(_int.pack(value + SIGN_BIT))
+
+def decode_int(buf, pos):
+    return _int.unpack_from(buf, pos)[0] - SIGN_BIT, pos + 8
+
+def encode_float(value, out):
+    bits = _int.unpack(_double.pack(value))[0]
+    out.extend(_int.pack(bits ^ 0xffffffffffffffff if bits & SIGN_BIT else bits | SIGN_BIT))
+
+def decode_float(buf, pos):
+    bits = _int.unpack_from(buf, pos)[0]
+    bits = bits ^ SIGN_BIT if bits & SIGN_BIT else bits ^ 0xffffffffffffffff
+    return _double.unpack(_int.pack(bits))[0], pos + 8
+
+def encode_bool(value, out):
+    out.append(1 if value else 0)
+
+def decode_bool(buf, pos):
+    return buf[pos] != 0, pos + 1
+
+def encode_bytes(value, out):
+    out.extend(value.replace(b"\x00", b"\x00\xff"))
+    out.extend(b"\x00\x01")
+
+def decode_bytes(buf, pos):
+    out = bytearray()
+    while True:
+        end = buf.index(0, pos)
+        out.extend(buf[pos:end])
+        if buf[end + 1] == 0xff:
+            out.append(0)
+            pos = end + 2
+        else:
+            return bytes(out), end + 2
+
+def encode_str(value, out):
+    encode_bytes(value.encode("utf-8"), out)
+
+def decode_str(buf, pos):
+    value, pos = decode_bytes(buf, pos)
+    return value.decode("utf-8"), pos
+
+def encode_datetime(value, out):
+    # Naive datetimes are taken to be in UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(_utc).replace(tzinfo = None)
+    delta = value - _epoch
+    encode_int((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds, out)
+
+def decode_datetime(buf, pos):
+    micros, pos = decode_int(buf, pos)
+    return _epoch + datetime.timedelta(microseconds = micros), pos
+
+def encode_auto(value, out):
+    """ Parts of auto assigned keys can be ints or strs. """
+    if type(value) is int:
+        out.append(TAG_INT)
+        encode_int(value, out)
+    else:
+        out.append(TAG_STR)
+        encode_str(str(value), out)
+
+def decode_auto(buf, pos):
+    if buf[pos] == TAG_INT:
+        return decode_int(buf, pos + 1)
+    return decode_str(buf, pos + 1)
+
+def _codec_for_type(thetype):
+    if thetype.is_optional_type:
+        thetype = thetype.optional_type.base_type
+    if thetype == MZTypes.Int or thetype == MZTypes.Long: return encode_int, decode_int
+    if thetype == MZTypes.Float or thetype == MZTypes.Double: return encode_float, decode_float
+    if thetype == MZTypes.Bool: return encode_bool, decode_bool
+    if thetype == MZTypes.String or thetype == MZTypes.URL: return encode_str, decode_str
+    if thetype == MZTypes.Bytes: return encode_bytes, decode_bytes
+    if thetype == MZTypes.DateTime: return encode_datetime, decode_datetime
+    raise TypeError(f"Key fields of type {thetype} cannot be ordered")
+
+class KeyEncoder(object):
+    """ Encodes the keys (or leading parts of keys) of an entity class. """
+    def __init__(self, entity_class):
+        self.entity_class = entity_class
+        key_fields = entity_class.key_fields()
+        if not key_fields:
+            self.fields = [None]
+            self.codecs = [(encode_auto, decode_auto)]
+        else:
+            rmeta = entity_class.__record_metadata__
+            self.fields = [rmeta[kf] for kf in key_fields]
+            self.codecs = [_codec_for_type(field.base_type) for field in self.fields]
+
+    def encode(self, key) -> bytes:
+        return self.encode_parts(key.parts, validate = False)
+
+    def encode_parts(self, parts, validate = True) -> bytes:
+        """ Encodes all or just the leading parts of a key. """
+        if len(parts) > len(self.codecs):
+            raise ValueError(f"{self.entity_class.__name__} keys only have {len(self.codecs)} parts")
+        out = bytearray()
+        for field, (encoder, decoder), part in zip(self.fields, self.codecs, parts):
+            if validate and field is not None:
+                part = field.validate(part)
+            encoder(part, out)
+        return bytes(out)
+
+    def decode(self, data):
+        from modelzero.core.entities import Key
+        parts = []
+        pos = 0
+        for encoder, decoder in self.codecs:
+            part, pos = decoder(data, pos)
+            parts.append(part)
+        return Key.from_parts(self.entity_class, parts)
+
+_encoders = {}
+
+def key_encoder(entity_class) -> KeyEncoder:
+    encoder = _encoders.get(entity_class, None)
+    if encoder is None:
+        encoder = _encoders[entity_class] = KeyEncoder(entity_class)
+    return encoder
+
+def prefix_end(prefix : bytes):
+    """ The smallest byte string greater than every string starting with prefix
+    (None if there is no such string). """
+    prefix = prefix.rstrip(b"\xff")
+    if not prefix: return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
@@ -0,0 +1,137 @@
+"""
+Memoizes the results of native function calls.
+
+Native functions are cached if they are pure or are explicitly marked
+cacheable.  Each NativeFunc picks a scope for its results:
+
+    * "request" results are shared by the calls in one evaluation (eg all
+      GetProfilePic calls of a query with the same arguments), and
+    * "process" results are shared by all evaluations in this process.
+
+Calls are keyed by the fqn of the function and its normalized argument
+values (records by their field values, lists as tuples and so on).  Calls
+with arguments that cannot be normalized are not cached.
+
+    GetProfilePic = NativeFunc(get_profile_pic, pure = True)     # request scope
+    GetUser = NativeFunc(get_user, cache = memo.PROCESS)        # impure but cacheable
+
+    result = DFSEval(memo = memo.Memo())(query.body, env.DefaultEnv())
+
+Cached values are returned as is, so callers must not modify them.
+"""
+
+from ipdb import set_trace
+import time, threading
+from collections import OrderedDict
+from modelzero.core import records
+
+REQUEST = "request"
+PROCESS = "process"
+
+class Unhashable(Exception): pass
+
+def normalize(value):
+    """ Returns a hashable value that is equal for equal argument values.
+
+    Values are tagged with their types so values that compare equal across
+    types (eg True, 1 and 1.0 or lists and tuples) get different keys.
+    """
+    if value is None:
+        return value
+    cls = value.__class__
+    if isinstance(value, (bool, int, float, str, bytes)):
+        return (cls, value)
+    if isinstance(value, (list, tuple)):
+        return (cls, tuple(normalize(v) for v in value))
+    if isinstance(value, (set, frozenset)):
+        return (cls, frozenset(normalize(v) for v in value))
+    if isinstance(value, dict):
+        try:
+            return (cls, tuple(sorted((normalize(k), normalize(v)) for k,v in value.items())))
+        except TypeError:
+            # Keys of different types cannot be ordered
+            raise Unhashable(value)
+    if isinstance(value, records.RecordBase):
+        return (f"{cls.__module__}.{cls.__qualname__}",
+                tuple((name, normalize(getattr(value, name)))
+                      for name in value.__record_metadata__.fieldnames))
+    try:
+        hash(value)
+    except TypeError:
+        raise Unhashable(value)
+    return (cls, value)
+
+def memo_key(func, kwargs):
+    """ The key of a call to func with the given arguments or None if they
+    cannot be normalized. """
+    try:
+        return (func.fqn, tuple(sorted((k, normalize(v)) for k,v in kwargs.items())))
+    except Unhashable:
+        return None
+
+class MemoCache(object):
+    """ A cache of call results with LRU and TTL eviction. """
+    def __init__(self, max_size : int = None, ttl : float = None, clock = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = dict(hits = 0, misses = 0, evictions = 0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+    def get(self, key):
+        """ Returns (True, value) for a cached key or (False, None). """
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or self.clock() < expires_at:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return True, value
+                del self.entries[key]
+                self.stats["evictions"] += 1
+            self.stats["misses"] += 1
+            return False, None
+
+    def put(self, key, value):
+        expires_at = None if self.ttl is None else self.clock() + self.ttl
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            if self.max_size is not None:
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last = False)
+                    self.stats["evictions"] += 1
+
+process_cache = MemoCache(max_size = 4096)
+
+class Memo(object):
+    """ The caches used by one evaluation (ie a request). """
+    def __init__(self, process : MemoCache = None, request : MemoCache = None):
+        self.process = process_cache if process is None else process
+        self.request = MemoCache() if request is None else request
+
+    def cache_for(self, func):
+        scope = getattr(func, "cache_scope", None)
+        if scope == REQUEST: return self.request
+        if scope == PROCESS: return self.process
+        return None
+
+    def call(self, func, target, kwargs):
+        """ Returns target(**kwargs) for the native func, cached if it is cacheable. """
+        cache = self.cache_for(func)
+        key = None if cache is None else memo_key(func, kwargs)
+        if key is None:
+            return target(**kwargs)
+        found, value = cache.get(key)
+        if not found:
+            value = target(**kwargs)
+            cache.put(key, value)
+        return value
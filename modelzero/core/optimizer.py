@@ -0,0 +1,419 @@
+"""
+Simplification of expressions before they are evaluated or compiled.
+
+Query bodies built by AttrSetter wrap every fragment in a Let of its
+arguments and an IfElse on IsType checks of them.  Most of these checks
+are known to pass when the query is built (the argument's type is the
+fragment's parameter type) and most Lets just rename variables.  The
+Optimizer:
+
+    * folds Not/And/Or/IfElse over Native values,
+    * resolves IsType checks whose outcome is known from static types,
+    * drops the branches that can never be taken,
+    * substitutes Let bindings of variables and constants and inlines
+      pure bindings used once (dropping unused ones),
+    * flattens chains of Setters into one, and finally
+    * binds pure subexpressions that occur more than once (getter chains
+      and calls of pure native functions) to variables with Lets so they
+      are evaluated once (common subexpression elimination).
+
+The input expression is never modified.  Shared subexpressions stay
+shared in the output so what is evaluated once is still evaluated once.
+Functions (and queries) that are called are optimized too.
+
+    func = optimize_func(query)
+    func.body           # optimized body
+"""
+
+from ipdb import set_trace
+import itertools
+from modelzero.core import exprs, types, records
+from modelzero.core.analysis import FreeVars, node_count, count_uses, bound_names, called_funcs, is_pure
+from modelzero.core.analysis import child_exprs, with_children, structural_key
+from taggedunion import CaseMatcher, case
+
+def optimize(expr, input_types = None):
+    """ Returns the optimized form of an expression whose free variables
+    have the given types (by name). """
+    return Optimizer().optimize(expr, input_types)
+
+def optimize_func(func):
+    """ Returns a Func equivalent to func (eg a Query) with an optimized body. """
+    return Optimizer().func(func)
+
+class OptScope(object):
+    """ What is known about the variables visible in an expression.  Each
+    name maps to the expression replacing it (if any) and its type. """
+    def __init__(self, parent = None, bindings = None):
+        self.bindings = dict(parent.bindings) if parent else {}
+        self.bindings.update(bindings or {})
+
+    def get(self, name):
+        return self.bindings.get(name, (None, None))
+
+    def key_for(self, names):
+        return tuple((name, id(self.bindings[name][0]), id(self.bindings[name][1]))
+                     for name in sorted(names) if name in self.bindings)
+
+MAX_PASSES = 4
+
+class Optimizer(CaseMatcher):
+    __caseon__ = exprs.Expr
+
+    def __init__(self, cse = True):
+        self.cse = cse
+        self.free_vars = FreeVars()
+        self.stats = dict(before = 0, after = 0)
+        self._results = {}
+        self._funcs = {}
+
+    def optimize(self, expr, input_types = None):
+        expr = exprs.ensure_expr(expr)
+        before = node_count(expr)
+        self.stats["before"] += before
+        scope = OptScope(None, {name: (None, t) for name, t in (input_types or {}).items()})
+        # Folding can make more bindings single use so repeat while it helps
+        for index in range(MAX_PASSES):
+            self._results = {}
+            result = self(expr, scope)
+            after = node_count(result)
+            if after > before: break
+            if result is expr or after == before:
+                expr = result
+                break
+            expr, before = result, after
+        if self.cse:
+            expr = eliminate_common_subexprs(expr, self.free_vars)
+        self.stats["after"] += node_count(expr)
+        return expr
+
+    def func(self, func):
+        """ Returns the optimized copy of a function (natives are returned as is). """
+        if type(func.body) is exprs.Native or func.body is None:
+            return func
+        key = id(func)
+        if key in self._funcs: return self._funcs[key][1]
+        out = exprs.Func(func.fqn)
+        # Registered first so recursive calls refer to the copy (which
+        # later passes must leave as is)
+        self._funcs[key] = (func, out)
+        self._funcs[id(out)] = (out, out)
+        input_types = {}
+        for name in func.input_names:
+            out.add_input(name, func.annotated_input_type(name))
+            out.set_inferred_input_type(name, func.inferred_input_type(name))
+            if func.has_default_value(name):
+                out.set_default_value(name, func.get_default_value(name))
+            input_types[name] = func.annotated_input_type(name) or func.inferred_input_type(name)
+        out.annotated_return_type = func.annotated_return_type
+        func_type = func.annotated_type or func.inferred_type
+        if func_type: out.set_inferred_return_type(func_type.func_type.return_type)
+        results = self._results
+        out._body = self.optimize(func.body, input_types)
+        self._results = results
+        return out
+
+    def __call__(self, expr, scope):
+        # Results depend only on what is known about the expression's variables
+        key = (id(expr),) + scope.key_for(self.free_vars(expr))
+        result = self._results.get(key, None)
+        if result is None:
+            result = self.optimize_node(expr, scope)
+            self._results[key] = (expr, result)
+            return result
+        return result[1]
+
+    def optimize_node(self, expr, scope):
+        # Cases return None for expressions that are left as they are
+        result = super().__call__(expr, scope)
+        return expr if result is None else result
+
+    def static_type(self, expr, scope):
+        """ The type of an expression's value if it is known statically. """
+        if expr.is_var:
+            replacement, thetype = scope.get(expr.var.name)
+            return thetype
+        if expr.is_new:
+            return expr.new.obj_type
+        if expr.is_setter:
+            return self.static_type(expr.setter.src_expr, scope)
+        if expr.is_native:
+            value = expr.native.value
+            if isinstance(value, records.Record):
+                return types.ensure_type(value.__class__)
+            return None
+        if expr.is_call and expr.call.operator.is_func:
+            func = expr.call.operator.func
+            func_type = func.annotated_type or func.inferred_type
+            return func_type.func_type.return_type if func_type else None
+        if expr.is_getter:
+            src_type = self.static_type(expr.getter.src_expr, scope)
+            if src_type is None: return None
+            optional = src_type.is_optional_type
+            if optional: src_type = src_type.optional_type.base_type
+            if not (src_type.is_record_type or src_type.is_sum_type): return None
+            try:
+                out = src_type.type_for_field_path(expr.getter.key)
+            except Exception:
+                return None
+            return types.Type.as_optional_type(out) if optional and out else out
+        return None
+
+    def static_istype(self, expr, target_type, scope):
+        """ True if a value is known to be of the target type, False if
+        known not to be and None if only known at runtime. """
+        if expr.is_native:
+            return issubclass(expr.native.value.__class__, target_type.record_class)
+        thetype = self.static_type(expr, scope)
+        if thetype is None: return None
+        if thetype.is_type_ref: thetype = thetype.target
+        if thetype is target_type: return True
+        if thetype.is_record_type and target_type.is_record_type and \
+                issubclass(thetype.record_class, target_type.record_class):
+            return True
+        return None
+
+    @case("native")
+    def optimizeNative(self, native: exprs.Native, scope):
+        return None
+
+    @case("new")
+    def optimizeNew(self, new: exprs.New, scope):
+        return None
+
+    @case("ref")
+    def optimizeRef(self, ref: exprs.Ref, scope):
+        return None
+
+    @case("var")
+    def optimizeVar(self, var: exprs.Var, scope):
+        replacement, _ = scope.get(var.name)
+        return replacement
+
+    @case("func")
+    def optimizeFunc(self, func: exprs.Function, scope):
+        out = self.func(func)
+        return None if out is func else exprs.Expr(func = out)
+
+    @case("let")
+    def optimizeLet(self, let: exprs.Let, scope):
+        body = let.body
+        # Variables read by called functions (which see the caller's env) must stay bound
+        dynamic = set()
+        for func in called_funcs(body):
+            dynamic.update(self.free_vars.of_func(func))
+        capturing = bound_names(body)
+
+        kept, bindings = {}, {}
+        for name, mapping in let.mappings.items():
+            value = self(mapping, scope)
+            thetype = self.static_type(value, scope)
+            captured = self.free_vars(value).intersection(capturing | (set(let.mappings.keys()) - {name}))
+            if name not in dynamic and not captured:
+                if value.is_native or value.is_var:
+                    bindings[name] = (value, thetype)
+                    continue
+                uses = count_uses(body, name)
+                if uses == 0 and is_pure(value):
+                    continue
+                if uses == 1 and is_pure(value):
+                    bindings[name] = (value, thetype)
+                    continue
+            kept[name] = value
+            bindings[name] = (None, thetype)
+        body = self(body, OptScope(scope, bindings))
+        if not kept: return body
+        out = exprs.Expr.as_let(**kept)
+        out.let.set_body(body)
+        return out
+
+    @case("istype")
+    def optimizeIsType(self, istype: exprs.IsType, scope):
+        expr = self(istype.expr, scope)
+        target_type = istype.type_or_expr
+        if issubclass(target_type.__class__, exprs.Expr):
+            return exprs.Expr.as_istype(expr, self(target_type, scope))
+        if is_pure(expr):
+            result = self.static_istype(expr, target_type, scope)
+            if result is not None:
+                return exprs.Expr.as_native(result)
+        return exprs.Expr.as_istype(expr, target_type)
+
+    @case("ifelse")
+    def optimizeIfElse(self, ifelse: exprs.IfElse, scope):
+        cond = self(ifelse.cond, scope)
+        if cond.is_native:
+            return self(ifelse.exp1 if cond.native.value else ifelse.exp2, scope)
+        exp1 = self(ifelse.exp1, scope)
+        exp2 = self(ifelse.exp2, scope)
+        if exp1 is exp2 and is_pure(cond):
+            return exp1
+        return exprs.Expr.as_ifelse(cond, exp1, exp2)
+
+    @case("andexp")
+    def optimizeAnd(self, andexp: exprs.And, scope):
+        return self.fold_bool_op(andexp.exprs, scope, exprs.Expr.as_andexp, False)
+
+    @case("orexp")
+    def optimizeOr(self, orexp: exprs.Or, scope):
+        return self.fold_bool_op(orexp.exprs, scope, exprs.Expr.as_orexp, True)
+
+    def fold_bool_op(self, operands, scope, make, deciding):
+        """ Drops constant operands that do not decide the result and the
+        operands after one that does. """
+        out = []
+        for operand in operands:
+            operand = self(operand, scope)
+            if operand.is_native:
+                if bool(operand.native.value) != deciding: continue
+                if not out: return exprs.Expr.as_native(deciding)
+                out.append(operand)
+                break
+            out.append(operand)
+        if not out: return exprs.Expr.as_native(not deciding)
+        return make(*out)
+
+    @case("notexp")
+    def optimizeNot(self, notexp: exprs.Not, scope):
+        expr = self(notexp.expr, scope)
+        if expr.is_native:
+            return exprs.Expr.as_native(not expr.native.value)
+        return exprs.Expr.as_notexp(expr)
+
+    @case("getter")
+    def optimizeGetter(self, getter: exprs.Getter, scope):
+        src = self(getter.src_expr, scope)
+        if src.is_native and src.native.value is None:
+            return src
+        return exprs.Expr.as_getter(src, getter.key)
+
+    @case("setter")
+    def optimizeSetter(self, setter: exprs.Setter, scope):
+        src = self(setter.src_expr, scope)
+        values = {key: self(value, scope) for key, value in setter.keys_and_values.items()}
+        if src.is_setter and not set(src.setter.keys_and_values).intersection(values):
+            # Sets in the same order as before
+            values = dict(src.setter.keys_and_values, **values)
+            src = src.setter.src_expr
+        return exprs.Expr.as_setter(src, **values)
+
+    @case("fmap")
+    def optimizeFMap(self, fmap: exprs.FMap, scope):
+        return exprs.Expr.as_fmap(self(fmap.func_expr, scope), self(fmap.src_expr, scope))
+
+    @case("call")
+    def optimizeCall(self, call: exprs.Call, scope):
+        operator = self(call.operator, scope)
+        kwargs = {key: self(value, scope) for key, value in call.kwargs.items()}
+        return exprs.Expr.as_call(operator, **kwargs)
+
+CSE_PREFIX = "__cse"
+
+def eliminate_common_subexprs(expr, free_vars = None):
+    """ Binds pure subexpressions that occur more than once in an
+    expression to variables of Lets.
+
+    Only expressions whose variables are not bound by Lets within expr are
+    shared (so they mean the same everywhere).  The largest shared
+    expression is bound first so its parts are only shared if they are also
+    used elsewhere.  Each Let is put around the outermost node that always
+    evaluates the shared expression (so eg a getter guarded by an IsType in
+    one branch of an IfElse is not evaluated before the guard).
+    """
+    free_vars = free_vars or FreeVars()
+    names = (f"{CSE_PREFIX}{index}" for index in itertools.count())
+    while True:
+        bound = bound_names(expr)
+        found = shared_subexpr(expr, bound, free_vars)
+        if found is None: return expr
+        shared, site = found
+        name = next(name for name in names if name not in bound)
+        key = structural_key(shared)
+        keys, rewritten = {}, {}
+        var = exprs.Expr.as_var(name)
+        def rewrite(curr, in_site):
+            memo_key = (id(curr), in_site)
+            out = rewritten.get(memo_key, None)
+            if out is None:
+                if curr is site and not in_site:
+                    out = exprs.Expr.as_let(**{name: shared})
+                    out.let.set_body(rewrite(curr, True))
+                elif in_site and structural_key(curr, keys) == key:
+                    out = var
+                else:
+                    out = with_children(curr, [rewrite(child, in_site) for child in child_exprs(curr)])
+                rewritten[memo_key] = out
+            return out
+        expr = rewrite(expr, False)
+
+def shared_subexpr(expr, bound, free_vars):
+    """ Returns the largest shared subexpression that can be bound and the
+    node to bind it around, or None. """
+    keys, counts, sizes, first = {}, {}, {}, {}
+    stack, seen = [expr], set()
+    while stack:
+        curr = stack.pop()
+        if id(curr) in seen: continue
+        seen.add(id(curr))
+        stack.extend(child_exprs(curr))
+        if curr.is_native or curr.is_var or curr.is_func: continue
+        if not is_pure(curr) or has_new(curr): continue
+        if free_vars(curr).intersection(bound): continue
+        key = structural_key(curr, keys)
+        counts[key] = counts.get(key, 0) + 1
+        if key not in first:
+            first[key] = curr
+            sizes[key] = node_count(curr)
+    shared = sorted((key for key, count in counts.items() if count > 1),
+                    key = lambda key: -sizes[key])
+    for key in shared:
+        site = binding_site(expr, key, keys)
+        if site is not None:
+            return first[key], site
+    return None
+
+def binding_site(expr, key, keys):
+    """ The outermost node that contains more than one occurrence of the
+    expression with the given key and evaluates one of them whenever it is
+    evaluated, or None. """
+    occurrences, always = {}, {}
+    def occurrences_in(curr):
+        out = occurrences.get(id(curr), None)
+        if out is None:
+            if structural_key(curr, keys) == key:
+                out = {id(curr)}
+            else:
+                out = set()
+                for child in child_exprs(curr):
+                    out.update(occurrences_in(child))
+            occurrences[id(curr)] = out
+        return out
+    def always_evaluates(curr):
+        out = always.get(id(curr), None)
+        if out is None:
+            out = always[id(curr)] = evaluates_always(curr, key, keys, always_evaluates)
+        return out
+    def find(curr):
+        if len(occurrences_in(curr)) < 2: return None
+        if always_evaluates(curr): return curr
+        for child in child_exprs(curr):
+            site = find(child)
+            if site is not None: return site
+        return None
+    return find(expr)
+
+def evaluates_always(expr, key, keys, always):
+    """ Tells if evaluating expr always evaluates the expression with the
+    given key (checked on children with always). """
+    if structural_key(expr, keys) == key: return True
+    value = expr._variant_value
+    if expr.is_ifelse:
+        return always(value.cond) or (always(value.exp1) and always(value.exp2))
+    if expr.is_andexp or expr.is_orexp:
+        # Operands after the first are short circuited
+        return bool(value.exprs) and always(value.exprs[0])
+    return any(always(child) for child in child_exprs(expr))
+
+def has_new(expr):
+    """ Shared new records would be the same record. """
+    return expr.is_new or any(has_new(child) for child in child_exprs(expr))
@@ -0,0 +1,76 @@
+"""
+Maps functions over lists in chunks on concurrent.futures executors.
+
+Used by DFSEval to evaluate the elements of an FMap in parallel:
+
+    with ThreadPoolExecutor(8) as executor:
+        result = DFSEval(executor = executor, chunk_size = 16)(query.body, env)
+
+Thread pools suit element functions that wait on I/O.  Process pools only
+run element functions that are pure native functions (which, with their
+arguments and results, must be picklable); other functions are evaluated in
+the calling thread.  FMaps nested in elements that are evaluated on an
+executor worker are evaluated in that worker (waiting on the executor from
+its own workers could deadlock it).
+"""
+
+from ipdb import set_trace
+import threading
+from concurrent.futures import ProcessPoolExecutor, CancelledError, wait, FIRST_EXCEPTION
+from typing import List
+
+DEFAULT_CHUNK_SIZE = 32
+
+# Set in threads while they run chunks
+_worker = threading.local()
+
+def in_worker() -> bool:
+    """ Tells if the current thread is running a chunk. """
+    return getattr(_worker, "active", False)
+
+def chunks(items : List, size : int):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+def run_chunk(func, chunk, cancelled = None):
+    results = []
+    active, _worker.active = in_worker(), True
+    try:
+        for item in chunk:
+            if cancelled is not None and cancelled.is_set():
+                raise CancelledError()
+            results.append(func(item))
+    finally:
+        _worker.active = active
+    return results
+
+def call_with(func, name, value):
+    """ Calls func with a single keyword argument (picklable unlike a lambda). """
+    return func(**{name: value})
+
+def map_in_chunks(executor, func, items : List, chunk_size : int = None) -> List:
+    """ Returns [func(item) for item in items] with chunks of items evaluated
+    on executor.
+
+    If func raises, chunks that have not started are cancelled, chunks
+    running on threads stop before their next item and the exception of the
+    earliest failed chunk is raised.  Items are mapped in the calling
+    thread if it is already running a chunk.
+    """
+    if in_worker():
+        return [func(item) for item in items]
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    # Flags cannot be shared with other processes
+    cancelled = None if isinstance(executor, ProcessPoolExecutor) else threading.Event()
+    futures = [executor.submit(run_chunk, func, chunk, cancelled)
+               for chunk in chunks(items, chunk_size)]
+    done, not_done = wait(futures, return_when = FIRST_EXCEPTION)
+    if not_done:
+        if cancelled is not None: cancelled.set()
+        for future in not_done: future.cancel()
+        wait(not_done)
+    for future in futures:
+        if future.cancelled(): continue
+        error = future.exception()
+        if error is not None and not isinstance(error, CancelledError):
+            raise error
+    return [result for future in futures for result in future.result()]
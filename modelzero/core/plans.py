@@ -0,0 +1,127 @@
+"""
+A process wide cache of query plans.
+
+Handlers often build the same query for every request.  Deriving it creates
+a new record class (and body) each time and compiling it generates its
+source again.  A Plan is a derived and compiled query; the PlanCache maps
+the structural fingerprint of a query (its inputs and commands, not its
+generated name) to the plan of the first equivalent query seen (derived
+from a copy of it, so changes made to the query later do not change the
+plan):
+
+    plan = plans.plan_for(Query(user = User).select("id", "name"))
+    record = plan(user = some_user)         # an instance of plan.record_class
+
+Fingerprints are computed from the commands alone so looking up a plan
+for an equivalent query neither derives nor compiles it.
+"""
+
+from ipdb import set_trace
+from modelzero.core import exprs, memo, querygen
+from modelzero.core.analysis import child_exprs
+from modelzero.core.queries import Query
+
+def value_key(value):
+    try:
+        return memo.normalize(value)
+    except memo.Unhashable:
+        return ("id", id(value))
+
+def func_key(func, queries):
+    """ Queries are keyed by their structure and native functions by what
+    they wrap (so NativeFuncs made again for the same python function share
+    plans).  Keys hold on to the functions so their ids are not reused. """
+    if isinstance(func, Query):
+        return ("query", query_key(func, queries))
+    if isinstance(func, exprs.NativeFunc):
+        return ("native", func.fqn, func.body.value, func.is_pure, func.batch_func,
+                func.cache_scope, func.annotated_type)
+    return ("func", func.fqn, func)
+
+def expr_key(expr, queries):
+    value = expr._variant_value
+    if expr.is_native: return ("native", type(value.value), value_key(value.value))
+    if expr.is_var: return ("var", value.name)
+    if expr.is_func: return func_key(value, queries)
+    if expr.is_new: return ("new", value.obj_type)
+    if expr.is_getter: attrs = value.key
+    elif expr.is_call: attrs = tuple(value.kwargs.keys())
+    elif expr.is_setter: attrs = tuple(value.keys_and_values.keys())
+    elif expr.is_let: attrs = tuple(value.mappings.keys())
+    elif expr.is_ref: attrs = value.expr if value.is_var else None
+    elif expr.is_istype:
+        target = value.type_or_expr
+        attrs = None if issubclass(target.__class__, exprs.Expr) else target
+    else: attrs = None
+    return (expr._variant_type, attrs) + tuple(expr_key(child, queries) for child in child_exprs(expr))
+
+def default_key(query : Query, name : str):
+    """ (has_default, value key) so a default of eg False or 0 is not taken
+    for no default. """
+    if not query.has_default_value(name):
+        return (False, None)
+    return (True, value_key(query.get_default_value(name)))
+
+def query_key(query : Query, queries = None):
+    """ The structural fingerprint of a query. """
+    queries = {} if queries is None else queries
+    if id(query) in queries:
+        return queries[id(query)][1]
+    inputs = tuple(sorted((name, query.input_type(name)) + default_key(query, name)
+                          for name in query.input_names))
+    commands = []
+    for command in query.commands:
+        if command.is_selector:
+            selector = command.selector
+            commands.append(("selector", selector.target_name, expr_key(selector.src_value, queries)))
+        else:
+            fragment = command.fragment
+            condition = None if fragment.condition is None else expr_key(fragment.condition, queries)
+            commands.append(("fragment", query_key(fragment.query, queries), condition,
+                             tuple(sorted((k, expr_key(v, queries)) for k,v in fragment.kwargs.items()))))
+    name = None if query.has_generated_name else query.fqn
+    key = (name, query.is_inline, inputs, tuple(commands))
+    queries[id(query)] = (query, key)
+    return key
+
+class Plan(object):
+    """ A derived query with its compiled body. """
+    def __init__(self, query : Query, fingerprint):
+        # Our own copy so the query given can still be changed
+        self.query = query = query.copy()
+        self.fingerprint = fingerprint
+        self.return_type = query.return_type
+        self.compiled = querygen.compile_query(query)
+
+    @property
+    def record_class(self):
+        return self.return_type.record_class
+
+    def __call__(self, **kwargs):
+        return self.compiled(**kwargs)
+
+class PlanCache(object):
+    """ Plans of queries by their fingerprints with LRU eviction. """
+    def __init__(self, max_size : int = 256):
+        self.plans = memo.MemoCache(max_size = max_size)
+
+    @property
+    def stats(self):
+        return self.plans.stats
+
+    def __len__(self):
+        return len(self.plans)
+
+    def plan_for(self, query : Query) -> Plan:
+        key = query_key(query)
+        found, plan = self.plans.get(key)
+        if not found:
+            plan = Plan(query, key)
+            self.plans.put(key, plan)
+        return plan
+
+plans = PlanCache()
+
+def plan_for(query : Query) -> Plan:
+    """ Returns the plan for a query from the process wide cache. """
+    return plans.plan_for(query)
@@ -0,0 +1,225 @@
+"""
+Per node profiles of expression evaluation.
+
+A Profiler records, for every expression node evaluated, how often it was
+evaluated, the time spent in it (cumulative, ie with its children, and
+self) and optionally the memory blocks it allocated.  Time spent in native
+functions is also recorded by their fqn.  Profiling is opt in: it is done
+by evaluators created for a profiler so DFSEval and the Compiler are not
+slowed down otherwise.
+
+    profiler = Profiler()
+    ProfilingEval(profiler)(query.body, env.DefaultEnv())
+    ProfilingCompiler(profiler).compile_func(query)(**inputs)
+
+    print(profiler.report(query.body))          # PrettyPrinter output annotated with stats
+    profiler.write_collapsed(open("query.folded", "w"))
+
+The collapsed stacks (one "node;node;node self-time-in-us" line per
+stack) can be rendered with flamegraph.pl or speedscope.
+"""
+
+from ipdb import set_trace
+import sys, time
+from typing import Dict
+from modelzero.core import exprs, evals, printers
+from modelzero.core.compiler import Compiler
+from taggedunion import case
+
+class NodeStats(object):
+    """ Counts, times (in seconds) and allocated blocks of a node or native function. """
+    __slots__ = ("label", "count", "total", "own", "allocated")
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.total = 0.0
+        self.own = 0.0
+        self.allocated = 0
+
+    def summary(self, allocations = False):
+        out = f"{self.count}x {self.total * 1e3:.3f}ms self {self.own * 1e3:.3f}ms"
+        if allocations: out += f" {self.allocated} blocks"
+        return out
+
+def node_label(expr : exprs.Expr) -> str:
+    """ Label of a node in stacks and reports. """
+    value = expr._variant_value
+    if expr.is_call:
+        operator = value.operator
+        return f"call {operator.func.fqn}" if operator.is_func else "call <computed>"
+    if expr.is_getter: return f"get {value.key}"
+    if expr.is_setter: return f"set {','.join(value.keys_and_values.keys())}"
+    if expr.is_let: return f"let {','.join(value.mappings.keys())}"
+    if expr.is_var: return f"${value.name}"
+    if expr.is_func: return f"func {value.fqn}"
+    return expr._variant_type
+
+class Profiler(object):
+    """ Collects the stats of the nodes evaluated by profiling evaluators. """
+    def __init__(self, allocations : bool = False, clock = time.perf_counter):
+        self.allocations = allocations
+        self.clock = clock
+        # Stats by node id (with the node so ids stay unique)
+        self.nodes : Dict[int, tuple] = {}
+        self.funcs : Dict[str, NodeStats] = {}
+        # Self time by stack of labels
+        self.stacks : Dict[tuple, float] = {}
+        # Frames of nodes being evaluated: [stats, path, start, child time, start blocks, child blocks]
+        self._frames = []
+
+    def stats_for(self, expr : exprs.Expr) -> NodeStats:
+        entry = self.nodes.get(id(expr), None)
+        return None if entry is None else entry[1]
+
+    def enter(self, expr : exprs.Expr):
+        entry = self.nodes.get(id(expr), None)
+        if entry is None:
+            entry = self.nodes[id(expr)] = (expr, NodeStats(node_label(expr)))
+        self.push(entry[1])
+
+    def enter_func(self, func : exprs.Function):
+        stats = self.funcs.get(func.fqn, None)
+        if stats is None:
+            stats = self.funcs[func.fqn] = NodeStats(f"native {func.fqn}")
+        self.push(stats)
+
+    def push(self, stats):
+        frames = self._frames
+        path = (frames[-1][1] if frames else ()) + (stats.label,)
+        blocks = sys.getallocatedblocks() if self.allocations else 0
+        frames.append([stats, path, self.clock(), 0.0, blocks, 0])
+
+    def exit(self):
+        stats, path, start, child_time, start_blocks, child_blocks = self._frames.pop()
+        elapsed = self.clock() - start
+        blocks = (sys.getallocatedblocks() - start_blocks) if self.allocations else 0
+        stats.count += 1
+        stats.total += elapsed
+        stats.own += elapsed - child_time
+        stats.allocated += blocks - child_blocks
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - child_time
+        if self._frames:
+            parent = self._frames[-1]
+            parent[3] += elapsed
+            parent[5] += blocks
+
+    def clear(self):
+        self.nodes.clear()
+        self.funcs.clear()
+        self.stacks.clear()
+
+    def collapsed(self):
+        """ Lines of collapsed stacks with their self time in microseconds. """
+        return [f"{';'.join(path)} {int(round(own * 1e6))}"
+                for path, own in sorted(self.stacks.items())]
+
+    def write_collapsed(self, outfile):
+        for line in self.collapsed():
+            outfile.write(line + "\n")
+
+    def report(self, expr : exprs.Expr = None) -> str:
+        """ The annotated pretty printed expression (if given) followed by
+        the stats of native functions and of the slowest nodes. """
+        writer = printers.Writer()
+        if expr is not None:
+            AnnotatedPrinter(self)(expr, writer)
+            writer.nextline()
+            writer.nextline()
+        writer.writeln("Native functions:")
+        with writer.indent():
+            for fqn, stats in sorted(self.funcs.items(), key = lambda item: -item[1].total):
+                writer.writeln(f"{fqn}: {stats.summary(self.allocations)}")
+        writer.writeln("Slowest nodes (self time):")
+        with writer.indent():
+            slowest = sorted((stats for _,stats in self.nodes.values()), key = lambda stats: -stats.own)
+            for stats in slowest[:10]:
+                writer.writeln(f"{stats.label}: {stats.summary(self.allocations)}")
+        return writer.value
+
+class AnnotatedPrinter(printers.PrettyPrinter):
+    """ Pretty prints expressions with the stats of each profiled node. """
+    def __init__(self, profiler : Profiler):
+        printers.PrettyPrinter.__init__(self)
+        self.profiler = profiler
+
+    def __call__(self, expr, writer):
+        stats = self.profiler.stats_for(expr)
+        if expr.is_setter:
+            # Printed after the sets since the source of a setter comes first
+            self._setter_stats = stats
+        elif stats is not None and not (expr.is_var or expr.is_native or expr.is_func):
+            writer.write(f"[{self.summary(stats)}] ")
+        return printers.PrettyPrinter.__call__(self, expr, writer)
+
+    def summary(self, stats):
+        return stats.summary(self.profiler.allocations)
+
+    @case("setter")
+    def eprintSetter(self, setter: exprs.Setter, writer):
+        stats = self._setter_stats
+        self(setter.src_expr, writer)
+        with writer.indent():
+            for index, (key, value) in enumerate(setter.keys_and_values.items()):
+                writer.write(f".set({key}, ")
+                self(value, writer)
+                writer.write(")")
+                if index == 0 and stats is not None:
+                    writer.write(f"    # {self.summary(stats)}")
+                writer.nextline()
+
+class ProfilingEval(evals.DFSEval):
+    """ A DFSEval that records the stats of each node in a profiler. """
+    def __init__(self, profiler : Profiler, **kwargs):
+        evals.DFSEval.__init__(self, **kwargs)
+        self.profiler = profiler
+
+    def __call__(self, expr, env):
+        profiler = self.profiler
+        profiler.enter(expr)
+        try:
+            return evals.DFSEval.__call__(self, expr, env)
+        finally:
+            profiler.exit()
+
+    def apply_proc(self, boundfunc, kwargs):
+        func = boundfunc.func
+        if type(func.body) is not exprs.Native:
+            return evals.DFSEval.apply_proc(self, boundfunc, kwargs)
+        self.profiler.enter_func(func)
+        try:
+            return evals.DFSEval.apply_proc(self, boundfunc, kwargs)
+        finally:
+            self.profiler.exit()
+
+class ProfilingCompiler(Compiler):
+    """ A Compiler whose closures record the stats of their nodes in a profiler. """
+    def __init__(self, profiler : Profiler):
+        Compiler.__init__(self)
+        self.profiler = profiler
+
+    def __call__(self, expr):
+        return self.profiled(expr, Compiler.__call__(self, expr))
+
+    def profiled(self, expr, run):
+        enter, exit = self.profiler.enter, self.profiler.exit
+        def run_profiled(env):
+            enter(expr)
+            try:
+                return run(env)
+            finally:
+                exit()
+        return run_profiled
+
+    def applier(self, func):
+        apply = Compiler.applier(self, func)
+        if type(func.body) is not exprs.Native:
+            return apply
+        enter_func, exit = self.profiler.enter_func, self.profiler.exit
+        def apply_profiled(env, kwargs):
+            enter_func(func)
+            try:
+                return apply(env, kwargs)
+            finally:
+                exit()
+        return apply_profiled
@@ -41,6 +41,10 @@ class Command(TUnion):
 class CommandProcessor(CaseMatcher):
     __caseon__ = Command
 
+    def __init__(self, type_infer : exprs.TypeInfer = None):
+        CaseMatcher.__init__(self)
+        self.type_infer = type_infer or exprs.TypeInfer()
+
     @case("selector")
     def processSelector(self, selector : Selector,
                         curr_record : Record,
@@ -50,7 +54,7 @@ class CommandProcessor(CaseMatcher):
 
         # See if this already exists and if types match - then OK
         rmeta = curr_record.__record_metadata__
-        src_type = exprs.TypeInfer()(src_value, query_stack)
+        src_type = self.type_infer(src_value, query_stack)
         if selector.target_name in rmeta:
             field = rmeta[selector.target_name]
             curr_type = field.logical_type
@@ -101,7 +105,7 @@ class CommandProcessor(CaseMatcher):
         # Finally if there is a type mismatch (or casting is not possible)
         # It is an error.
         for name,expr in fragment.kwargs.items():
-            expr_type = exprs.TypeInfer()(expr, query_stack)
+            expr_type = self.type_infer(expr, query_stack)
             param_type = fragment.query.input_type(name)
             if expr_type != param_type:
                 optional = True
@@ -119,6 +123,7 @@ def InQuery(fqn = None, **input_types : Dict[str, types.Type]):
 
 class Query(exprs.Function):
     def __init__(self, fqn = None, **input_types : Dict[str, types.Type]):
+        self._has_generated_name = not fqn
         if not fqn:
             fqn = f"Derivation_{self._counter}"
             self.__class__._counter += 1
@@ -130,10 +135,21 @@ class Query(exprs.Function):
         self._commands : List[Union[Selector, Fragment]] = []
         self._inferred_return_type = None
         self._func_body = None
+        # Number of commands already applied to the return type and the body
+        self._typed_commands = 0
+        self._body_commands = 0
+        # Types inferred for the expressions of our commands by node id
+        self._expr_types = {}
 
     @property
     def is_inline(self): return self._is_inline
 
+    @property
+    def has_generated_name(self): return self._has_generated_name
+
+    @property
+    def commands(self): return tuple(self._commands)
+
     def include(self, query : "Query", **kwargs : Dict[str, "Expr"]):
         """ Includes one or all fields from the src type at the root level
         of this query
@@ -163,32 +179,75 @@ class Query(exprs.Function):
                 self.add_command(Command.as_selector(selector[0], selector[1]))
         return self
 
+    def copy(self) -> "Query":
+        """ Returns a query with the same name, inputs and commands whose
+        return type and body are derived on their own. """
+        out = Query(self.fqn)
+        out._has_generated_name = self._has_generated_name
+        out._is_inline = self._is_inline
+        out.input_names = set(self.input_names)
+        out.annotated_input_types = dict(self.annotated_input_types)
+        out.inferred_input_types = dict(self.inferred_input_types)
+        out._param_default_values = dict(self._param_default_values)
+        out._commands = list(self._commands)
+        return out
+
     def add_command(self, cmd):
+        """ Adds a command.  The return type and body derived so far are
+        extended with it (when next accessed) instead of being rebuilt. """
         self._commands.append(cmd)
+        return self
+
+    def remove_command(self, index : int):
+        self._commands.pop(index)
+        return self.invalidate()
+
+    def replace_command(self, index : int, cmd):
+        self._commands[index] = cmd
+        return self.invalidate()
+
+    def invalidate(self):
+        """ Drops the derived return type and body so they are rebuilt from
+        all the commands, eg after a command is changed. """
         self._inferred_return_type = None
+        self._func_type = None
         self._func_body = None
+        self._typed_commands = self._body_commands = 0
+        self._expr_types = {}
         return self
 
+    @property
+    def func_type(self):
+        # Brings the (cached) return type up to date with added commands
+        self.inferred_return_type
+        return exprs.Function.func_type.fget(self)
+
     @property
     def inferred_return_type(self):
-        if self._inferred_return_type is None:
+        if self._inferred_return_type is None or self._typed_commands < len(self._commands):
             self._eval_return_type([])
         return self._inferred_return_type
 
     _counter = 1
     def _eval_return_type(self, query_stack : List["Query"]) -> types.Type:
-        classdict = dict(__fqn__ = self.fqn)
-        name = self.name
-        record_class = types.RecordType.new_record_class(name, **classdict)
-        self._inferred_return_type = types.Type.as_record_type(record_class)
+        if self._inferred_return_type is None:
+            classdict = dict(__fqn__ = self.fqn)
+            name = self.name
+            record_class = types.RecordType.new_record_class(name, **classdict)
+            self._inferred_return_type = types.Type.as_record_type(record_class)
+            self._typed_commands = 0
+        record_class = self._inferred_return_type.record_class
         query_stack.append(self)
-        for command in self._commands:
-            CommandProcessor()(command, record_class, query_stack)
+        # One inference pass over the commands added since the last one
+        processor = CommandProcessor(exprs.TypeInfer(self._expr_types))
+        for command in self._commands[self._typed_commands:]:
+            processor(command, record_class, query_stack)
+            self._typed_commands += 1
         query_stack.pop()
 
     @property
     def body(self):
-        if self._func_body is None:
+        if self._func_body is None or self._body_commands < len(self._commands):
             if self.is_inline:
                 set_trace()
                 assert False, "func_body can only be evalled for non-inlined queries"
@@ -196,10 +255,14 @@ class Query(exprs.Function):
         return self._func_body
 
     def _eval_func_body(self, query_stack : List["Query"]) -> exprs.Expr:
-        self._func_body = exprs.Expr.as_new(self.return_type)
-        for index,command in enumerate(self._commands):
+        if self._func_body is None:
+            self._func_body = exprs.Expr.as_new(self.return_type)
+            self._body_commands = 0
+        # Commands added since the body was derived wrap it
+        for command in self._commands[self._body_commands:]:
             result = AttrSetter(command, self._func_body, query_stack)
             self._func_body = result.value
+            self._body_commands += 1
         # if at the end all we have is a new, then we have not set any fields
         # so can really delete this
 
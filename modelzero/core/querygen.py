@@ -0,0 +1,418 @@
+"""
+Ahead of time generation of python source for queries.
+
+Instead of evaluating the Setter/Let/IfElse tree of a query's body (with
+DFSEval or closures from the Compiler) QueryCodeGen emits a python function
+that builds the output record directly, eg:
+
+    def q1(v1_user):
+        t2 = __mz_c0()
+        t3 = (None if v1_user is None else v1_user.id)
+        if t3 is None: delattr(t2, 'id')
+        else: t2.id = t3
+        ...
+        return t2
+
+Every object the query refers to (record classes, native functions, non
+literal values) is bound to a named constant, so the generated source is a
+rendering of just the query's structure and its hash is used as the
+query's fingerprint.  Compiled code is cached by fingerprint in memory and
+optionally (marshalled) on disk so a query is only compiled once.
+
+Like compiled closures, generated code is a snapshot of the query.
+"""
+
+from ipdb import set_trace
+import ast, hashlib, marshal, os, sys
+from modelzero.core import exprs, codegen
+from modelzero.core.analysis import FreeVars, contains
+from taggedunion import CaseMatcher, case
+
+def compile_query(query : exprs.Function, cache_dir : str = None) -> "CompiledQuery":
+    """ Generates and compiles the source for a query (or any Func).
+
+    Queries using expressions that cannot be generated (refs, functions as
+    values or calls to computed functions) are compiled into closures
+    instead.
+    """
+    try:
+        source = QueryCodeGen().generate(query)
+    except NotImplementedError:
+        from modelzero.core.compiler import Compiler
+        return CompiledQuery(query, None, None, Compiler().compile_func(query))
+    fingerprint = hashlib.sha1(source.text.encode("utf-8")).hexdigest()
+    code = load_code(source, fingerprint, cache_dir)
+    run = source.compile(code = code)[RUN_FUNC]
+    return CompiledQuery(query, source, fingerprint, run)
+
+class CompiledQuery(object):
+    """ A query compiled into a python function called with the query's inputs. """
+    def __init__(self, query, source, fingerprint, run):
+        self.query = query
+        self.source = source
+        self.fingerprint = fingerprint
+        self.run = run
+
+    @property
+    def text(self):
+        return self.source.text if self.source else None
+
+    def __call__(self, **kwargs):
+        return self.run(**kwargs)
+
+_codes = {}
+
+def load_code(source, fingerprint, cache_dir = None):
+    """ Returns the code object for generated source from the in memory or
+    disk caches, compiling (and caching) it if needed. """
+    code = _codes.get(fingerprint, None)
+    if code is not None: return code
+    filename = f"<modelzero-query-{fingerprint[:12]}>"
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, f"{fingerprint}.{sys.implementation.cache_tag}.mzq")
+        try:
+            with open(path, "rb") as cached:
+                code = marshal.load(cached)
+        except (OSError, EOFError, ValueError, TypeError):
+            code = None
+    if code is None:
+        code = source.compile_code(filename)
+        if path:
+            os.makedirs(cache_dir, exist_ok = True)
+            tmppath = f"{path}.{os.getpid()}.tmp"
+            with open(tmppath, "wb") as cached:
+                marshal.dump(code, cached)
+            os.replace(tmppath, path)
+    _codes[fingerprint] = code
+    return code
+
+RUN_FUNC = "__mz_run"
+
+def missing_arg(func, name):
+    raise Exception(f"Value for arg '{name}' in function '{func.fqn}' not found")
+
+class Scope(object):
+    """ Python names of the variables visible at a point in the generated
+    code and the thunks that can be called there instead of generating an
+    expression again. """
+    def __init__(self, parent = None, names = None):
+        names = names or {}
+        self.names = dict(parent.names) if parent else {}
+        self.names.update(names)
+        self.thunks = {}
+        if parent:
+            # Thunks remain valid unless their expression's variables are rebound
+            self.thunks = {key: (name, free_vars) for key, (name, free_vars) in parent.thunks.items()
+                           if not free_vars.intersection(names)}
+
+def is_atomic(code):
+    """ Tells if generated code is a name or literal, ie can be evaluated
+    any number of times at any point. """
+    if code.isidentifier(): return True
+    try:
+        ast.literal_eval(code)
+        return True
+    except (ValueError, SyntaxError):
+        return False
+
+class QueryCodeGen(CaseMatcher):
+    """ Generates the python source for a function and everything it calls.
+
+    Each case emits the statements an expression needs into the current
+    function and returns the python expression for its value.
+    """
+    __caseon__ = exprs.Expr
+
+    def __init__(self):
+        self.module = None
+        self.out = None
+        self.free_vars = FreeVars()
+        self._counter = 0
+        self._funcs = {}
+
+    def generate(self, func : exprs.Function) -> codegen.Source:
+        """ Returns the source defining __mz_run(**kwargs) that applies func. """
+        self.module = codegen.Source(f"query.{func.name}")
+        if self.free_vars.of_func(func):
+            raise NotImplementedError(f"Unbound variables in {func.fqn}: {sorted(self.free_vars.of_func(func))}")
+        funcname, params = self.top_level_func(func)
+        self.out = self.module
+        self.out.line(f"def {RUN_FUNC}(**kwargs):")
+        with self.out.indent():
+            args = []
+            for param in params:
+                if func.has_default_value(param):
+                    args.append(f"kwargs.get({param!r}, {self.literal(func.get_default_value(param))})")
+                else:
+                    missing = f"{self.const(missing_arg)}({self.const(func)}, {param!r})"
+                    args.append(f"kwargs[{param!r}] if {param!r} in kwargs else {missing}")
+            self.out.line(f"return {funcname}({', '.join(args)})")
+        return self.module
+
+    def __call__(self, expr, scope):
+        thunk = scope.thunks.get(id(expr), None)
+        if thunk is not None:
+            return f"{thunk[0]}()"
+        return super().__call__(expr, scope)
+
+    def newname(self, prefix, name = ""):
+        self._counter += 1
+        suffix = f"_{name}" if name and name.isidentifier() else ""
+        return f"{prefix}{self._counter}{suffix}"
+
+    def const(self, value):
+        return self.module.const(value)
+
+    def literal(self, value):
+        T = type(value)
+        if value is None or T in (str, int, bool) or (T is float and value == value and abs(value) != float("inf")):
+            return repr(value)
+        return self.const(value)
+
+    def temp(self, code):
+        """ Evaluates code into a temporary and returns its name. """
+        if is_atomic(code): return code
+        name = self.newname("t")
+        self.out.line(f"{name} = {code}")
+        return name
+
+    def capture(self, expr, scope):
+        """ Generates an expression and returns the statements it needs
+        (instead of emitting them) along with its code. """
+        lines, self.out.lines = self.out.lines, []
+        thunks = dict(scope.thunks)
+        try:
+            code = self(expr, scope)
+        finally:
+            captured, self.out.lines = self.out.lines, lines
+            scope.thunks = thunks
+        return captured, code
+
+    def emit(self, lines, extra_level = 0):
+        prefix = "    " * extra_level
+        self.out.lines.extend(prefix + line for line in lines)
+
+    def sequence(self, exprs_, scope):
+        """ Generates expressions evaluated in order, returning their codes.
+        A value is held in a temporary if later expressions need statements
+        that would otherwise run before it is evaluated. """
+        parts = [self.capture(expr, scope) for expr in exprs_]
+        codes = []
+        for index, (lines, code) in enumerate(parts):
+            self.emit(lines)
+            if any(later for later, _ in parts[index + 1:]):
+                code = self.temp(code)
+            codes.append(code)
+        return codes
+
+    def attr(self, target, key):
+        return codegen.attr(target, key)
+
+    def assign(self, target, key, code):
+        return f"{target}.{key} = {code}" if codegen.is_name(key) else f"setattr({target}, {key!r}, {code})"
+
+    def thunk(self, expr, scope):
+        """ Defines a local function evaluating expr so the code for an
+        expression shared by both branches of an IfElse is only generated once. """
+        name = self.newname("b")
+        self.out.line(f"def {name}():")
+        with self.out.indent():
+            lines, code = self.capture(expr, scope)
+            self.emit(lines)
+            self.out.line(f"return {code}")
+        scope.thunks[id(expr)] = (name, self.free_vars(expr))
+
+    def top_level_func(self, func):
+        """ Generates a module level function for a function whose body only
+        reads its own inputs and returns its name and parameters. """
+        key = id(func)
+        if key in self._funcs: return self._funcs[key][1:]
+        params = sorted(func.input_names)
+        pynames = {param: self.newname("v", param) for param in params}
+        funcname = self.newname("q")
+        self._funcs[key] = (func, funcname, params)
+        out, self.out = self.out, codegen.Source(funcname)
+        try:
+            self.out.line(f"def {funcname}({', '.join(pynames[p] for p in params)}):")
+            with self.out.indent():
+                code = self(func.body, Scope(None, pynames))
+                self.out.line(f"return {code}")
+            self.module.lines[0:0] = self.out.lines
+        finally:
+            self.out = out
+        return funcname, params
+
+    def func_caller(self, func, scope):
+        """ Returns a python callable (and its parameters) that applies func.
+        Functions reading variables of their caller become local functions. """
+        body = func.body
+        assert body
+        params = sorted(func.input_names)
+        if type(body) is exprs.Native:
+            return self.const(body.value), params, True
+        if not self.free_vars.of_func(func):
+            funcname, params = self.top_level_func(func)
+            return funcname, params, False
+        for name in self.free_vars.of_func(func):
+            if name not in scope.names:
+                raise NotImplementedError(f"Unbound variable '{name}' in {func.fqn}")
+        pynames = {param: self.newname("v", param) for param in params}
+        funcname = self.newname("q")
+        self.out.line(f"def {funcname}({', '.join(pynames[p] for p in params)}):")
+        with self.out.indent():
+            lines, code = self.capture(func.body, Scope(scope, pynames))
+            self.emit(lines)
+            self.out.line(f"return {code}")
+        return funcname, params, False
+
+    def call_args(self, func, params, by_keyword, values):
+        """ Code for the arguments passed to func given codes of the values
+        of some of its inputs. """
+        args = []
+        for param in params:
+            if param in values:
+                arg = values[param]
+            elif func.has_default_value(param):
+                arg = self.literal(func.get_default_value(param))
+            else:
+                arg = f"{self.const(missing_arg)}({self.const(func)}, {param!r})"
+            args.append(f"{param}={arg}" if by_keyword else arg)
+        return ", ".join(args)
+
+    @case("native")
+    def genNative(self, native: exprs.Native, scope):
+        return self.literal(native.value)
+
+    @case("var")
+    def genVar(self, var: exprs.Var, scope):
+        if var.name not in scope.names:
+            raise NotImplementedError(f"Unbound variable '{var.name}'")
+        return scope.names[var.name]
+
+    @case("ref")
+    def genRef(self, ref: exprs.Ref, scope):
+        raise NotImplementedError("Refs cannot be generated")
+
+    @case("func")
+    def genFunc(self, func: exprs.Function, scope):
+        raise NotImplementedError("Functions as values cannot be generated")
+
+    @case("new")
+    def genNew(self, new: exprs.New, scope):
+        return f"{self.const(new.obj_type.record_class)}()"
+
+    @case("let")
+    def genLet(self, let: exprs.Let, scope):
+        names = list(let.mappings.keys())
+        codes = self.sequence(let.mappings.values(), scope)
+        pynames = {}
+        for name, code in zip(names, codes):
+            pynames[name] = self.newname("v", name)
+            self.out.line(f"{pynames[name]} = {code}")
+        return self(let.body, Scope(scope, pynames))
+
+    @case("getter")
+    def genGetter(self, getter: exprs.Getter, scope):
+        src = self.temp(self(getter.src_expr, scope))
+        if src == "None": return "None"
+        return f"(None if {src} is None else {self.attr(src, getter.key)})"
+
+    @case("setter")
+    def genSetter(self, setter: exprs.Setter, scope):
+        src = self.temp(self(setter.src_expr, scope))
+        for key, value in setter.keys_and_values.items():
+            code = self.temp(self(value, scope))
+            if code == "None":
+                self.out.line(f"delattr({src}, {key!r})")
+            elif not code.isidentifier():
+                # Literals are never None
+                self.out.line(self.assign(src, key, code))
+            else:
+                self.out.line(f"if {code} is None: delattr({src}, {key!r})")
+                self.out.line(f"else: {self.assign(src, key, code)}")
+        return src
+
+    @case("istype")
+    def genIsType(self, istype: exprs.IsType, scope):
+        if issubclass(istype.type_or_expr.__class__, exprs.Expr):
+            raise NotImplementedError("Computed types in IsType cannot be generated")
+        code = self(istype.expr, scope)
+        return f"issubclass(({code}).__class__, {self.const(istype.type_or_expr.record_class)})"
+
+    @case("notexp")
+    def genNot(self, notexp: exprs.Not, scope):
+        return f"(not {self(notexp.expr, scope)})"
+
+    @case("andexp")
+    def genAnd(self, andexp: exprs.And, scope):
+        return self.gen_bool_op(andexp.exprs, scope, "and")
+
+    @case("orexp")
+    def genOr(self, orexp: exprs.Or, scope):
+        return self.gen_bool_op(orexp.exprs, scope, "or")
+
+    def gen_bool_op(self, operands, scope, op):
+        parts = [self.capture(expr, scope) for expr in operands]
+        if not any(lines for lines, _ in parts):
+            return "(" + f" {op} ".join(f"bool({code})" for _, code in parts) + ")"
+        # Nest the operands so later ones are only evaluated when needed
+        result = self.newname("t")
+        self.out.line(f"{result} = {op == 'or'}")
+        test = "" if op == "and" else "not "
+        for level, (lines, code) in enumerate(parts):
+            self.emit(lines, level)
+            self.out.lines.append("    " * (self.out.level + level) + f"if {test}{code}:")
+        self.out.lines.append("    " * (self.out.level + len(parts)) + f"{result} = {op == 'and'}")
+        return result
+
+    @case("ifelse")
+    def genIfElse(self, ifelse: exprs.IfElse, scope):
+        # Fragments produce "if cond then setters(expr) else expr"
+        for shared, other in ((ifelse.exp2, ifelse.exp1), (ifelse.exp1, ifelse.exp2)):
+            if not (shared.is_native or shared.is_var) and \
+                    id(shared) not in scope.thunks and contains(other, shared):
+                self.thunk(shared, scope)
+        cond_lines, cond = self.capture(ifelse.cond, scope)
+        lines1, code1 = self.capture(ifelse.exp1, scope)
+        lines2, code2 = self.capture(ifelse.exp2, scope)
+        if not (cond_lines or lines1 or lines2):
+            return f"({code1} if {cond} else {code2})"
+        self.emit(cond_lines)
+        result = self.newname("t")
+        self.out.line(f"if {cond}:")
+        self.emit(lines1, 1)
+        self.out.lines.append("    " * (self.out.level + 1) + f"{result} = {code1}")
+        self.out.line("else:")
+        self.emit(lines2, 1)
+        self.out.lines.append("    " * (self.out.level + 1) + f"{result} = {code2}")
+        return result
+
+    @case("call")
+    def genCall(self, call: exprs.Call, scope):
+        if not call.operator.is_func:
+            raise NotImplementedError("Calls to computed functions cannot be generated")
+        func = call.operator.func
+        names = list(call.kwargs.keys())
+        codes = self.sequence(call.kwargs.values(), scope)
+        values = {}
+        for name, code in zip(names, codes):
+            if name in func.input_names:
+                values[name] = code
+            elif not is_atomic(code):
+                self.out.line(code)     # Not passed but still evaluated
+        caller, params, by_keyword = self.func_caller(func, scope)
+        return f"{caller}({self.call_args(func, params, by_keyword, values)})"
+
+    @case("fmap")
+    def genFMap(self, fmap: exprs.FMap, scope):
+        if not fmap.func_expr.is_func:
+            raise NotImplementedError("FMaps over computed functions cannot be generated")
+        func = fmap.func_expr.func
+        assert len(func.input_names) == 1
+        param = list(func.input_names)[0]
+        caller, params, by_keyword = self.func_caller(func, scope)
+        src = self(fmap.src_expr, scope)
+        item = self.newname("i")
+        args = self.call_args(func, params, by_keyword, {param: item})
+        return f"[{caller}({args}) for {item} in {src}]"
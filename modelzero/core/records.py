@@ -1,6 +1,8 @@
 
 from ipdb import set_trace
 from collections import defaultdict
+from collections.abc import MutableMapping
+from types import MemberDescriptorType
 from taggedunion import Union, Variant
 import typing
 from modelzero.utils import with_metaclass
@@ -8,6 +10,13 @@ from modelzero.core import errors
 
 __doc_order_by__ = [ "RecordBase", "Field", "RecordMetadata", "Record", "RecordMeta" ]
 
+class _Missing(object):
+    """ Marker for "no value passed" where None is a legitimate value. """
+    def __repr__(self): return "<MISSING>"
+    def __reduce__(self): return "MISSING"
+
+MISSING = _Missing()
+
 class Field(object):
     USE_DEFAULT = None
     def __init__(self, base_type = None, **kwargs):
@@ -63,12 +72,14 @@ class Field(object):
         assert instance is not None, "Instance needed for deleter"
         if self.field_name in instance.__field_values__:
             del instance.__field_values__[self.field_name]
+            mark_dirty(instance, self.field_name)
 
     def __set__(self, instance, value):
         assert self.field_name is not None, "field_name is not set"
         assert instance is not None, "Instance needed for setter"
         value = self.validate(value)
         instance.__field_values__[self.field_name] = value
+        mark_dirty(instance, self.field_name)
 
     def validate(self, value):
         if self.base_type and self.base_type.is_opaque_type and self.base_type.native_type:
@@ -99,16 +110,46 @@ class Field(object):
 
     @property
     def logical_type(self):
+        # Cached along with what it was derived from in case either changes
+        cached = self.__dict__.get("_logical_type", None)
+        if cached and cached[0] is self._base_type and cached[1] == self.optional:
+            return cached[2]
         if not self.base_type:
             set_trace()
             raise Exception("basetype not found")
-        return self.wrap_optionality(self.base_type)
+        logical_type = self.wrap_optionality(self.base_type)
+        self._logical_type = (self._base_type, self.optional, logical_type)
+        return logical_type
+
+def mark_dirty(record, fieldname):
+    """ Records a change to a field of a record whose changes are being tracked. """
+    dirty = getattr(record, "__dirty_fields__", None)
+    if dirty is not None:
+        dirty.add(fieldname)
+
+def holds_mutable_value(field):
+    """ Whether a field holds a record, list or map, ie a value that can be
+    changed in place without the field being set again. """
+    from modelzero.core.types import MZTypes
+    ftype = field.base_type
+    while ftype.is_type_ref or ftype.is_optional_type:
+        ftype = ftype.target if ftype.is_type_ref else ftype.optional_type.base_type
+    if ftype.is_record_type or ftype.is_union_type or ftype.is_sum_type:
+        return True
+    return ftype.is_type_app and ftype.type_app.origin_type in (MZTypes.List, MZTypes.Map)
 
 class RecordMetadata(object):
+    # Bumped every time a field is registered on any record so that anything
+    # derived from record schemas (eg codec plans) knows when to rebuild.
+    generation = 0
+
     def __init__(self, parent_record):
         self._parent_record = parent_record
         self._fieldnames = []
         self._fields = {}
+        self._mutable_fieldnames = None
+        # Bumped whenever a field is registered (see types.cached_resolution)
+        self.version = 0
 
     def __getitem__(self, fieldname):
         return self._fields[fieldname]
@@ -140,8 +181,13 @@ class RecordMetadata(object):
             raise Exception(f"Duplicate field '{fieldname}' found")
 
         curr_field = self._parent_record.__dict__.get(fieldname, None)
-        if curr_field:
+        if type(curr_field) is MemberDescriptorType:
+            # Compact records hold the field's value in a slot of the same name
+            pass
+        elif curr_field:
             assert curr_field == field
+        elif "__field_members__" in self._parent_record.__dict__:
+            raise Exception(f"Cannot add field '{fieldname}' to compact record '{self._parent_record.__name__}' after it is created")
         else:
             setattr(self._parent_record, fieldname, field)
 
@@ -151,6 +197,14 @@ class RecordMetadata(object):
         # (ie via a base class or via a duplicate declaration)?
         self._fieldnames.append(fieldname)
         self._fields[fieldname] = field
+        self._mutable_fieldnames = None
+        self.version += 1
+        RecordMetadata.generation += 1
+
+        # Compiled methods have the field list baked in so regenerate them
+        if getattr(self._parent_record.__dict__.get("validate", None), "__generated__", False):
+            from modelzero.core.codegen import compile_record_methods
+            compile_record_methods(self._parent_record)
         # if not field.checker_name: field.checker_name = "has_" + fieldname
         # setattr(self, field.checker_name, field.makechecker(fieldname))
 
@@ -158,12 +212,292 @@ class RecordMetadata(object):
     def fieldnames(self):
         return iter(self._fieldnames)
 
+    @property
+    def mutable_fieldnames(self):
+        """ Names of the fields whose values can be changed in place (see holds_mutable_value). """
+        if self._mutable_fieldnames is None:
+            self._mutable_fieldnames = frozenset(name for name, field in self.items()
+                                                 if holds_mutable_value(field))
+        return self._mutable_fieldnames
+
+class SlotValues(MutableMapping):
+    """ A dict like view over the slots of a compact record.  This is what
+    __field_values__ returns for compact records so that code reading (or
+    writing) field values by name keeps working regardless of the layout.
+    """
+    __slots__ = ("_record", "_members")
+    def __init__(self, record):
+        self._record = record
+        self._members = record.__field_members__
+
+    def get(self, fieldname, default = None):
+        member = self._members.get(fieldname, None)
+        if member is None: return default
+        try:
+            return member.__get__(self._record)
+        except AttributeError:
+            return default
+
+    def __contains__(self, fieldname):
+        member = self._members.get(fieldname, None)
+        if member is None: return False
+        try:
+            member.__get__(self._record)
+            return True
+        except AttributeError:
+            return False
+
+    def __getitem__(self, fieldname):
+        try:
+            return self._members[fieldname].__get__(self._record)
+        except AttributeError:
+            raise KeyError(fieldname)
+
+    def __setitem__(self, fieldname, value):
+        self._members[fieldname].__set__(self._record, value)
+
+    def __delitem__(self, fieldname):
+        try:
+            self._members[fieldname].__delete__(self._record)
+        except AttributeError:
+            raise KeyError(fieldname)
+
+    def __iter__(self):
+        return (f for f in self._members if f in self)
+
+    def __len__(self):
+        return sum(1 for f in self)
+
+    def __eq__(self, another):
+        return dict(self.items()) == dict(another.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+class LazyFieldValues(MutableMapping):
+    """ The __field_values__ of a record created with RecordBase.lazy.  Wraps
+    the raw values a store loaded (eg a row or a datastore entity) and only
+    validates a field's value the first time it is read.  Any change to the
+    record first materializes all the remaining fields and puts a plain dict
+    of values back on the record.
+    """
+    __slots__ = ("_record", "_source", "_values", "_pending")
+    def __init__(self, record, source):
+        self._record = record
+        self._source = source
+        self._values = {}
+        self._pending = set(f for f in record.__record_metadata__.fieldnames if f in source)
+
+    def _load(self, fieldname):
+        field = self._record.__record_metadata__[fieldname]
+        value = self._values[fieldname] = field.validate(self._source[fieldname])
+        self._pending.discard(fieldname)
+        return value
+
+    def materialize(self):
+        """ Loads all pending fields and replaces this view with a plain dict on the record. """
+        for fieldname in list(self._pending):
+            self._load(fieldname)
+        self._record.__field_values__ = self._values
+        return self._values
+
+    @property
+    def pending(self):
+        """ Names of the fields that have not been read yet. """
+        return self._pending
+
+    def get(self, fieldname, default = None):
+        if fieldname in self._values: return self._values[fieldname]
+        if fieldname in self._pending: return self._load(fieldname)
+        return default
+
+    def __contains__(self, fieldname):
+        return fieldname in self._values or fieldname in self._pending
+
+    def __getitem__(self, fieldname):
+        if fieldname in self._values: return self._values[fieldname]
+        if fieldname in self._pending: return self._load(fieldname)
+        raise KeyError(fieldname)
+
+    def __setitem__(self, fieldname, value):
+        self.materialize()[fieldname] = value
+
+    def __delitem__(self, fieldname):
+        del self.materialize()[fieldname]
+
+    def __iter__(self):
+        return iter(list(self._values) + list(self._pending))
+
+    def __len__(self):
+        return len(self._values) + len(self._pending)
+
+    def __eq__(self, another):
+        return dict(self.items()) == dict(another.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+# Non field attributes that every compact record has a slot for
+COMPACT_ATTRS = ("__dirty_fields__", "__store_state__")
+
+def _compact_getattr(record, name):
+    # Only called when a slot has not been set, so this is where field defaults come from
+    field = record.__slot_fields__.get(name, None)
+    if field is None:
+        if name in COMPACT_ATTRS: return None
+        raise AttributeError(f"'{record.__class__.__name__}' object has no attribute '{name}'")
+    return field.default_value
+
+def _compact_setattr(record, name, value):
+    field = record.__slot_fields__.get(name, None)
+    if field is not None:
+        value = field.validate(value)
+        object.__setattr__(record, name, value)
+        mark_dirty(record, name)
+    else:
+        object.__setattr__(record, name, value)
+
+def _compact_delattr(record, name):
+    try:
+        object.__delattr__(record, name)
+    except AttributeError:
+        if name not in record.__slot_fields__: raise
+        return
+    if name in record.__slot_fields__:
+        mark_dirty(record, name)
+
+def _compact_getstate(record):
+    slot_values = {}
+    for name in record.__compact_slots__:
+        try:
+            slot_values[name] = object.__getattribute__(record, name)
+        except AttributeError:
+            pass
+    return getattr(record, "__dict__", None), slot_values
+
+def _compact_setstate(record, state):
+    instance_dict, slot_values = state
+    if instance_dict: record.__dict__.update(instance_dict)
+    for name, value in slot_values.items():
+        object.__setattr__(record, name, value)
+
+def _get_slot_values(record):
+    return SlotValues(record)
+
+def _set_slot_values(record, values):
+    for member in record.__field_members__.values():
+        try:
+            member.__delete__(record)
+        except AttributeError:
+            pass
+    members = record.__field_members__
+    for fieldname, value in values.items():
+        members[fieldname].__set__(record, value)
+
+def prepare_compact_layout(bases, dct):
+    """ Takes the Fields declared on a compact record class out of its class
+    dict and declares a slot for every field (declared or inherited) and
+    every attribute in __init_attrs__ that does not already have one.  Returns the
+    Fields that were taken out so they can be registered once the class exists.
+
+    Records only go without a __dict__ if every base class declares
+    __slots__ too (as RecordBase, Record and Entity do).
+    """
+    fields = {k: v for k,v in dct.items() if issubclass(v.__class__, Field)}
+    for fieldname in fields: del dct[fieldname]
+
+    inherited = []
+    for base in bases:
+        rmeta = getattr(base, "__record_metadata__", None)
+        if rmeta is not None:
+            inherited = list(rmeta.fieldnames)
+            break
+    extras = [n for b in bases for n in getattr(b, "__init_attrs__", {})]
+    extras += list(dct.get("__init_attrs__", {}))
+    extras += list(COMPACT_ATTRS)
+
+    slots = list(dct.get("__slots__", ()))
+    for name in inherited + list(fields.keys()) + extras:
+        if name in slots: continue
+        if any(type(getattr(b, name, None)) is MemberDescriptorType for b in bases): continue
+        slots.append(name)
+    dct["__slots__"] = tuple(slots)
+    return fields
+
+def finish_compact_layout(record_class):
+    """ Wires up a compact record class once its fields are registered. """
+    rmeta = record_class.__record_metadata__
+    record_class.__field_members__ = {f: getattr(record_class, f) for f in rmeta.fieldnames}
+    record_class.__slot_fields__ = dict(rmeta.items())
+    record_class.__compact_slots__ = tuple(n for k in record_class.__mro__
+                                             for n in k.__dict__.get("__slots__", ()))
+    record_class.__field_values__ = property(_get_slot_values, _set_slot_values)
+    record_class.__getattr__ = _compact_getattr
+    record_class.__setattr__ = _compact_setattr
+    record_class.__delattr__ = _compact_delattr
+    record_class.__getstate__ = _compact_getstate
+    record_class.__setstate__ = _compact_setstate
+
 class RecordBase(object):
     """ Records are our base of all objects that need a representation. """
+    # Compact records keep everything in slots, the others get a __dict__ from RecordMeta
+    __slots__ = ()
+
+    # Non field attributes every instance starts out with and their initial values
+    __init_attrs__ = {}
+
+    # Names of the fields changed since the record was loaded from (or last
+    # written to) a store.  None means changes are not being tracked, ie the
+    # record is new and all of it has to be written.
+    __dirty_fields__ = None
+
+    # What a store kept about the record it loaded (eg the Datastore entity
+    # it was read from) or None.
+    __store_state__ = None
+
     def __init__(self, **kwargs):
+        for attr, value in self.__init_attrs__.items():
+            setattr(self, attr, value)
         self.__field_values__ = {}
         self.apply_patch(kwargs, reject_invalid_fields = True)
 
+    @classmethod
+    def from_values(cls, values):
+        """ Creates a record from field values that have already been validated. """
+        out = cls.__new__(cls)
+        for attr, value in cls.__init_attrs__.items():
+            object.__setattr__(out, attr, value)
+        if hasattr(cls, "__field_members__"):
+            members = cls.__field_members__
+            for name, value in values.items():
+                members[name].__set__(out, value)
+        else:
+            out.__field_values__ = dict(values)
+        return out
+
+    def set_values(self, values):
+        """ Sets field values that have already been validated. """
+        field_values = self.__field_values__
+        for name, value in values.items():
+            field_values[name] = value
+            mark_dirty(self, name)
+        return self
+
+    @classmethod
+    def lazy(cls, source):
+        """ Creates a record over a mapping of raw field values (eg a row
+        loaded by a store) that are only validated as each field is read.
+        See LazyFieldValues.  Compact records hold values in their slots so
+        these are populated right away.
+        """
+        if hasattr(cls, "__field_members__"):
+            return cls(**{f: source[f] for f in cls.__record_metadata__.fieldnames if f in source})
+        out = cls.__new__(cls)
+        for attr, value in cls.__init_attrs__.items():
+            setattr(out, attr, value)
+        out.__field_values__ = LazyFieldValues(out, source)
+        return out
+
     @classmethod
     def register_field(cls, fieldname : str, field : "Type"):
         cls.__record_metadata__.register(fieldname, field)
@@ -207,6 +541,34 @@ class RecordBase(object):
             self.setfield(fieldname, value, reject_invalid_fields)
         return self
 
+    @property
+    def dirty_fields(self):
+        """ Fields changed since mark_clean was last called, None if changes are not tracked. """
+        return self.__dirty_fields__
+
+    @property
+    def changed_fields(self):
+        """ Fields a store has to write for this record.  None if changes are
+        not tracked (so the whole record has to be written), otherwise the
+        dirty fields along with the set fields holding records, lists or maps
+        as those may have been changed in place. """
+        dirty = self.__dirty_fields__
+        if dirty is None: return None
+        mutable = self.__record_metadata__.mutable_fieldnames
+        if not mutable: return dirty
+        values = self.__field_values__
+        return dirty | {name for name in mutable if name in values}
+
+    def mark_clean(self):
+        """ Called by stores once a record is loaded or written to start
+        tracking which fields are changed from here on. """
+        self.__dirty_fields__ = set()
+        return self
+
+    def to_dict(self):
+        """ Returns the value of every field (or its default if not set) by name. """
+        return {name: getattr(self, name) for name in self.__record_metadata__.fieldnames}
+
     def validate(self):
         field_errors = defaultdict(list)
         for name, field in self.__record_metadata__.items():
@@ -224,8 +586,39 @@ class RecordBase(object):
             raise errors.ValidationError(f"Validation failed for {self.__class__}", field_errors)
         return self
 
+def instance_slots(bases):
+    """ The __dict__ (and __weakref__) slots a non compact record class
+    needs that its bases do not already provide. """
+    if not any(b.__dictoffset__ for b in bases): yield "__dict__"
+    if not any(b.__weakrefoffset__ for b in bases): yield "__weakref__"
+
 class RecordMeta(type):
+    """ Metaclass for records.  Collects the Fields declared on a record class
+    into its RecordMetadata.
+
+    Setting `__compact__ = True` on a record class (subclasses inherit it)
+    gives it a compact layout: instead of a per instance dict of field values,
+    every field gets a `__slots__` entry of its own that holds its value.
+    Reading a field becomes a plain slot read and records do not carry a
+    dict around.  Fields then have to be known when the class is created.
+    Other record classes get a `__dict__` unless they declare `__slots__`
+    themselves (which abstract bases like Record do so that compact
+    subclasses stay dict free).
+
+    Setting `__compiled__ = True` (also inherited) generates __init__,
+    validate, __eq__ and to_dict methods specialized to the class's fields
+    (see codegen.compile_record_methods) so constructing and validating
+    records costs about what a hand written class would.
+    """
     def __new__(cls, name, bases, dct):
+        compact = dct.get("__compact__", False) or any(getattr(b, "__compact__", False) for b in bases)
+        compiled = dct.get("__compiled__", False) or any(getattr(b, "__compiled__", False) for b in bases)
+        if compact:
+            compact_fields = prepare_compact_layout(bases, dct)
+        else:
+            compact_fields = {}
+            if "__slots__" not in dct:
+                dct["__slots__"] = tuple(instance_slots(bases))
         x = super().__new__(cls, name, bases, dct)
 
         # Evaluate FQN
@@ -237,10 +630,17 @@ class RecordMeta(type):
         for fieldname,entry in x.__dict__.copy().items():
             if issubclass(entry.__class__, Field):
                 x.register_field(fieldname, entry)
+        if compact:
+            for fieldname,entry in compact_fields.items():
+                x.register_field(fieldname, entry)
+            finish_compact_layout(x)
+        if compiled:
+            from modelzero.core.codegen import compile_record_methods
+            compile_record_methods(x)
         return x
 
-class Record(with_metaclass(RecordMeta, RecordBase)):
-    pass
+class Record(with_metaclass(RecordMeta, RecordBase, dct = {"__slots__": ()})):
+    __slots__ = ()
 
 class PatchRecordBase(Record):
     """ Patch objects represent the "patch actions" that can be performed on the fields of a Record. """
@@ -91,3 +91,10 @@ class RequestParamSource(object):
     def items(self):
         return self.request.values.items()
 
+    @property
+    def body(self):
+        """ The parsed json body of the request or its form values if it is not json. """
+        if self.request_json is not None:
+            return self.request_json
+        return dict(self.request.values.items())
+
@@ -25,7 +25,7 @@ class Clause(object):
 
     def __init__(self, param, value):
         self.fieldname = param
-        self.operator = "eq"
+        self.operator = Clause.OP_EQ
         self.value = value
         for op,opval in Clause.operators.items():
             if param.endswith("__" + op):
@@ -49,6 +49,7 @@ class Query(Generic[T]):
         self._field_ordering = []
         self._filter_clauses = []
         self._projection = []
+        self._lazy = False
 
     def __eq__(self, another):
         if type(another) != Query: return False
@@ -57,6 +58,7 @@ class Query(Generic[T]):
         if self._field_ordering != another._field_ordering: return False
         if self._projection != another._projection: return False
         if self._filter_clauses != another._filter_clauses: return False
+        if self._lazy != another._lazy: return False
         return True
 
     @property
@@ -116,6 +118,16 @@ class Query(Generic[T]):
         self._projection = field_names
         return self
 
+    @property
+    def lazy(self):
+        return self._lazy
+
+    def set_lazy(self, lazy = True) -> "Query":
+        """ Asks for results to be lazy records (see RecordBase.lazy) whose
+        fields are only decoded and validated when they are first read. """
+        self._lazy = lazy
+        return self
+
 class Table(Generic[T]):
     """ A table is the logical storage provider for entities (eg as rows) and is 
     responsible for ensuring loading an persistance of Entities.
@@ -157,6 +169,13 @@ class Table(Generic[T]):
     def query(self) -> Query[T]:
         return Query(self._entity_class)
 
+    def scan(self, prefix = (), start = None, end = None, limit = None) -> List[T]:
+        """ Returns entities in key order whose keys start with the parts in
+        prefix and fall in the range [start, end).  start and end are
+        (possibly partial) tuples of key parts compared like tuples, eg
+        scan(prefix = ("phone",)) returns all Channels with a phone login. """
+        assert False, "Not implemented"
+
     def fetch(self, query : Query[T]) -> List[T]:
         """ Queries the table for entries that match a certain conditions and then sorting (if required) and returns results in a particular window. """
         return []
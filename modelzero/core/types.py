@@ -1,6 +1,6 @@
 
 from ipdb import set_trace
-import typing, datetime, inspect
+import typing, datetime, inspect, weakref
 from typing import List, Dict, Tuple
 from taggedunion import Union, Variant
 
@@ -38,10 +38,39 @@ class TypeVar(object):
     def __init__(self, name : str):
         self.varname = name
 
+def cached_resolution(owner, key, resolve, deps = None):
+    """ Returns resolve(deps) cached on owner under key.
+
+    resolve appends the RecordMetadata and DataTypes it looks at to deps
+    and its result is reused until one of them changes (ie gets a new
+    field or child).  Failures are cached as their exception type and
+    arguments and raised anew every time.  If deps is given the
+    dependencies of the result are added to it.
+    """
+    cache = owner.__dict__.get("_resolution_cache", None)
+    if cache is None:
+        cache = owner.__dict__["_resolution_cache"] = {}
+    entry = cache.get(key, None)
+    if entry is None or any(dep.version != version for dep, version in entry[2]):
+        found = []
+        try:
+            ok, value = True, resolve(found)
+        except Exception as exc:
+            ok, value = False, (type(exc), exc.args)
+        entry = cache[key] = (ok, value, tuple((dep, dep.version) for dep in found))
+    ok, value, entry_deps = entry
+    if deps is not None:
+        deps.extend(dep for dep, version in entry_deps)
+    if not ok:
+        raise value[0](*value[1])
+    return value
+
 class DataType(object):
     def __init__(self, name : str = None):
         self._name = name
         self._children = []
+        # Bumped whenever a child is added (see cached_resolution)
+        self.version = 0
 
     @property
     def name(self): return self._name
@@ -57,6 +86,7 @@ class DataType(object):
     def add(self, *children : List["Type"]):
         for child in children:
             self._children.append(ensure_type(child))
+        self.version += 1
         return self
 
 class OptionalType(DataType):
@@ -101,8 +131,15 @@ class RecordType(object):
             raise Exception(f"Found {record_class_or_fqn}, Expected str or 'Record' class")
 
     def type_for_key(self, key):
-        field = self.record_class.__record_metadata__[key]
-        return field.logical_type
+        """ Type of a field (or an annotated property) of the record, None if there is no such member. """
+        rmeta = self.record_class.__record_metadata__
+        if key in rmeta:
+            return rmeta[key].logical_type
+        # See if a property matches
+        prop = getattr(self.record_class, key, None)
+        if type(prop) is property:
+            return ensure_type(inspect.signature(prop.fget).return_annotation)
+        return None
 
     @classmethod
     def new_record_class(cls, name, **class_dict):
@@ -144,13 +181,19 @@ class SumType(DataType):
         for v in variants:
             self.add(v)
 
-    def child_if_exists_in_all_variants(self, name):
+    def child_if_exists_in_all_variants(self, name, deps = None):
+        return cached_resolution(self, name, lambda found: self._child_in_all_variants(name, found), deps)
+
+    def _child_in_all_variants(self, name, deps = None):
+        deps = [] if deps is None else deps
+        deps.append(self)
         candidates = []
         queue = list(self.children)
         while queue:
             ch = queue.pop()
             if ch.is_record_type:
                 rmeta = ch.record_class.__record_metadata__
+                deps.append(rmeta)
                 if name not in rmeta: return None
                 candidates.append(rmeta[name].logical_type)
             elif ch.is_union_type:
@@ -159,6 +202,7 @@ class SumType(DataType):
                 candidates.append(vt)
             elif ch.is_sum_type:
                 # add 
+                deps.append(ch.sum_type)
                 for ch in ch.sum_type.children:
                     queue.append(ch)
             else:   # We have non collection types so this cannot be shared field
@@ -192,23 +236,35 @@ class Type(Union):
         return Type.as_type_app(self, *keys)
 
     def type_for_field_path(self, *parts):
+        """ Type of the value at a path of field names (or indexes into
+        sum/product types) from this type.  Results (including failures) are
+        cached on the type until a record or type along the path changes. """
+        return cached_resolution(self, parts, lambda deps: self._type_for_field_path(parts, deps))
+
+    def _type_for_field_path(self, parts, deps):
         curr = self
         for p in parts:
             if type(p) is int:
                 assert curr.is_sum_type or curr.is_product_type
+                deps.append(curr.sum_type if curr.is_sum_type else curr.product_type)
                 curr = curr.type_at(p)
             elif type(p) is str:
                 if curr.is_sum_type:
                     # This is an interesting case, we will go deeper here
                     # if "p" exists in "all" the variants of 'curr'
-                    curr = curr.sum_type.child_if_exists_in_all_variants(p)
+                    curr = curr.sum_type.child_if_exists_in_all_variants(p, deps)
                     if curr is None:
                         raise Exception(f"Part '{p}' has different types across sum type")
                 elif not curr.is_record_type and not curr.is_union_type:
                     set_trace()
                     assert False
                 else:
-                    curr = curr.type_for_key(p)
+                    if curr.is_record_type:
+                        deps.append(curr.record_class.__record_metadata__)
+                    child = curr.type_for_key(p)
+                    if child is None:
+                        raise Exception(f"Attribute '{p}' not found in '{curr}'")
+                    curr = child
             else:
                 set_trace()
                 raise Exception("Type being indexed can only be sum, product, record or union types")
@@ -227,6 +283,68 @@ class Type(Union):
             self.sum_type.child_if_exists_in_all_variants(name)
         return None
 
+    # Set on the one shared instance of each structurally distinct type (see intern_type)
+    __interned__ = False
+
+    def __eq__(self, another):
+        if self is another: return True
+        if type(another) is not Type: return False
+        # Interned types that are not the same object are different types
+        if self.__interned__ and another.__interned__: return False
+        return super().__eq__(another)
+
+    def __hash__(self):
+        if self.__interned__: return id(self) >> 4
+        return super().__hash__()
+
+# Types are hash consed - constructing a type that is structurally equal to
+# an existing one returns the existing instance.  Sum, product and function
+# types are left alone as they are either mutable or compared by identity.
+_interned_types = weakref.WeakValueDictionary()
+
+def _structural_key(t):
+    if t.is_opaque_type:
+        return ("opaque", t.opaque_type.name)
+    if t.is_type_app:
+        return ("app", t.type_app.origin_type, tuple(t.type_app.type_args))
+    if t.is_optional_type:
+        return ("optional", t.optional_type.base_type)
+    if t.is_record_type:
+        rt = t.record_type
+        return ("record", rt._record_class or rt._record_fqn)
+    if t.is_union_type:
+        ut = t.union_type
+        return ("union", ut._union_class or ut._union_fqn)
+    if t.is_type_ref:
+        return ("ref", t.type_ref.target_fqn)
+    if t.is_type_var:
+        return ("var", t.type_var.varname)
+    return None
+
+def intern_type(t):
+    """ Returns the shared instance of types structurally equal to t. """
+    if t.__interned__: return t
+    key = _structural_key(t)
+    if key is None: return t
+    existing = _interned_types.get(key, None)
+    if existing is not None: return existing
+    t.__interned__ = True
+    _interned_types[key] = t
+    return t
+
+def _make_interning_constructor(name):
+    construct = getattr(Type, name).__func__
+    def constructor(cls, *args, **kwargs):
+        if name == "as_optional_type" and len(args) == 1 and type(args[0]) is Type and args[0].is_optional_type:
+            # Optional of an optional is the same optional
+            return args[0]
+        return intern_type(construct(cls, *args, **kwargs))
+    return classmethod(constructor)
+
+for _vname, _variant in Type.__variants__:
+    for _ctor in (_variant.constructor, _variant.from_constructor):
+        setattr(Type, _ctor, _make_interning_constructor(_ctor))
+
 class MZTypes:
     Int = Type.as_opaque_type("int", int)
     Long = Type.as_opaque_type("long", int)
@@ -241,7 +359,28 @@ class MZTypes:
     Key = Type.as_opaque_type("key")
     DateTime = Type.as_opaque_type("DateTime", datetime.datetime)
 
+# Conversions of typing aliases (eg List[int]).  Record classes and fqns are
+# not kept here as that would keep (generated) record classes alive forever;
+# their types are interned anyway.
+_ensured_aliases = {}
+
 def ensure_type(t):
+    if type(t) is Type: return t
+    if not isinstance(t, typing._GenericAlias):
+        return _ensure_type(t)
+    try:
+        return _ensured_aliases[t]
+    except (KeyError, TypeError):
+        pass
+    out = _ensure_type(t)
+    try:
+        _ensured_aliases[t] = out
+    except TypeError:
+        # Not hashable so cannot be memoized
+        pass
+    return out
+
+def _ensure_type(t):
     if t in (None, inspect._empty):
         return None
     if t is str:
@@ -250,7 +389,7 @@ def ensure_type(t):
         return MZTypes.Int
     if t is bool:
         return MZTypes.Bool
-    if type(t) is typing._GenericAlias:
+    if isinstance(t, typing._GenericAlias):
         if t.__origin__ == list:
             return MZTypes.List[ensure_type(t.__args__[0])]
         if t.__origin__ == dict:
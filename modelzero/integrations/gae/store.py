@@ -36,29 +36,51 @@ class GAETable(Table[T]):
     @property
     def dsclient(self): return self._dsclient
 
-    def fromDatastore(self, entity) -> T:
+    def fromDatastore(self, entity, lazy = False) -> T:
         if entity is None:
             return None
         builtin_list = list
         if isinstance(entity, builtin_list):
             entity = entity.pop()
-        out = self._entity_class()
-        for k,v in entity.items():
-            setattr(out, k, v)
-        # set the key
-        key = self._entity_class.Key(entity.key.id_or_name)
-        out.setkey(key)
-        return out
+        if lazy:
+            out = self._entity_class.lazy(entity)
+        else:
+            # Properties that are no longer fields of the entity are ignored
+            fieldnames = self._entity_class.__record_metadata__.fieldnames
+            out = self._entity_class(**{f: entity[f] for f in fieldnames if f in entity})
+        # set the key - stored keys are already validated so are not parsed again
+        key_fields = self._entity_class.key_fields()
+        if not key_fields:
+            out.setkey(Key.from_parts(self._entity_class, (entity.key.id_or_name,)))
+        elif any(f not in entity for f in key_fields):
+            # Composite ids are the "/" separated values of the key fields
+            out.setkey(self._entity_class.Key(entity.key.id_or_name))
+        # Otherwise the key fields were loaded (and validated) with the other fields
+        # Hold on to the loaded entity so later puts only apply changed fields to it
+        out.__store_state__ = entity
+        return out.mark_clean()
 
     def toDatastore(self, entity : T):
-        dsc = self.dsclient
-        if entity.getkey():
-            # Create one - this means our entity needs auto generated keys
-            key = dsc.key(self._entity_class.__fqn__, entity.getkey().value)
+        dsentity = entity.__store_state__
+        changed_fields = entity.changed_fields
+        if dsentity is not None and changed_fields is not None and entity.getkey() and \
+                dsentity.key.id_or_name == entity.getkey().value:
+            # Only the changed fields need to be copied over
+            fieldnames = changed_fields
         else:
-            key = dsc.key(self._entity_class.__fqn__)
-        dsentity = datastore.Entity(key=key)
-        for field,value in entity.__field_values__.items():
+            dsc = self.dsclient
+            if entity.getkey():
+                # Create one - this means our entity needs auto generated keys
+                key = dsc.key(self._entity_class.__fqn__, entity.getkey().value)
+            else:
+                key = dsc.key(self._entity_class.__fqn__)
+            dsentity = datastore.Entity(key=key)
+            fieldnames = entity.__field_values__.keys()
+        for field in fieldnames:
+            if field not in entity.__field_values__:
+                dsentity.pop(field, None)
+                continue
+            value = entity.__field_values__[field]
             if type(value) is Key:
                 dsentity[field] = value.value
             else:
@@ -80,7 +102,13 @@ class GAETable(Table[T]):
 
     # Update methods
     def put(self, entity : T, validate = True) -> T:
-        """ Updates this entity by first validating it and then persisting it. """
+        """ Updates this entity by first validating it and then persisting it.
+        Entities loaded from the datastore that have not changed are not
+        written again.  Datastore always writes whole entities so changed
+        entities only avoid re-converting their unchanged fields. """
+        changed_fields = entity.changed_fields
+        if changed_fields is not None and not changed_fields:
+            return entity
         if validate:
             entity.validate()
         dsentity = self.toDatastore(entity)
@@ -117,5 +145,5 @@ class GAETable(Table[T]):
         if query.field_ordering:
             dsquery.order = [field if asc else "-"+ field for field,asc in query.field_ordering]
         results = dsquery.fetch(limit = query.limit, offset = query.offset)
-        entities = list(map(self.fromDatastore, results))
+        entities = [self.fromDatastore(entity, query.lazy) for entity in results]
         return entities
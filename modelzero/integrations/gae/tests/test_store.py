@@ -0,0 +1,82 @@
+import pytest
+from ipdb import set_trace
+
+datastore = pytest.importorskip("google.cloud.datastore")
+
+from modelzero.core.records import Field
+from modelzero.core.types import MZTypes
+from modelzero.core.entities import Entity, Key
+from modelzero.integrations.gae import store
+
+class Client(object):
+    """ An in memory stand in for a datastore client. """
+    def __init__(self):
+        self.entities = {}
+        self.puts = []
+
+    def key(self, kind, id_or_name = None):
+        return datastore.Key(kind, id_or_name, project = "test")
+
+    def get(self, key):
+        return self.entities.get(key.flat_path, None)
+
+    def put(self, entity):
+        self.puts.append(entity)
+        stored = datastore.Entity(key = entity.key)
+        stored.update(entity)
+        self.entities[entity.key.flat_path] = stored
+
+class CompactRecord(Entity):
+    __compact__ = True
+    name = Field(MZTypes.String)
+    age = Field(MZTypes.Int)
+
+def test_load_and_put(mocker):
+    table = store.GAETable(Client(), CompactRecord)
+    table.put(CompactRecord(__key__ = "123", name = "Hello", age = 10))
+
+    key = CompactRecord.Key("123")
+    from_value = mocker.spy(Key, "fromValue")
+    entity = table.get_by_key(key)
+    assert not hasattr(entity, "__dict__")
+    assert (entity.name, entity.age) == ("Hello", 10)
+    # The stored key is not parsed again
+    assert entity.getkey() == key and from_value.call_count == 0
+
+    # Unchanged entities are not written again
+    table.put(entity)
+    assert len(table.dsclient.puts) == 1
+    entity.age = 11
+    table.put(entity)
+    assert len(table.dsclient.puts) == 2
+    # The loaded entity was updated in place
+    assert table.dsclient.puts[-1] is entity.__store_state__
+    loaded = table.get_by_key("123")
+    assert (loaded.name, loaded.age) == ("Hello", 11)
+
+def test_load_ignores_old_properties(mocker):
+    client = Client()
+    table = store.GAETable(client, CompactRecord)
+    stored = datastore.Entity(key = client.key(CompactRecord.__fqn__, "1"))
+    stored.update(name = "Hello", age = 10, nickname = "old")
+    client.put(stored)
+    entity = table.get_by_key("1")
+    assert (entity.name, entity.age) == ("Hello", 10)
+    assert "nickname" not in entity
+
+class PairRecord(Entity):
+    __compact__ = True
+    kind = Field(MZTypes.String)
+    number = Field(MZTypes.Int)
+
+    @classmethod
+    def key_fields(cls):
+        return ["kind", "number"]
+
+def test_composite_keys(mocker):
+    table = store.GAETable(Client(), PairRecord)
+    table.put(PairRecord(kind = "a", number = 3))
+    key = PairRecord.Key("a", 3)
+    from_value = mocker.spy(Key, "fromValue")
+    entity = table.get_by_key(key)
+    assert entity.getkey() == key and from_value.call_count == 0
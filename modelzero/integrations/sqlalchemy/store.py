@@ -3,10 +3,11 @@ import logging
 from ipdb import set_trace
 from typing import TypeVar, Generic, List, Type
 from taggedunion import CaseMatcher, case
-from modelzero.core import errors, types
+from modelzero.core import errors, types, codec
 from modelzero.core.store import DataStore
 from modelzero.core.store import Table as MZTable, Clause, Query
 from modelzero.core.entities import Key, KEY_FIELD
+from modelzero.core.records import Field
 
 from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, DateTime, Float, Binary, MetaData, Table, ForeignKeyConstraint, PrimaryKeyConstraint
 from sqlalchemy.orm import relationship
@@ -81,6 +82,33 @@ class Flattener(object):
         """ Flattens a value of our entity_type into the result set. """
         return None
 
+def record_class_of(field):
+    """ The record class of a record typed field (whose fields are flattened
+    into columns of their own) or None. """
+    base_type = field.base_type
+    if base_type.is_type_ref: base_type = base_type.target
+    return base_type.record_class if base_type.is_record_type else None
+
+class DecodedRow(object):
+    """ A view over a row that decodes the values of codec encoded columns
+    and rebuilds record fields from their flattened columns when they are
+    read. """
+    def __init__(self, row, table):
+        self.row = row
+        self.table = table
+
+    def __contains__(self, name):
+        return name in self.row
+
+    def __getitem__(self, name):
+        table = self.table
+        if name in table.record_fields:
+            return table.table_fields_to_value(self.row, table.record_fields[name], name)
+        value = self.row[name]
+        if value is not None and name in table.binary_fields:
+            value = codec.decode_named(value, table.binary_fields[name])
+        return value
+
 class SQLTable(MZTable[T]):
     """ A SQL table over an entity. """
     def __init__(self, sql_store : SQLStore, entity_class : Type[T] = T):
@@ -91,6 +119,8 @@ class SQLTable(MZTable[T]):
         self._field_path_index = {}
         self._sa_table = None
         self._sa_table_class = None
+        self._binary_fields = None
+        self._record_fields = None
         self.create_table()
 
     @property
@@ -112,9 +142,9 @@ class SQLTable(MZTable[T]):
                 self._field_path_index[colname] = colindex
 
                 sa_column = Column(KEY_FIELD, String, primary_key = True)
-                column = ColumnInfo(column.name, sa_column, colindex, -1, None)
+                column = ColumnInfo(colname, sa_column, colindex, -1, None)
                 self._columns.append(column)
-                self._sa_table.append_column(column)
+                self._sa_table.append_column(sa_column)
 
             for fieldname,field in self._entity_class.__record_metadata__.items():
                 self.field_to_column(field.logical_type, fieldname)
@@ -151,22 +181,17 @@ class SQLTable(MZTable[T]):
         # Register the column
         if type(columns) is not list: columns = [columns]
         for sa_column in columns:
+            if sa_column is None: continue
             colindex = len(self._columns)
             colname = sa_column.name
 
-            if column.name in self._field_path_index:
-                set_trace()
-                raise Exception(f"Column with name '{column.name}' already exists")
-
-                sa_column = Column(KEY_FIELD, String, primary_key = True)
-                column = ColumnInfo(column.name, sa_column, colindex, -1, None)
-                self._columns.append(column)
-                self._sa_table.append_column(column)
-
+            if colname in self._field_path_index:
+                raise Exception(f"Column with name '{colname}' already exists")
 
-            self._field_path_index[column.name] = colindex
+            column = ColumnInfo(colname, sa_column, colindex, -1, None)
+            self._field_path_index[colname] = colindex
             self._columns.append(column)
-            self._sa_table.append_column(column)
+            self._sa_table.append_column(sa_column)
 
         # Add any constraints
         for fkc in f2c.fkey_constraints:
@@ -176,41 +201,102 @@ class SQLTable(MZTable[T]):
         child_optional = optional or field_type.is_optional_type or field_type.is_sum_type or field_type.is_union_type
         for childname,childtype in children:
             ourname = field_name + "_" + childname
+            if issubclass(childtype.__class__, Field): childtype = childtype.logical_type
             self.field_to_column(childtype, ourname, child_optional)
 
-    def fromDatastore(self, entity) -> T:
-        if entity is None:
+    def fromDatastore(self, row, lazy = False) -> T:
+        if row is None:
             return None
         builtin_list = list
-        if isinstance(entity, builtin_list):
-            entity = entity.pop()
-        out = self._entity_class()
-        set_trace()
-        for k,v in entity.items():
-            setattr(out, k, v)
+        if isinstance(row, builtin_list):
+            row = row.pop()
+        if self.binary_fields or self.record_fields:
+            row = DecodedRow(row, self)
+        if lazy:
+            out = self._entity_class.lazy(row)
+        else:
+            values = {}
+            for fieldname in self._entity_class.__record_metadata__.fieldnames:
+                if fieldname in row:
+                    values[fieldname] = row[fieldname]
+            out = self._entity_class(**values)
         # set the key
-        key = self._entity_class.Key(entity.key.id_or_name)
-        out.setkey(key)
-        return out
+        if not self._entity_class.key_fields():
+            # Stored keys are already validated so are not parsed again
+            out.setkey(Key.from_parts(self._entity_class, (row[KEY_FIELD],)))
+        # Track changes from here on so puts only write changed columns
+        return out.mark_clean()
+
+    @property
+    def binary_fields(self):
+        """ Fields (by name) whose values are stored as a Binary column encoded with codec.encode_named. """
+        if self._binary_fields is None:
+            self._binary_fields = {}
+            for fieldname, field in self._entity_class.__record_metadata__.items():
+                base_type = field.base_type
+                if base_type.is_type_ref: base_type = base_type.target
+                if base_type.is_type_app and base_type.type_app.origin_type in (types.MZTypes.List, types.MZTypes.Map):
+                    self._binary_fields[fieldname] = base_type
+        return self._binary_fields
+
+    @property
+    def record_fields(self):
+        """ Record typed fields (by name) that are stored as a presence column
+        and the columns of their own fields (prefixed with the field name). """
+        if self._record_fields is None:
+            self._record_fields = {fieldname: field for fieldname, field in self._entity_class.__record_metadata__.items()
+                                   if record_class_of(field) is not None}
+        return self._record_fields
+
+    def table_fields_to_value(self, row, field, fullpath):
+        """ Rebuilds the value of a field from the columns it was flattened into. """
+        record_class = record_class_of(field)
+        if record_class is None:
+            return row[fullpath]
+        if not row[fullpath]:
+            return None
+        values = {}
+        for childname, child in record_class.__record_metadata__.items():
+            value = self.table_fields_to_value(row, child, fullpath + "_" + childname)
+            if value is not None:
+                values[childname] = value
+        return record_class(**values)
 
     def entity_to_table_fields(self, parent, fieldname, key_fields, entity_fields, prefix = ""):
         fullpath = fieldname if not prefix else (prefix + "_" + fieldname)
-        value = parent.__field_values__[fieldname]
-        valuetype = parent.__record_metadata__[fieldname].logical_type
-        if valuetype.is_record_type:
-            entity_fields[fullpath] = value is not None
-            if value:
-                # need to recurse
-                for field,fvalue in value.__field_values__.items():
-                    self.entity_to_table_fields(value, field, key_fields, entity_fields, fullpath)
+        field = parent.__record_metadata__[fieldname]
+        value = parent.__field_values__.get(fieldname, None)
+        if value is None:
+            self.null_table_fields(field, entity_fields, fullpath)
+            return
+        valuetype = field.logical_type
+        record_class = record_class_of(field)
+        if record_class is not None:
+            entity_fields[fullpath] = True
+            # All the flattened columns are written so fields not set in the value are cleared
+            for childname in record_class.__record_metadata__.fieldnames:
+                self.entity_to_table_fields(value, childname, key_fields, entity_fields, fullpath)
         elif valuetype.is_union_type:
             set_trace()
             entity_fields[fullpath] = value is not None
+        elif not prefix and fieldname in self.binary_fields:
+            entity_fields[fullpath] = codec.encode_named(value)
         else:
             # leaf/native values
-            entity_fields[fullpath] = parent.__field_values__[fieldname]
-
-    def toDatastore(self, entity : T):
+            entity_fields[fullpath] = value
+
+    def null_table_fields(self, field, entity_fields, fullpath):
+        """ Nulls the column of a field and, for record fields, the columns
+        their fields are flattened into. """
+        entity_fields[fullpath] = None
+        record_class = record_class_of(field)
+        if record_class is not None:
+            for childname, child in record_class.__record_metadata__.items():
+                self.null_table_fields(child, entity_fields, fullpath + "_" + childname)
+
+    def toDatastore(self, entity : T, fieldnames = None):
+        """ Flattens an entity into its key and field columns.  If fieldnames
+        is provided only those (top level) fields are flattened. """
         key_fields = {}
         entity_fields = {}
 
@@ -220,49 +306,94 @@ class SQLTable(MZTable[T]):
                 key_fields[KEY_FIELD] = entity.getkey().value
             else:
                 set_trace()
-        for field,value in entity.__field_values__.items():
+        if fieldnames is None:
+            fieldnames = entity.__field_values__.keys()
+        for field in fieldnames:
+            # Cleared fields null out their columns
             self.entity_to_table_fields(entity, field, key_fields, entity_fields)
         return key_fields, entity_fields
 
+    def _key_clause(self, key : Key):
+        """ Returns the where clause that selects the row for a given key. """
+        from sqlalchemy import and_
+        cols = self.sa_table.c
+        key_fields = self._entity_class.key_fields()
+        if not key_fields:
+            return getattr(cols, KEY_FIELD) == key.value
+        return and_(*[getattr(cols, kf) == key.parts[i] for i,kf in enumerate(key_fields)])
+
     # GET methods
     def get_by_key(self, key : Key, nothrow = True) -> T:
         from sqlalchemy import select, and_, or_, not_, asc, desc, all_
-        stmt = select([self.sa_table])
         if type(key) is not Key:
             key = self._entity_class.Key(key)
-        key_fields = self._entity_class.key_fields()
-        if not key_fields:
-            stmt = stmt.where(getattr(self.sa_table.c, KEY_FIELD) == key.value)
-        else:
-            for i,kf in enumerate(key_fields):
-                stmt = stmt.where(getattr(self.sa_table.c, kf) == key.parts[i])
-
-        results = self.sql_store.dbengine.execute(stmt)
-        entity = list(map(self.fromDatastore, results))
-        return entity
+        stmt = select([self.sa_table]).where(self._key_clause(key))
+        row = self.sql_store.dbengine.execute(stmt).first()
+        if row is None:
+            if not nothrow:
+                raise errors.NotFound("Object not found for Key: " + str(key))
+            return None
+        return self.fromDatastore(row)
 
     # Update methods
     def put(self, entity : T, validate = True) -> T:
-        """ Updates this entity by first validating it and then persisting it. """
+        """ Updates this entity by first validating it and then persisting it.
+
+        Entities that were loaded from (or already written to) this table
+        track their changed fields so only those columns are UPDATEd (see
+        RecordBase.changed_fields).  New entities, and tracked entities
+        whose row no longer exists (eg it was deleted or the key changed),
+        are INSERTed as a whole.
+        """
+        changed_fields = entity.changed_fields
+        if changed_fields is not None and not changed_fields:
+            # Nothing has changed since this was last loaded or saved
+            return entity
         if validate:
             entity.validate()
-        from sqlalchemy import insert
         table = self.sa_table
-        cols = table.c
-        stmt = table.insert()
+        dbengine = self.sql_store.dbengine
+        if changed_fields is not None:
+            key_fields, entity_fields = self.toDatastore(entity, changed_fields)
+            stmt = table.update().where(self._key_clause(entity.getkey())).values(**entity_fields)
+            if dbengine.execute(stmt).rowcount > 0:
+                return entity.mark_clean()
         key_fields, entity_fields = self.toDatastore(entity)
-        all_fields = dict(entity_fields, **key_fields)
-        stmt = stmt.values(**all_fields)
-        result = self.sql_store.dbengine.execute(stmt)
-        return entity
+        dbengine.execute(table.insert().values(**dict(entity_fields, **key_fields)))
+        return entity.mark_clean()
 
     # Delete methods
     def delete_by_key(self, key : Key):
+        """ Delete an entry given its Key. """
         if type(key) is not Key:
             key = self._entity_class.Key(key)
-        """ Delete an entry given its Key. """
-        dskey = self.dsclient.key(self._entity_class.__fqn__, key.value)
-        self.dsclient.delete(dskey)
+        stmt = self.sa_table.delete().where(self._key_clause(key))
+        self.sql_store.dbengine.execute(stmt)
+
+    def scan(self, prefix = (), start = None, end = None, limit = None) -> List[T]:
+        from sqlalchemy import select, and_, tuple_
+        table = self.sa_table
+        key_fields = self._entity_class.key_fields() or [KEY_FIELD]
+        rmeta = self._entity_class.__record_metadata__
+        cols = [getattr(table.c, kf) for kf in key_fields]
+        def validated(parts):
+            return [rmeta[kf].validate(p) if kf in rmeta else p for kf,p in zip(key_fields, parts)]
+        def leading(parts):
+            # Compare the leading columns as a row value so partial keys work like tuples
+            n = len(parts)
+            return (cols[0], parts[0]) if n == 1 else (tuple_(*cols[:n]), tuple_(*parts))
+        conditions = [col == part for col,part in zip(cols, validated(prefix))]
+        if start:
+            lhs, rhs = leading(validated(start))
+            conditions.append(lhs >= rhs)
+        if end:
+            lhs, rhs = leading(validated(end))
+            conditions.append(lhs < rhs)
+        stmt = select([table]).order_by(*cols)
+        if conditions: stmt = stmt.where(and_(*conditions))
+        if limit is not None: stmt = stmt.limit(limit)
+        results = self.sql_store.dbengine.execute(stmt)
+        return [self.fromDatastore(row) for row in results]
 
     OPS = {
             Clause.OP_EQ: lambda f,v: f == v,
@@ -271,7 +402,7 @@ class SQLTable(MZTable[T]):
         Clause.OP_LE: lambda f,v: f <= v,
         Clause.OP_GT: lambda f,v: f > v,
         Clause.OP_GE: lambda f,v: f >= v,
-        Clause.OP_IN: lambda f,v: f in v,
+        Clause.OP_IN: lambda f,v: f.in_(v),
     }
 
     def fetch(self, query : Query[T]) -> List[T]:
@@ -283,7 +414,7 @@ class SQLTable(MZTable[T]):
         efields = self._entity_class.__record_metadata__
         if query.filters:
             # assert f.fieldname in efields, "Clause refers to field (%s) not in entity class (%s)" % (f.fieldname, self._entity_class)
-            and_args = [OPS[f.operator](getattr(cols, f.fieldname), f.value) for f in query.filters]
+            and_args = [SQLTable.OPS[f.operator](getattr(cols, f.fieldname), f.value) for f in query.filters]
             stmt = stmt.where(and_(*and_args))
         if query.field_ordering:
             order_args = [(asc if is_asc else desc)(getattr(cols, field))  for field,is_asc in query.field_ordering]
@@ -291,7 +422,7 @@ class SQLTable(MZTable[T]):
         if query.limit: stmt = stmt.limit(query.limit)
         if query.offset: stmt = stmt.offset(query.offset)
         results = self.sql_store.dbengine.execute(stmt)
-        entities = list(map(self.fromDatastore, results))
+        entities = [self.fromDatastore(row, query.lazy) for row in results]
         return entities
 
 class FieldToColumns(CaseMatcher):
@@ -304,7 +435,7 @@ class FieldToColumns(CaseMatcher):
     def for_record_type(self, type_data : types.RecordType, field_name : str, optional : bool = False):
         # Just holds if the value is null or not
         column = Column(field_name, Boolean, nullable = optional)
-        return None, type_data.record_class.__record_metadata__.items()
+        return column, type_data.record_class.__record_metadata__.items()
 
     @case("product_type")
     def for_product_type(self, type_data : types.ProductType, field_name : str, optional : bool = False):
@@ -350,11 +481,9 @@ class FieldToColumns(CaseMatcher):
             raise Exception("Arbitrary Generics not yet supported")
 
         opaque_type = origin_type.opaque_type
-        if origin_type == types.MZTypes.List:
+        if origin_type == types.MZTypes.List or origin_type == types.MZTypes.Map:
+            # Stored encoded with the codec (see SQLTable.binary_fields)
             return Column(field_name, Binary, nullable = optional), []
-        elif origin_type == types.MZTypes.Map:
-            set_trace()
-            a = 2
         elif origin_type == types.MZTypes.Key:
             # Nothing to be done - should be taken care by 
             # above
@@ -2,12 +2,14 @@
 from datetime import datetime
 import pytest
 from ipdb import set_trace
-from sqlalchemy import create_engine, String, DateTime, Boolean, Integer
+from sqlalchemy import create_engine, String, DateTime, Boolean, Integer, LargeBinary
 from sqlalchemy_utils import database_exists, create_database, drop_database
 
-from modelzero.core.records import Field
-from modelzero.core.types import MZTypes
+from modelzero.core.records import Field, Record
+from modelzero.common.fields import ListField, MapField
+from modelzero.core.types import MZTypes, Type
 from modelzero.common.entities import BaseEntity
+from modelzero.core.entities import Key
 from modelzero.integrations.sqlalchemy import store
 
 @pytest.fixture
@@ -50,5 +52,160 @@ def test_put_table(mocker, dbengine):
             name = "Hello", age = 1000, smart = True)
     entity = table.put(entity)
 
-    entity2 = table.get_by_key("123")
+    key = SimpleRecord.Key("123")
+    from_value = mocker.spy(Key, "fromValue")
+    entity2 = table.get_by_key(key)
     assert entity == entity2
+    # The stored key is not parsed again
+    assert entity2.getkey() == key and from_value.call_count == 0
+
+def test_put_updates_changed_columns(mocker, dbengine):
+    sql_store = store.SQLStore(dbengine)
+    table = sql_store.get_table(SimpleRecord)
+    entity = SimpleRecord(is_active = True, created_at = datetime.utcnow(), updated_at = datetime.utcnow(), __key__ = "123",
+            name = "Hello", age = 1000, smart = True)
+    table.put(entity)
+
+    entity2 = table.get_by_key("123")
+    assert entity2.dirty_fields == set()
+    mocker.spy(dbengine, "execute")
+    table.put(entity2)
+    assert dbengine.execute.call_count == 0
+
+    entity2.age = 20
+    table.put(entity2)
+    stmt = dbengine.execute.call_args[0][0]
+    assert stmt.__visit_name__ == "update"
+    assert list(stmt.parameters.keys()) == ["age"]
+    assert table.get_by_key("123").age == 20
+    assert table.get_by_key("456") is None
+
+def test_fetch_lazy(mocker, dbengine):
+    sql_store = store.SQLStore(dbengine)
+    table = sql_store.get_table(SimpleRecord)
+    for i in range(3):
+        table.put(SimpleRecord(__key__ = str(i), created_at = datetime.utcnow(), updated_at = datetime.utcnow(),
+                               name = f"name{i}", age = i, smart = i % 2 == 0))
+
+    query = table.query().add_filter(age__ge = 1).order_by("age").set_lazy()
+    entities = table.fetch(query)
+    assert [e.getkey().value for e in entities] == ["1", "2"]
+    entity = entities[0]
+    assert "name" in entity.__field_values__.pending
+    assert entity.name == "name1"
+    assert "name" not in entity.__field_values__.pending
+    assert entity == table.get_by_key("1")
+
+    # Mutating loads every field and switches back to plain values
+    entity.age = 10
+    assert type(entity.__field_values__) is dict
+    assert entity.smart == False
+    assert entity.dirty_fields == {"age"}
+
+class ListRecord(BaseEntity):
+    names = ListField(MZTypes.String, optional = True)
+
+def test_list_columns(mocker, dbengine):
+    sql_store = store.SQLStore(dbengine)
+    table = sql_store.get_table(ListRecord)
+    assert isinstance(table.sa_table.c.names.type, LargeBinary)
+    now = datetime.utcnow()
+    table.put(ListRecord(__key__ = "1", created_at = now, updated_at = now, names = ["a", "b"]))
+    assert table.get_by_key("1").names == ["a", "b"]
+    entity = table.fetch(table.query().set_lazy())[0]
+    assert entity.names == ["a", "b"]
+
+class PairRecord(BaseEntity):
+    kind = Field(MZTypes.String)
+    number = Field(MZTypes.Int)
+
+    @classmethod
+    def key_fields(cls):
+        return ["kind", "number"]
+
+def test_scan(mocker, dbengine):
+    sql_store = store.SQLStore(dbengine)
+    table = sql_store.get_table(PairRecord)
+    now = datetime.utcnow()
+    for kind, number in [("b", 1), ("a", 3), ("a", 1), ("c", 0), ("a", 2)]:
+        table.put(PairRecord(kind = kind, number = number, created_at = now, updated_at = now))
+    scanned = lambda **kw: [(p.kind, p.number) for p in table.scan(**kw)]
+    assert scanned(prefix = ("a",)) == [("a", 1), ("a", 2), ("a", 3)]
+    assert scanned(prefix = ("a",), limit = 2) == [("a", 1), ("a", 2)]
+    assert scanned(start = ("a", 2), end = ("c",)) == [("a", 2), ("a", 3), ("b", 1)]
+    assert scanned(prefix = ("a",), start = ("a", "2")) == [("a", 2), ("a", 3)]
+
+def test_put_inserts_missing_rows(mocker, dbengine):
+    sql_store = store.SQLStore(dbengine)
+    table = sql_store.get_table(SimpleRecord)
+    now = datetime.utcnow()
+    table.put(SimpleRecord(__key__ = "1", created_at = now, updated_at = now, name = "a", age = 1, smart = True))
+
+    # The row was deleted after the entity was loaded
+    entity = table.get_by_key("1")
+    table.delete_by_key("1")
+    entity.age = 2
+    table.put(entity)
+    assert table.get_by_key("1").age == 2
+    assert table.get_by_key("1").name == "a"
+
+    # A new key is a new row and the old one is left alone
+    entity = table.get_by_key("1")
+    entity.setkey("3")
+    assert entity.dirty_fields is None
+    entity.age = 3
+    table.put(entity)
+    assert table.get_by_key("3").age == 3
+    assert table.get_by_key("3").name == "a"
+    assert table.get_by_key("1").age == 2
+
+class NestedRecord(BaseEntity):
+    names = ListField(MZTypes.String, optional = True)
+    scores = MapField(MZTypes.String, MZTypes.Int, optional = True)
+
+def test_put_writes_changes_in_place(mocker, dbengine):
+    sql_store = store.SQLStore(dbengine)
+    table = sql_store.get_table(NestedRecord)
+    now = datetime.utcnow()
+    table.put(NestedRecord(__key__ = "1", created_at = now, updated_at = now,
+                           names = ["a"], scores = {"a": 1}))
+    entity = table.get_by_key("1")
+    assert entity.dirty_fields == set()
+    assert entity.changed_fields == {"names", "scores"}
+    entity.names.append("b")
+    entity.scores["b"] = 2
+    table.put(entity)
+    entity = table.get_by_key("1")
+    assert entity.names == ["a", "b"]
+    assert entity.scores == {"a": 1, "b": 2}
+
+class Address(Record):
+    city = Field(MZTypes.String, optional = True)
+    zip = Field(MZTypes.Int, optional = True)
+
+class Person(BaseEntity):
+    name = Field(MZTypes.String)
+    address = Field(Type.as_record_type(Address), optional = True)
+
+def test_put_clears_nested_records(mocker, dbengine):
+    sql_store = store.SQLStore(dbengine)
+    table = sql_store.get_table(Person)
+    assert {"address", "address_city", "address_zip"} <= set(table.sa_table.c.keys())
+    now = datetime.utcnow()
+    table.put(Person(__key__ = "1", created_at = now, updated_at = now, name = "a",
+                     address = Address(city = "x", zip = 3)))
+    entity = table.get_by_key("1")
+    assert (entity.address.city, entity.address.zip) == ("x", 3)
+
+    # Fields missing from a new value are cleared too
+    entity.address = Address(city = "y")
+    table.put(entity)
+    entity = table.get_by_key("1")
+    assert (entity.address.city, entity.address.zip) == ("y", None)
+
+    del entity.address
+    assert table.toDatastore(entity, ["address"])[1] == dict(address = None, address_city = None, address_zip = None)
+    table.put(entity)
+    assert table.get_by_key("1").address is None
+    row = dbengine.execute(table.sa_table.select()).first()
+    assert (row["address"], row["address_city"], row["address_zip"]) == (None, None, None)
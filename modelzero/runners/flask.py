@@ -5,12 +5,14 @@ from modelzero import world
 from modelzero import utils as neutils
 from modelzero.core import errors as neerrors
 
-def create_app(project_id):
+def create_app(project_id, json_encoder = neutils.NEJsonEncoder):
+    """ Creates the flask app.  json_encoder is the encoder used for
+    responses, eg neutils.RecordJsonEncoder for record heavy apis. """
     from flask import Flask, render_template, redirect, jsonify
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.urandom(32)
     app.config['PROJECT_ID'] = project_id
-    app.config['RESTPLUS_JSON'] = { "cls": neutils.NEJsonEncoder }
+    app.config['RESTPLUS_JSON'] = { "cls": json_encoder }
 
     # Global error handlers
     def default_error_handler(message, status):
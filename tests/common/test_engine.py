@@ -57,3 +57,24 @@ def test_hard_delete(mocker):
     engine.ensure_access.assert_called_once_with(entity, viewer, "delete")
     engine.table.delete.assert_called_once_with(entity)
 
+
+def test_memtable_partial_put(mocker):
+    from modelzero.common import memstore
+    table = memstore.MemTable(BaseEntity)
+    created_at = datetime(2020, 1, 1)
+    entity = table.put(BaseEntity(is_active = True, created_at = created_at, __key__ = 1))
+    assert entity.dirty_fields == set()
+
+    # Clean entities are not validated or written again
+    mocker.spy(entity, "validate")
+    table.put(entity)
+    assert entity.validate.call_count == 0
+
+    # Only changed fields are copied onto the stored entity
+    copy = BaseEntity(__key__ = 1).mark_clean()
+    copy.is_active = False
+    table.put(copy)
+    stored = table.get_by_key(1)
+    assert stored is entity
+    assert stored.is_active == False
+    assert stored.created_at == created_at
@@ -0,0 +1,152 @@
+"""
+Graph style queries (from the GraphQL spec examples in tests/core/test_queries) over a
+small in memory set of users and pages, shared by the evaluator tests and
+benchmarks.  check_matches_dfseval is the differential check every
+evaluator runs over these queries.
+"""
+import typing, json
+from modelzero import utils
+from modelzero.core import evals, env
+from modelzero.core.exprs import FMap, NativeFunc
+from modelzero.core.types import Type, MZTypes
+from modelzero.core.queries import Query
+from modelzero.core.records import Record, Field
+
+class Date(Record):
+    day = Field(MZTypes.Int)
+    month = Field(MZTypes.Int)
+    year = Field(MZTypes.Int)
+
+class UserRecord(Record):
+    id = Field(MZTypes.String)
+    handle = Field(MZTypes.String)
+    firstName = Field(MZTypes.String)
+    lastName = Field(MZTypes.String)
+    name = Field(MZTypes.String)
+    birthday = Field(Type.as_record_type(Date))
+User = Type.as_record_type(UserRecord)
+
+class PageRecord(Record):
+    id = Field(MZTypes.String)
+    handle = Field(MZTypes.String)
+    url = Field(MZTypes.URL)
+Page = Type.as_record_type(PageRecord)
+
+PageOrUser = Type.as_sum_type("PageOrUser", Page, User)
+
+class FriendsRecord(Record):
+    count = Field(MZTypes.Int)
+Friends = Type.as_record_type(FriendsRecord)
+
+class LikersRecord(Record):
+    count = Field(MZTypes.Int)
+Likers = Type.as_record_type(LikersRecord)
+
+def make_user(id):
+    return UserRecord(id = str(id), handle = f"user{id}",
+                      firstName = f"First{id}", lastName = f"Last{id}",
+                      name = f"User {id}",
+                      birthday = Date(day = 1 + id % 28, month = 1 + id % 12, year = 1980 + id % 30))
+
+def get_user(id : int = 0, handle : str = None) -> User:
+    return make_user(id)
+
+def get_current_user() -> User:
+    return make_user(1)
+
+def get_profile_pic(id : str, size : int = 100, width : int = 100, height : int = 100) -> str:
+    return f"https://pics/{id}?s={size}&w={width}&h={height}"
+
+def get_friends(id : str, first : int = 10) -> MZTypes.List[User]:
+    return [make_user(int(id) + i + 1) for i in range(first)]
+
+def get_mutual_friends(id : str, first : int = 10) -> MZTypes.List[User]:
+    return [make_user(int(id) * 2 + i) for i in range(first)]
+
+def count_friends(id : str) -> Friends:
+    return FriendsRecord(count = len(id) * 10)
+
+def count_likers(id : str) -> Likers:
+    return LikersRecord(count = len(id) * 100)
+
+def get_profiles(handles : typing.List[str]) -> MZTypes.List[PageOrUser]:
+    return [make_user(i) if i % 2 == 0 else
+            PageRecord(id = str(i), handle = handle, url = f"https://{handle}")
+            for i, handle in enumerate(handles)]
+
+def batch_of(func):
+    """ A batch implementation that calls func once per argument dict. """
+    def batch(args_list):
+        return [func(**args) for args in args_list]
+    return batch
+
+GetUser = NativeFunc(get_user)
+GetCurrentUser = NativeFunc(get_current_user)
+GetProfilePic = NativeFunc(get_profile_pic, pure = True, batch = batch_of(get_profile_pic))
+GetFriends = NativeFunc(get_friends)
+GetMutualFriends = NativeFunc(get_mutual_friends)
+CountFriends = NativeFunc(count_friends, batch = batch_of(count_friends))
+CountLikers = NativeFunc(count_likers, batch = batch_of(count_likers))
+GetProfiles = NativeFunc(get_profiles)
+
+def basic_query():
+    d = Query(user = User).select(
+            "id", "firstName", "lastName",
+            ("birthday", Query(date = Date).select("month", "day")(date = "$user/birthday")),
+            ("friends", FMap(Query(friend = User).select("name"), GetFriends(id = "$user/id"))))
+    return Query().select(("me", d(user = GetCurrentUser())))
+
+def profile_pic_query():
+    d = Query(user = User).select(
+            "id", "name",
+            ("smallPic", GetProfilePic(id = "$user/id", size = 64)),
+            ("bigPic", GetProfilePic(id = "$user/id", size = 1024, width = 100, height = 50)))
+    return Query().select(("user", d(user = GetUser(id = 4))))
+
+def fragments_query(first = 10):
+    pic = Query(user = User).select(
+            ("profilePic", GetProfilePic(id = "$user/id", size = 50)))
+    fields = Query(user = User).select("id", "name").include(pic, user = "$user")
+    uq = Query(user = User).select(
+            ("friends", FMap(fields, GetFriends(id = "$user/id", first = first))),
+            ("mutualFriends", FMap(fields, GetMutualFriends(id = "$user/id", first = first))))
+    return Query().select(("user", uq(user = GetUser(id = 4))))
+
+def type_conditions_query():
+    uf = Query(user = User).select(("friends", CountFriends(id = "$user/id")))
+    pf = Query(page = Page).select(("likers", CountLikers(id = "$page/id")))
+    pq = Query(profile = PageOrUser)        \
+            .select("handle")               \
+            .include(uf, user = "$profile") \
+            .include(pf, page = "$profile")
+    return Query().select(("profiles",
+            FMap(pq, GetProfiles(handles = ["zuck", "cocacola", "alice", "acme"]))))
+
+def optional_fragment_query(expand_info):
+    pq = Query(user = User, expandInfo = MZTypes.Bool)          \
+            .select(("id", "$user/id"), ("name", "$user/name"))   \
+            .include_if("$expandInfo",
+                Query(user = User).select("firstName", "lastName", "birthday"),
+                user = "$user")
+    return Query().select(("user", pq(user = GetUser(handle = "zuck"), expandInfo = expand_info)))
+
+QUERIES = dict(basic = basic_query,
+               profile_pic = profile_pic_query,
+               fragments = fragments_query,
+               type_conditions = type_conditions_query,
+               expanded = lambda: optional_fragment_query(True),
+               not_expanded = lambda: optional_fragment_query(False))
+
+def as_json(value):
+    # Records from separately built queries have different classes
+    return json.dumps(value, cls = utils.NEJsonEncoder, sort_keys = True)
+
+def check_matches_dfseval(name, evaluate):
+    """ Checks that evaluate(query) gives the result DFSEval gives for the
+    named query (and leaves the query as it was).  Returns the result. """
+    query = QUERIES[name]()
+    expected = as_json(evals.DFSEval()(query.body, env.DefaultEnv()).value)
+    result = evaluate(query)
+    assert as_json(result) == expected
+    assert as_json(evals.DFSEval()(query.body, env.DefaultEnv()).value) == expected
+    return result
@@ -0,0 +1,42 @@
+import pytest, asyncio
+from modelzero.core import env
+from modelzero.core.asynceval import AsyncEval
+from modelzero.core.exprs import Expr, FMap, NativeFunc
+from modelzero.core.queries import Query
+from modelzero.core.types import MZTypes
+from tests.core import graphqueries
+
+@pytest.mark.parametrize("name", list(graphqueries.QUERIES.keys()))
+def test_queries_match_dfseval(mocker, name):
+    graphqueries.check_matches_dfseval(name, lambda query: asyncio.run(AsyncEval()(query.body, env.DefaultEnv())).value)
+
+def test_siblings_run_concurrently(mocker):
+    running, log = [0], []
+    async def fetch(id : str, first : int = 3) -> MZTypes.List[graphqueries.User]:
+        running[0] += 1
+        log.append(("start", first, running[0]))
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        log.append(("end", first))
+        return graphqueries.get_friends(id, first)
+    Fetch = NativeFunc(fetch)
+    friends = Query(friend = graphqueries.User).select("name")
+    uq = Query(user = graphqueries.User).select(
+            ("friends", FMap(friends, Fetch(id = "$user/id"))),
+            ("mutualFriends", FMap(friends, Fetch(id = "$user/id", first = 2))))
+    query = Query().select(("user", uq(user = graphqueries.GetUser(id = 4))))
+    result = asyncio.run(AsyncEval()(query.body, env.DefaultEnv())).value
+    # Both calls started before either ended
+    assert [entry[0] for entry in log] == ["start", "start", "end", "end"]
+    assert log[1][2] == 2
+    assert [f.name for f in result.user.friends] == ["User 5", "User 6", "User 7"]
+
+def test_short_circuits(mocker):
+    calls = []
+    async def check(x : int) -> bool:
+        calls.append(x)
+        return x > 0
+    Check = NativeFunc(check)
+    expr = Expr.as_andexp(Check(x = 0), Check(x = 1))
+    assert asyncio.run(AsyncEval()(expr, env.DefaultEnv())).value is False
+    assert calls == [0]
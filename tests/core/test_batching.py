@@ -0,0 +1,39 @@
+import pytest
+from modelzero.core import env
+from modelzero.core.batching import BatchEval
+from modelzero.core.exprs import Expr, FMap, NativeFunc
+from modelzero.core.queries import Query
+from tests.core import graphqueries
+
+@pytest.mark.parametrize("name", list(graphqueries.QUERIES.keys()))
+def test_queries_match_dfseval(mocker, name):
+    graphqueries.check_matches_dfseval(name, lambda query: BatchEval()(query.body, env.DefaultEnv()).value)
+
+def test_calls_across_fmaps_are_batched(mocker):
+    # Profile pics of friends and mutual friends in one batch
+    batcheval = BatchEval()
+    batcheval(graphqueries.fragments_query(first = 5).body, env.DefaultEnv())
+    assert batcheval.stats == dict(calls = 10, batches = 1)
+
+    # Sibling fragments on the elements of a sum type list
+    batcheval = BatchEval()
+    batcheval(graphqueries.type_conditions_query().body, env.DefaultEnv())
+    assert batcheval.stats == dict(calls = 4, batches = 2)
+
+def test_batch_results_fan_out(mocker):
+    batches = []
+    def double(x : int) -> int:
+        assert False, "Only the batch implementation should be called"
+    def double_all(args_list):
+        batches.append([args["x"] for args in args_list])
+        return [args["x"] * 2 for args in args_list]
+    Double = NativeFunc(double, batch = double_all)
+    inner = Query(x = int).select(("real", "$x"), ("doubled", Double(x = "$x")))
+    body = FMap(inner, Expr.as_native([1, 2, 3]))
+    values = BatchEval()(Expr(fmap = body), env.DefaultEnv()).value
+    assert [(v.real, v.doubled) for v in values] == [(1, 2), (2, 4), (3, 6)]
+    assert batches == [[1, 2, 3]]
+
+    Bad = NativeFunc(double, batch = lambda args_list: [])
+    with pytest.raises(Exception):
+        BatchEval()(Bad(x = 1), env.DefaultEnv())
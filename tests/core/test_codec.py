@@ -0,0 +1,106 @@
+from datetime import datetime
+import pytest
+from modelzero.core import codec, errors
+from modelzero.core.records import Record, Field
+from modelzero.core.types import MZTypes, Type
+from modelzero.common.entities import BaseEntity
+from modelzero.common.fields import ListField, MapField, KeyField
+from modelzero.members.entities import Member
+
+class Address(Record):
+    city = Field(MZTypes.String)
+    zipcode = Field(MZTypes.Int, optional = True)
+
+class CompactAddress(Address):
+    __compact__ = True
+
+class Person(BaseEntity):
+    name = Field(MZTypes.String)
+    age = Field(MZTypes.Int, optional = True)
+    height = Field(MZTypes.Float, optional = True)
+    photo = Field(MZTypes.Bytes, optional = True)
+    tags = ListField(MZTypes.String, optional = True)
+    addresses = ListField(Address, optional = True)
+    scores = MapField(MZTypes.String, MZTypes.Int, optional = True)
+    member = KeyField(Member, optional = True)
+    parent = Field(Type.as_type_ref("tests.core.test_codec.Person"), optional = True)
+
+def test_record_roundtrip(mocker):
+    created_at = datetime(2020, 1, 2, 3, 4, 5, 6)
+    person = Person(name = "Alice", age = -3, height = 1.5, photo = b"\x00\x01",
+                    tags = ["a", "b"], addresses = [Address(city = "X", zipcode = 123)],
+                    scores = {"math": 90}, member = Member.Key(42),
+                    created_at = created_at, updated_at = created_at, __key__ = 7)
+    person.parent = Person(name = "Bob", created_at = created_at, updated_at = created_at)
+    data = codec.encode(person)
+    assert type(data) is bytes
+
+    decoded = codec.decode(data, Person)
+    assert decoded.getkey() == Person.Key(7)
+    assert decoded.to_dict().keys() == person.to_dict().keys()
+    for name in ["name", "age", "height", "photo", "tags", "scores", "member", "created_at"]:
+        assert getattr(decoded, name) == getattr(person, name)
+    assert decoded.addresses == person.addresses
+    assert decoded.parent == person.parent
+    assert decoded.parent.getkey() is None
+    # Unset fields stay unset
+    assert "zipcode" not in codec.decode(codec.encode(Address(city = "Y")), Address).__field_values__
+
+def test_compact_record_roundtrip(mocker):
+    address = codec.decode(codec.encode(CompactAddress(city = "X", zipcode = 1)), CompactAddress)
+    assert address.city == "X" and address.zipcode == 1
+
+def test_encode_value(mocker):
+    listtype = MZTypes.List[MZTypes.DateTime]
+    value = [datetime(1969, 12, 31), datetime(2030, 5, 6, 7, 8, 9)]
+    assert codec.decode_value(codec.encode_value(value, listtype), listtype) == value
+
+def test_schema_mismatch(mocker):
+    class Versioned(Record):
+        a = Field(MZTypes.Int)
+    data = codec.encode(Versioned(a = 1))
+    assert codec.decode(data, Versioned).a == 1
+    with pytest.raises(errors.SchemaMismatch):
+        codec.decode(data, Address)
+    Versioned.register_field("b", Field(MZTypes.Int, optional = True))
+    with pytest.raises(errors.SchemaMismatch):
+        codec.decode(data, Versioned)
+
+def test_aware_datetimes(mocker):
+    from datetime import timezone, timedelta
+    listtype = MZTypes.List[MZTypes.DateTime]
+    aware = datetime(2020, 1, 2, 8, 0, tzinfo = timezone(timedelta(hours = 5)))
+    assert codec.decode_value(codec.encode_value([aware], listtype), listtype) == [datetime(2020, 1, 2, 3, 0)]
+
+def test_named_encoding(mocker):
+    class Stored(Record):
+        a = Field(MZTypes.Int)
+        gone = Field(MZTypes.String, optional = True)
+    listtype = MZTypes.List[Type.as_record_type(Stored)]
+    data = codec.encode_named([Stored(a = 1, gone = "x"), Stored(a = 2)])
+
+    # Fields can be added to (and removed from) the records after they are stored
+    class Stored(Record):
+        a = Field(MZTypes.Int)
+        added = Field(MZTypes.Int, optional = True)
+    listtype = MZTypes.List[Type.as_record_type(Stored)]
+    values = codec.decode_named(data, listtype)
+    assert [v.a for v in values] == [1, 2]
+    assert values[0].__field_values__ == {"a": 1}
+    assert values[0].added is None
+
+    # Values encoded with a fingerprint can still be read
+    assert codec.decode_named(codec.encode_value(values, listtype), listtype) == values
+    person = Person(name = "A", addresses = [Address(city = "X")], __key__ = 3)
+    decoded = codec.decode_named(codec.encode_named(person), Type.as_record_type(Person))
+    assert decoded.getkey() == Person.Key(3)
+    assert decoded.addresses == person.addresses
+
+def test_unknown_key_classes(mocker):
+    for fqn in ("tests.core.test_codec.Removed", "tests.nowhere.Removed", "Removed"):
+        class Removed(BaseEntity):
+            __fqn__ = fqn
+        data = codec.encode_named([Removed.Key(1)])
+        with pytest.raises(errors.SchemaMismatch) as raised:
+            codec.decode_named(data, MZTypes.List[MZTypes.Key[Removed]])
+        assert fqn in str(raised.value)
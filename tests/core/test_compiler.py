@@ -0,0 +1,83 @@
+import pytest
+from modelzero.core import evals, env
+from modelzero.core.exprs import Expr, Native, Let, NativeFunc
+from modelzero.core.compiler import Compiler
+from tests.core import graphqueries
+
+def evaluate_both(expr, values = None):
+    expected = evals.DFSEval()(expr, env.DefaultEnv(**(values or {})))
+    compiled = Compiler().compile(expr)(env.DefaultEnv(**(values or {})))
+    return expected.value, compiled.value
+
+@pytest.mark.parametrize("name", list(graphqueries.QUERIES.keys()))
+def test_queries_match_dfseval(mocker, name):
+    graphqueries.check_matches_dfseval(name, lambda query: Compiler().compile(query.body)(env.DefaultEnv()).value)
+
+def test_compiled_query_func(mocker):
+    query = graphqueries.fragments_query(first = 3)
+    run = Compiler().compile_func(query)
+    result = run()
+    assert [f.id for f in result.user.friends] == ["5", "6", "7"]
+    assert result.user.friends[0].profilePic.startswith("https://pics/5")
+    # New records on every run
+    assert run() == result and run() is not result
+
+def test_boolean_exprs(mocker):
+    calls = []
+    def track(value : bool) -> bool:
+        calls.append(value)
+        return value
+    Track = NativeFunc(track)
+    T, F = Expr.as_native(True), Expr.as_native(False)
+    cases = [
+        (Expr.as_andexp(T, F, Track(value = True)), False, 0),
+        (Expr.as_andexp(T, Track(value = True)), True, 1),
+        (Expr.as_orexp(F, T, Track(value = True)), True, 0),
+        (Expr.as_orexp(F, Track(value = False)), False, 1),
+        (Expr.as_notexp(F), True, 0),
+        (Expr.as_ifelse(F, Track(value = True), Expr.as_native(2)), 2, 0),
+        (Expr.as_ifelse(Expr.as_var("x"), Expr.as_native(1), Track(value = True)), 1, 0),
+    ]
+    for expr, value, num_calls in cases:
+        del calls[:]
+        expected, compiled = evaluate_both(expr, dict(x = True))
+        assert expected == compiled == value
+        # Both evaluators short circuit the same way
+        assert len(calls) == 2 * num_calls
+
+def test_let_and_getters(mocker):
+    user = graphqueries.make_user(3)
+    let = Expr.as_let(u = Expr.as_var("user"), n = Expr.as_native(5))
+    let.let.set_body(Expr.as_getter(Expr.as_getter(Expr.as_var("u"), "birthday"), "month"))
+    expected, compiled = evaluate_both(let, dict(user = user))
+    assert expected == compiled == 4
+    missing = Expr.as_getter(Expr.as_var("user"), "name")
+    assert evaluate_both(missing, dict(user = None)) == (None, None)
+
+def test_frames(mocker):
+    layout = env.Layout(["a", "b"], env.Layout(["c", "a"]))
+    assert layout.resolve("b") == (0, 1)
+    assert layout.resolve("c") == (1, 0)
+    assert layout.resolve("a") == (0, 0)
+    assert layout.resolve("x") is None
+    frame = env.Frame(layout, [1, 2], env.Frame(layout.parent, [3, 4], env.DefaultEnv(x = 5)))
+    assert [frame.get(n) for n in "abcx"] == [1, 2, 3, 5]
+    assert env.slot_reader(1, 1)(frame) == 4
+    with pytest.raises(Exception):
+        env.Frame(layout, [1, 2]).get("x")
+
+def test_nested_scopes(mocker):
+    # Inner lets shadow outer ones, function bodies see their caller's names
+    from modelzero.core.exprs import Func
+    body = Expr.as_let(x = Expr.as_var("a"))
+    body.let.set_body(Expr.as_andexp(Expr.as_var("x"), Expr.as_var("b"), Expr.as_var("y")))
+    func = Func("f", params = ["a"], body = body)
+    inner = Expr.as_let(x = Expr.as_native(0), y = Expr.as_native("y"))
+    inner.let.set_body(Expr.as_call(func, a = Expr.as_var("x")))
+    outer = Expr.as_let(x = Expr.as_native(1), b = Expr.as_native(True))
+    outer.let.set_body(inner)
+    expected, compiled = evaluate_both(outer)
+    assert expected == compiled == False
+    inner.let.mappings["x"] = Expr.as_native(2)
+    expected, compiled = evaluate_both(outer)
+    assert expected == compiled == True
@@ -0,0 +1,56 @@
+import pytest
+from datetime import datetime
+from modelzero.core import decoding, errors
+from modelzero.core.records import Record, Field
+from modelzero.core.types import MZTypes
+from modelzero.common.entities import BaseEntity
+from modelzero.common.fields import ListField, MapField, KeyField
+from modelzero.members.entities import Member
+
+class Address(Record):
+    city = Field(MZTypes.String)
+    zipcode = Field(MZTypes.Int, optional = True)
+
+class Profile(BaseEntity):
+    name = Field(MZTypes.String, validators = [str.strip])
+    age = Field(MZTypes.Int, optional = True)
+    verified = Field(MZTypes.Bool, optional = True)
+    addresses = ListField(Address, optional = True)
+    scores = MapField(MZTypes.String, MZTypes.Float, optional = True)
+    member = KeyField(Member, optional = True)
+
+def test_decode_record(mocker):
+    profile = decoding.decode_record(Profile, {
+        "name": " Alice ", "age": "30", "verified": "true",
+        "created_at": "2020-01-02", "member": 42, "unknown": 1,
+        "addresses": [{"city": "X", "zipcode": "123"}],
+        "scores": {"math": 1},
+    })
+    assert profile.name == "Alice"
+    assert profile.age == 30
+    assert profile.verified is True
+    assert profile.created_at == datetime(2020, 1, 2)
+    assert profile.member == Member.Key(42)
+    assert profile.addresses[0].city == "X" and profile.addresses[0].zipcode == 123
+    assert profile.scores == {"math": 1.0}
+    assert "updated_at" not in profile.__field_values__
+
+def test_decode_collects_all_errors(mocker):
+    with pytest.raises(errors.ValidationError) as exc:
+        decoding.decode_record(Profile, {
+            "age": "old", "verified": "maybe", "created_at": "someday",
+            "addresses": [{"city": "X"}, {"zipcode": 1}, 3],
+        })
+    assert set(exc.value.data.keys()) == {"name", "age", "verified", "created_at",
+                                          "addresses.1.city", "addresses.2"}
+
+def test_decode_patch(mocker):
+    profile = Profile(name = "A", age = 3).mark_clean()
+    decoding.apply_patch(profile, {"age": "4", "verified": 0})
+    assert profile.age == 4 and profile.verified is False
+    assert profile.name == "A"
+    assert profile.dirty_fields == {"age", "verified"}
+    with pytest.raises(errors.ValidationError) as exc:
+        decoding.apply_patch(profile, {"age": "x", "name": None})
+    assert set(exc.value.data.keys()) == {"age", "name"}
+    assert profile.age == 4
@@ -0,0 +1,47 @@
+import json
+from modelzero import utils
+from modelzero.core import evals, env, types
+from modelzero.core.queries import Query, Command
+from tests.core import graphqueries
+
+def fieldnames(query):
+    return list(query.return_type.record_class.__record_metadata__.fieldnames)
+
+def test_commands_extend_derivation(mocker):
+    new_record_class = mocker.spy(types.RecordType, "new_record_class")
+    query = Query(user = graphqueries.User).select("id")
+    body = query.body
+    record_class = query.return_type.record_class
+    query.select("name", "handle")
+    assert fieldnames(query) == ["id", "name", "handle"]
+    # The record class is extended and the body wrapped
+    assert query.return_type.record_class is record_class
+    assert query.body.setter.src_expr.setter.src_expr is body
+    assert new_record_class.call_count == 1
+
+    pic = Query(user = graphqueries.User).select(("pic", graphqueries.GetProfilePic(id = "$user/id")))
+    query.include(pic, user = "$user")
+    assert fieldnames(query) == ["id", "name", "handle", "pic"]
+    result = evals.DFSEval()(query.body, env.DefaultEnv(user = graphqueries.make_user(2))).value
+    assert result.to_dict() == dict(id = "2", name = "User 2", handle = "user2", pic = graphqueries.get_profile_pic("2"))
+
+def test_changes_rebuild(mocker):
+    query = Query(user = graphqueries.User).select("id", "name")
+    record_class = query.return_type.record_class
+    body = query.body
+    query.replace_command(1, Command.as_selector("handle", "$user/handle"))
+    assert query.return_type.record_class is not record_class
+    assert fieldnames(query) == ["id", "handle"]
+    query.remove_command(0)
+    assert fieldnames(query) == ["handle"]
+    result = evals.DFSEval()(query.body, env.DefaultEnv(user = graphqueries.make_user(2))).value
+    assert result.to_dict() == dict(handle = "user2")
+
+def test_same_as_rebuilt(mocker):
+    built = graphqueries.fragments_query()
+    rebuilt = graphqueries.fragments_query()
+    built.body
+    rebuilt.invalidate()
+    as_json = lambda value: json.dumps(value, cls = utils.NEJsonEncoder, sort_keys = True)
+    assert as_json(evals.DFSEval()(built.body, env.DefaultEnv()).value) == \
+            as_json(evals.DFSEval()(rebuilt.body, env.DefaultEnv()).value)
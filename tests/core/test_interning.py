@@ -0,0 +1,47 @@
+import json
+from modelzero import utils
+from modelzero.core import evals, env, interning
+from modelzero.core.exprs import Expr
+from tests.core import graphqueries
+
+def unique_nodes(expr):
+    from modelzero.core.analysis import child_exprs
+    seen, stack = {}, [expr]
+    while stack:
+        curr = stack.pop()
+        if id(curr) in seen: continue
+        seen[id(curr)] = curr
+        stack.extend(child_exprs(curr))
+    return len(seen)
+
+def test_equal_exprs_are_shared(mocker):
+    make = lambda: Expr.as_andexp(Expr.as_getter(Expr.as_var("u"), "id"), Expr.as_native(3))
+    e1, e2 = make(), make()
+    assert e1 is not e2
+    i1, i2 = interning.intern(e1), interning.intern(e2)
+    assert i1 is i2 and hash(i1) == hash(i2)
+    assert i1.andexp.exprs[0] is interning.intern(Expr.as_getter(Expr.as_var("u"), "id"))
+    assert {i1: "cached"}[interning.intern(make())] == "cached"
+    # Interned nodes are equal by identity
+    other = interning.intern(Expr.as_andexp(Expr.as_getter(Expr.as_var("u"), "name"), Expr.as_native(3)))
+    assert other != i1 and other.andexp.exprs[1] is i1.andexp.exprs[1]
+    assert interning.intern(Expr.as_native(3)) != interning.intern(Expr.as_native("3"))
+
+    # Unhashable values are only the same if they are the same object
+    items = [1, 2]
+    assert interning.intern(Expr.as_native(items)) is interning.intern(Expr.as_native(items))
+    assert interning.intern(Expr.as_native([1, 2])) is not interning.intern(Expr.as_native([1, 2]))
+
+def test_interned_query(mocker):
+    table = interning.ExprTable()
+    query = graphqueries.fragments_query()
+    body = query.body.setter.keys_and_values["user"].call.operator.func.body
+    interned = table.intern(body)
+    assert unique_nodes(interned) < unique_nodes(body)
+    assert table.stats["hits"] > 0
+    assert table.intern(interned) is interned
+
+    expected = evals.DFSEval()(body, env.DefaultEnv(user = graphqueries.make_user(4))).value
+    result = evals.DFSEval()(interned, env.DefaultEnv(user = graphqueries.make_user(4))).value
+    as_json = lambda value: json.dumps(value, cls = utils.NEJsonEncoder, sort_keys = True)
+    assert as_json(result) == as_json(expected)
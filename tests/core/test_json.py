@@ -0,0 +1,46 @@
+import json
+from datetime import datetime
+from modelzero import utils
+from modelzero.core.records import Record, Field
+from modelzero.core.types import MZTypes
+from modelzero.common.fields import KeyField, ListField
+from modelzero.common.entities import BaseEntity
+from modelzero.members.entities import Member
+
+class Payload(BaseEntity):
+    name = Field(MZTypes.String)
+    data = Field(MZTypes.Bytes, optional = True)
+    member = KeyField(Member, optional = True)
+    members = ListField(Member, optional = True)
+
+def test_record_json_encoder(mocker):
+    created_at = datetime(2020, 1, 2, 3, 4, 5)
+    member = Member(fullname = "A", date_of_birth = created_at, __key__ = 1)
+    payload = Payload(name = "x", data = b"abc", member = Member.Key(42),
+                      created_at = created_at, members = [member])
+    values = [payload, Member.Key(3), created_at, b"xyz"]
+    expected = json.dumps(values, cls = utils.NEJsonEncoder, sort_keys = True)
+    assert json.dumps(values, cls = utils.RecordJsonEncoder, sort_keys = True) == expected
+    assert json.loads(expected)[0]["created_at"] == "2020-01-02 03:04:05"
+
+    # Serializers pick up fields added later
+    Payload.register_field("extra", Field(MZTypes.Int, optional = True))
+    payload.extra = 3
+    assert json.loads(json.dumps(payload, cls = utils.RecordJsonEncoder))["extra"] == 3
+
+def test_format_datetime(mocker):
+    import datetime as dt
+    for value in [datetime(2020, 1, 2, 3, 4, 5, 6), datetime(999, 1, 1),
+                  datetime(2020, 1, 1, tzinfo = dt.timezone.utc)]:
+        assert utils.format_datetime(value) == value.strftime(utils.DEFAULT_DATETIME_FORMAT)
+
+def test_fields_without_types(mocker):
+    class Untyped(Record):
+        name = Field(MZTypes.String)
+        value = Field()
+    created_at = datetime(2020, 1, 2, 3, 4, 5)
+    record = Untyped(name = "x")
+    record.__field_values__["value"] = created_at
+    # Left to the json encoder
+    out = json.loads(json.dumps(record, cls = utils.RecordJsonEncoder))
+    assert out == dict(name = "x", value = "2020-01-02 03:04:05")
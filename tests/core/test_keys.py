@@ -0,0 +1,95 @@
+import pickle
+import pytest
+from modelzero.core.entities import Key
+from modelzero.core.records import Field
+from modelzero.core.types import MZTypes
+from modelzero.common.entities import BaseEntity
+from modelzero.common.fields import KeyField
+
+class Pair(BaseEntity):
+    kind = Field(MZTypes.String)
+    number = Field(MZTypes.Int)
+
+    @classmethod
+    def key_fields(cls):
+        return ["kind", "number"]
+
+def test_key_equality_and_hash(mocker):
+    key = Pair.Key("a/3")
+    assert key.parts == ("a", 3)
+    assert key == Pair.Key("a", "3") == Key.from_parts(Pair, ["a", 3])
+    assert hash(key) == hash(Key.from_parts(Pair, ("a", 3)))
+    assert key != Pair.Key("a/4")
+    assert key != BaseEntity.Key("a/3".replace("/", ""))
+    assert {key: 1}[Pair(kind = "a", number = 3).getkey()] == 1
+    assert pickle.loads(pickle.dumps(key)) == key
+
+def test_key_is_immutable(mocker):
+    key = BaseEntity.Key(1)
+    with pytest.raises(AttributeError):
+        key.parts = (2,)
+    with pytest.raises(AttributeError):
+        del key.entity_class
+
+def test_key_interning(mocker):
+    key = Key.from_parts(Pair, ("a", 1), intern = True)
+    assert Pair.Key("a/1").intern() is key
+    assert Key.from_parts(Pair, ("a", 1)) is not key
+
+def test_ordered_key_encoding(mocker):
+    from datetime import datetime
+    from modelzero.core import keyencoding
+    from modelzero.core.keyencoding import key_encoder
+    encoder = key_encoder(Pair)
+    parts = [("", 0), ("a", -5), ("a", 3), ("a", 2 ** 40), ("a\x00b", 1), ("ab", -1), ("b", 0)]
+    encoded = [encoder.encode(Key.from_parts(Pair, p)) for p in parts]
+    assert sorted(encoded) == encoded
+    assert [encoder.decode(e).parts for e in encoded] == parts
+    assert encoded[2].startswith(encoder.encode_parts(["a"]))
+    assert not encoded[5].startswith(encoder.encode_parts(["a"]))
+
+    for values, codec in [([-1.5, -0.0, 0.5, 1e10], keyencoding.encode_float),
+                          ([datetime(1960, 1, 1), datetime(2020, 1, 1)], keyencoding.encode_datetime),
+                          ([3, "10", "9"], keyencoding.encode_auto)]:
+        outs = []
+        for value in values:
+            out = bytearray()
+            codec(value, out)
+            outs.append(bytes(out))
+        assert sorted(outs) == outs
+
+def test_memtable_scan(mocker):
+    from modelzero.common import memstore
+    table = memstore.MemTable(Pair)
+    for kind, number in [("b", 1), ("a", 3), ("a", 1), ("c", 0), ("a", 2)]:
+        table.put(Pair(kind = kind, number = number))
+    scanned = lambda **kw: [(p.kind, p.number) for p in table.scan(**kw)]
+    assert scanned(prefix = ("a",)) == [("a", 1), ("a", 2), ("a", 3)]
+    assert scanned(prefix = ("a",), limit = 2) == [("a", 1), ("a", 2)]
+    assert scanned(start = ("a", 2), end = ("c",)) == [("a", 2), ("a", 3), ("b", 1)]
+    table.delete_by_key(Pair.Key("a/2"))
+    assert scanned(prefix = ("a",), start = ("a", 2)) == [("a", 3)]
+
+class PairLink(BaseEntity):
+    pair = KeyField(Pair)
+
+    @classmethod
+    def key_fields(cls):
+        return ["pair"]
+
+def test_memtable_unordered_keys(mocker):
+    from modelzero.common import memstore
+    table = memstore.MemTable(PairLink)
+    link = table.put(PairLink(pair = Pair.Key("a/1")))
+    assert table.get_by_key(link.getkey()) is link
+    table.delete_by_key(link.getkey())
+    with pytest.raises(TypeError):
+        table.scan()
+
+def test_aware_key_datetimes(mocker):
+    from datetime import datetime, timezone, timedelta
+    from modelzero.core import keyencoding
+    aware, naive = bytearray(), bytearray()
+    keyencoding.encode_datetime(datetime(2020, 1, 2, 8, tzinfo = timezone(timedelta(hours = 5))), aware)
+    keyencoding.encode_datetime(datetime(2020, 1, 2, 3), naive)
+    assert aware == naive
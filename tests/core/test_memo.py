@@ -0,0 +1,81 @@
+import pytest, typing
+from modelzero.core import evals, env, memo
+from modelzero.core.exprs import Expr, NativeFunc
+from modelzero.core.queries import Query
+from tests.core import graphqueries
+
+def test_cache_scopes(mocker):
+    calls = []
+    def pic(id : str, size : int = 100) -> str:
+        calls.append((id, size))
+        return f"pic-{id}-{size}"
+    Pure = NativeFunc(pic, pure = True)
+    Impure = NativeFunc(pic)
+    Shared = NativeFunc(pic, cache = memo.PROCESS)
+    assert (Pure.cache_scope, Impure.cache_scope, Shared.cache_scope) == ("request", None, "process")
+    assert NativeFunc(pic, pure = True, cache = False).cache_scope is None
+
+    process = memo.MemoCache()
+    def run(func):
+        body = Expr.as_andexp(func(id = "1"), func(id = "1", size = 100), func(size = 100, id = "1"))
+        return evals.DFSEval(memo = memo.Memo(process = process))(body, env.DefaultEnv())
+
+    run(Impure)
+    assert len(calls) == 3
+    del calls[:]
+    run(Pure); run(Pure)
+    # Once per request
+    assert calls == [("1", 100), ("1", 100)]
+    del calls[:]
+    run(Shared); run(Shared)
+    assert calls == [("1", 100)]
+    assert process.stats == dict(hits = 5, misses = 1, evictions = 0)
+
+def test_record_arguments(mocker):
+    calls = []
+    def name_of(user : graphqueries.User) -> str:
+        calls.append(user.id)
+        return user.name
+    Name = NativeFunc(name_of, pure = True)
+    query = Query(a = graphqueries.User, b = graphqueries.User).select(
+            ("first", Name(user = "$a")), ("second", Name(user = "$b")))
+    result = evals.DFSEval(memo = memo.Memo())(query.body, env.DefaultEnv(
+                a = graphqueries.make_user(1), b = graphqueries.make_user(1))).value
+    # Equal records are the same arguments
+    assert (result.first, result.second) == ("User 1", "User 1")
+    assert calls == ["1"]
+
+    assert memo.memo_key(Name, dict(user = object())) is not None
+    assert memo.memo_key(Name, dict(user = [{}])) is not None
+    assert memo.memo_key(Name, dict(user = [bytearray()])) is None
+
+def test_argument_types(mocker):
+    keys = [memo.normalize(value) for value in (True, 1, 1.0, [1], (1,), {1: "a"}, {True: "a"})]
+    # Equal values of different types are different arguments
+    assert len(set(keys)) == len(keys)
+    calls = []
+    def count(values : typing.List[typing.Dict[str, int]]) -> int:
+        calls.append(values)
+        return len(values)
+    Count = NativeFunc(count, pure = True)
+    mixed = [{1: "a", "b": 2}]
+    assert memo.memo_key(Count, dict(values = mixed)) is None
+    body = Expr.as_andexp(Count(values = Expr.as_native(mixed)), Count(values = Expr.as_native(mixed)))
+    assert evals.DFSEval(memo = memo.Memo())(body, env.DefaultEnv()).value is True
+    # Not cached but still called
+    assert calls == [mixed, mixed]
+
+def test_lru_and_ttl(mocker):
+    now = [0]
+    cache = memo.MemoCache(max_size = 2, ttl = 10, clock = lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == (True, 1)
+    cache.put("c", 3)
+    # b was the least recently used
+    assert cache.get("b") == (False, None)
+    assert cache.get("c") == (True, 3)
+    now[0] = 10
+    assert cache.get("a") == (False, None)
+    assert len(cache) == 1
+    assert cache.stats == dict(hits = 2, misses = 2, evictions = 2)
@@ -0,0 +1,168 @@
+import pytest
+from modelzero.core import evals, env, optimizer
+from modelzero.core.analysis import child_exprs, node_count
+from modelzero.core import exprs
+from modelzero.core.exprs import Expr, NativeFunc
+from modelzero.core.types import MZTypes
+from tests.core import graphqueries
+
+def variants(expr):
+    """ Class names of the values of all nodes in an expression. """
+    out, stack = set(), [expr]
+    while stack:
+        curr = stack.pop()
+        out.add(type(curr._variant_value).__name__)
+        stack.extend(child_exprs(curr))
+    return out
+
+@pytest.mark.parametrize("name", list(graphqueries.QUERIES.keys()))
+def test_queries_match_dfseval(mocker, name):
+    def optimized(query):
+        opt = optimizer.Optimizer()
+        func = opt.func(query)
+        assert opt.stats["after"] < opt.stats["before"]
+        return evals.DFSEval()(func.body, env.DefaultEnv()).value
+    graphqueries.check_matches_dfseval(name, optimized)
+
+def test_static_fragment_checks(mocker):
+    query = graphqueries.fragments_query()
+    # The fragment's parameter type is its argument's type
+    fields = query.body.setter.keys_and_values["user"].call.operator.func \
+                  .body.setter.keys_and_values["mutualFriends"].fmap.func_expr.func
+    assert {"Let", "IfElse", "IsType"} <= variants(fields.body)
+    optimized = optimizer.Optimizer(cse = False).func(fields)
+    assert not {"Let", "IfElse", "IsType"} & variants(optimized.body)
+    # All fields set by a single setter
+    assert optimized.body.is_setter and optimized.body.setter.src_expr.is_new
+    assert set(optimized.body.setter.keys_and_values) == {"id", "name", "profilePic"}
+
+    # Checks against sum types are only known at runtime
+    profiles = optimizer.optimize_func(graphqueries.type_conditions_query())
+    pq = profiles.body.setter.keys_and_values["profiles"].fmap.func_expr.func
+    assert "IsType" in variants(pq.body)
+
+def test_folding(mocker):
+    x = Expr.as_var("x")
+    T, F = Expr.as_native(True), Expr.as_native(False)
+    cases = [
+        (Expr.as_notexp(F), True),
+        (Expr.as_andexp(T, T), True),
+        (Expr.as_andexp(F, x), False),
+        (Expr.as_orexp(F, F), False),
+        (Expr.as_orexp(T, x), True),
+        (Expr.as_ifelse(Expr.as_andexp(T, Expr.as_notexp(F)), Expr.as_native(1), x), 1),
+    ]
+    for expr, value in cases:
+        folded = optimizer.optimize(expr)
+        assert folded.is_native and folded.native.value == value
+    # Deciding constants drop later operands but keep earlier ones
+    partial = optimizer.optimize(Expr.as_andexp(x, T, F, x))
+    assert partial.is_andexp and len(partial.andexp.exprs) == 2
+    assert partial.andexp.exprs[0] is x
+
+def test_let_inlining(mocker):
+    calls = []
+    def fetch(id : int) -> int:
+        calls.append(id)
+        return id * 10
+    Fetch = NativeFunc(fetch)
+    user = graphqueries.make_user(3)
+    body = Expr.as_setter(Expr.as_var("out"),
+                          a = Expr.as_var("once"),
+                          b = Expr.as_var("fetched"),
+                          c = Expr.as_var("fetched"))
+    let = Expr.as_let(once = Expr.as_getter(Expr.as_var("u"), "name"),
+                      unused = Expr.as_getter(Expr.as_var("u"), "id"),
+                      fetched = Fetch(id = 4))
+    let.let.set_body(body)
+    optimized = optimizer.optimize(let)
+    # Calls are not pure so stay bound (and evaluated once)
+    assert optimized.is_let and list(optimized.let.mappings) == ["fetched"]
+    assert node_count(optimized) < node_count(let)
+
+    from modelzero.core.records import Record, Field
+    class Out(Record):
+        a = Field(MZTypes.String)
+        b = Field(MZTypes.Int)
+        c = Field(MZTypes.Int)
+    results = []
+    for expr in (let, optimized):
+        out = Out()
+        evals.DFSEval()(expr, env.DefaultEnv(u = user, out = out))
+        results.append(out.to_dict())
+    assert results[0] == results[1] == dict(a = "User 3", b = 40, c = 40)
+    assert calls == [4, 4]
+
+def test_setter_flattening(mocker):
+    out = Expr.as_setter(Expr.as_setter(Expr.as_var("r"), a = Expr.as_native(1)),
+                         b = Expr.as_native(2))
+    flat = optimizer.optimize(out)
+    assert flat.setter.src_expr.is_var
+    assert list(flat.setter.keys_and_values) == ["a", "b"]
+    # The same field set twice is left alone
+    twice = Expr.as_setter(Expr.as_setter(Expr.as_var("r"), a = Expr.as_native(1)),
+                           a = Expr.as_native(2))
+    assert optimizer.optimize(twice).setter.src_expr.is_setter
+
+def test_common_subexprs(mocker):
+    calls = []
+    @exprs.pure
+    def pic(id : str, size : int = 100) -> str:
+        calls.append(id)
+        return f"pic-{id}-{size}"
+    Pic = NativeFunc(pic)
+    def log(id : int) -> int:
+        calls.append(id)
+        return id
+    Log = NativeFunc(log)
+    assert Pic.is_pure and not Log.is_pure and not graphqueries.GetUser.is_pure
+
+    user_id = lambda: Expr.as_getter(Expr.as_getter(Expr.as_var("u"), "birthday"), "year")
+    body = Expr.as_setter(Expr.as_var("out"),
+                          a = Pic(id = user_id(), size = 10),
+                          b = Pic(size = 10, id = user_id()),
+                          c = Pic(id = user_id(), size = 20),
+                          d = Log(id = user_id()),
+                          e = Log(id = user_id()))
+    optimized = optimizer.optimize(body)
+    # The pure call and the getter chain are each bound once
+    assert optimized.is_let and optimized.let.body.is_let
+    bound = list(optimized.let.mappings.values()) + list(optimized.let.body.let.mappings.values())
+    assert sorted(v.variant_type for v in bound) == ["call", "getter"]
+    assert "Let" not in variants(optimized.let.body.let.body)
+
+    from modelzero.core.records import Record, Field
+    class Out(Record):
+        a = Field(MZTypes.String)
+        b = Field(MZTypes.String)
+        c = Field(MZTypes.String)
+        d = Field(MZTypes.Int)
+        e = Field(MZTypes.Int)
+    user = graphqueries.make_user(3)
+    results = []
+    for expr in (body, optimized):
+        del calls[:]
+        out = Out()
+        evals.DFSEval()(expr, env.DefaultEnv(u = user, out = out))
+        results.append((out.to_dict(), list(calls)))
+    year = user.birthday.year
+    assert results[0][1] == [year] * 5
+    # Impure calls still run each time
+    assert results[1][1] == [year] * 4
+    assert results[0][0] == results[1][0]
+
+def test_common_subexprs_stay_guarded(mocker):
+    month = lambda: Expr.as_getter(Expr.as_getter(Expr.as_var("x"), "birthday"), "month")
+    new_user = Expr.as_new(graphqueries.User)
+    body = Expr.as_ifelse(Expr.as_istype(Expr.as_var("x"), graphqueries.User),
+                          Expr.as_setter(new_user, id = month(), handle = month()),
+                          Expr.as_native(None))
+    optimized = optimizer.optimize(body)
+    # The getter is bound in the branch that is guarded by the type check
+    assert optimized.is_ifelse and optimized.ifelse.exp1.is_let
+    page = graphqueries.PageRecord(id = "1", handle = "page")
+    for expr in (body, optimized):
+        assert evals.DFSEval()(expr, env.DefaultEnv(x = page)).value is None
+    user = graphqueries.make_user(3)
+    result = evals.DFSEval()(optimized, env.DefaultEnv(x = user)).value
+    assert result.id == result.handle == str(user.birthday.month)
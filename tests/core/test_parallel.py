@@ -0,0 +1,68 @@
+import pytest, time, threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from modelzero.core import evals, env, parallel
+from modelzero.core.exprs import Expr, FMap, Func, NativeFunc
+from modelzero.core.queries import Query
+from tests.core import graphqueries
+
+def square(x : int) -> int:
+    return x * x
+
+def fmap(func, items):
+    return Expr(fmap = FMap(func, Expr.as_native(items)))
+
+@pytest.mark.parametrize("name", list(graphqueries.QUERIES.keys()))
+def test_queries_match_dfseval(mocker, name):
+    with ThreadPoolExecutor(4) as executor:
+        dfseval = evals.DFSEval(executor = executor, chunk_size = 3)
+        graphqueries.check_matches_dfseval(name, lambda query: dfseval(query.body, env.DefaultEnv()).value)
+
+def test_order_is_kept(mocker):
+    def slow(x : int) -> int:
+        # Earlier elements finish last
+        time.sleep((20 - x) * 0.001)
+        return x
+    items = list(range(20))
+    with ThreadPoolExecutor(4) as executor:
+        result = evals.DFSEval(executor = executor, chunk_size = 2)(fmap(NativeFunc(slow), items), env.DefaultEnv())
+    assert result.value == items
+
+def test_process_pool(mocker):
+    items = list(range(50))
+    with ProcessPoolExecutor(2) as executor:
+        dfseval = evals.DFSEval(executor = executor, chunk_size = 10)
+        map_in_chunks = mocker.spy(parallel, "map_in_chunks")
+        assert dfseval(fmap(NativeFunc(square, pure = True), items), env.DefaultEnv()).value == [x * x for x in items]
+        assert map_in_chunks.call_count == 1
+        # Impure functions stay in this process
+        assert dfseval(fmap(NativeFunc(square), items), env.DefaultEnv()).value == [x * x for x in items]
+        assert map_in_chunks.call_count == 1
+
+def test_exception_cancels_remaining(mocker):
+    calls = []
+    def fail_first(x : int) -> int:
+        calls.append(x)
+        if x == 0: raise ValueError("bad element")
+        time.sleep(0.001)
+        return x
+    with ThreadPoolExecutor(1) as executor:
+        dfseval = evals.DFSEval(executor = executor, chunk_size = 5)
+        with pytest.raises(ValueError):
+            dfseval(fmap(NativeFunc(fail_first), list(range(100))), env.DefaultEnv())
+    # Chunks picked up before the failure was seen stop early
+    assert calls[0] == 0 and len(calls) < 20
+
+def test_nested_fmaps_on_one_worker(mocker):
+    inner = Func(params = ["x"], body = NativeFunc(square)(x = Expr.as_var("x")))
+    outer = Func(params = ["xs"], body = Expr(fmap = FMap(inner, Expr.as_var("xs"))))
+    items = [[1, 2], [3, 4, 5], [6]]
+    results = []
+    def run():
+        with ThreadPoolExecutor(1) as executor:
+            dfseval = evals.DFSEval(executor = executor, chunk_size = 1)
+            results.append(dfseval(fmap(outer, items), env.DefaultEnv()).value)
+    # The inner FMaps would wait on the only worker (running the outer one)
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    thread.join(10)
+    assert results == [[[1, 4], [9, 16, 25], [36]]]
@@ -0,0 +1,74 @@
+from modelzero.core import evals, env, types, plans
+from modelzero.core.exprs import NativeFunc
+from modelzero.core.queries import Query
+from modelzero.core.types import MZTypes
+from tests.core import graphqueries
+
+def test_equivalent_queries_share_plans(mocker):
+    cache = plans.PlanCache()
+    first = cache.plan_for(graphqueries.fragments_query(first = 3))
+    new_record_class = mocker.spy(types.RecordType, "new_record_class")
+    query = graphqueries.fragments_query(first = 3)
+    assert cache.plan_for(query) is first
+    # The equivalent query is not derived
+    assert new_record_class.call_count == 0
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+    expected = evals.DFSEval()(query.body, env.DefaultEnv()).value
+    assert graphqueries.as_json(first()) == graphqueries.as_json(expected)
+    assert type(first()) is first.record_class
+
+    # Any difference in the commands is a different plan
+    assert cache.plan_for(graphqueries.fragments_query(first = 5)) is not first
+    assert cache.plan_for(graphqueries.optional_fragment_query(True)) is not \
+            cache.plan_for(graphqueries.optional_fragment_query(False))
+    named = Query("ProfileQuery", user = graphqueries.User).select("id")
+    assert cache.plan_for(named) is not cache.plan_for(Query(user = graphqueries.User).select("id"))
+    assert len(cache) == 6
+
+def test_lru_eviction(mocker):
+    cache = plans.PlanCache(max_size = 2)
+    make = lambda *fields: Query(user = graphqueries.User).select(*fields)
+    a = cache.plan_for(make("id"))
+    cache.plan_for(make("name"))
+    assert cache.plan_for(make("id")) is a
+    cache.plan_for(make("handle"))
+    # name was the least recently used
+    assert len(cache) == 2 and cache.stats["evictions"] == 1
+    assert cache.plan_for(make("id")) is a
+    assert cache.plan_for(make("id")).record_class is a.record_class
+    user = graphqueries.make_user(3)
+    assert a(user = user).to_dict() == dict(id = "3")
+
+def test_default_value_types(mocker):
+    assert plans.value_key([[1]]) != plans.value_key([(1,)])
+    assert plans.value_key(dict(a = True)) != plans.value_key(dict(a = 1))
+
+def test_plans_keep_their_queries(mocker):
+    cache = plans.PlanCache()
+    query = Query(user = graphqueries.User).select("id")
+    plan = cache.plan_for(query)
+    # Changing the query later changes neither the plan nor equivalent lookups
+    query.select("name")
+    assert set(query.return_type.record_class.__record_metadata__.fieldnames) == {"id", "name"}
+    assert list(plan.record_class.__record_metadata__.fieldnames) == ["id"]
+    other = cache.plan_for(Query(user = graphqueries.User).select("id"))
+    assert other is plan and list(other.record_class.__record_metadata__.fieldnames) == ["id"]
+    assert cache.plan_for(query) is not plan
+
+def test_false_defaults(mocker):
+    make = lambda: Query(user = graphqueries.User, expand = MZTypes.Bool).select(("expand", "$expand"))
+    with_default = make()
+    with_default.set_default_value("expand", False)
+    assert plans.query_key(with_default) != plans.query_key(make())
+
+def test_native_funcs_by_what_they_wrap(mocker):
+    cache = plans.PlanCache()
+    make = lambda func: Query(user = graphqueries.User).select(("pic", func(id = "$user/id")))
+    plan = cache.plan_for(make(NativeFunc(graphqueries.get_profile_pic, pure = True)))
+    # A NativeFunc made again for the same function shares the plan
+    assert cache.plan_for(make(NativeFunc(graphqueries.get_profile_pic, pure = True))) is plan
+    assert cache.plan_for(make(NativeFunc(graphqueries.get_profile_pic))) is not plan
+    def get_profile_pic(id : str) -> str:
+        return id
+    assert cache.plan_for(make(NativeFunc(get_profile_pic))) is not plan
@@ -0,0 +1,39 @@
+import io, itertools
+from modelzero.core import env
+from modelzero.core.exprs import Expr
+from modelzero.core.profiler import Profiler, ProfilingEval, ProfilingCompiler
+from tests.core import graphqueries
+
+def test_self_and_cumulative_times(mocker):
+    # Every reading of the clock is a second later
+    profiler = Profiler(clock = itertools.count().__next__)
+    native = Expr.as_native(True)
+    expr = Expr.as_notexp(native)
+    assert ProfilingEval(profiler)(expr, env.DefaultEnv()).value is False
+    stats = profiler.stats_for(expr)
+    assert (stats.count, stats.total, stats.own) == (1, 3, 2)
+    assert profiler.stats_for(native).own == 1
+    out = io.StringIO()
+    profiler.write_collapsed(out)
+    assert out.getvalue() == "notexp 2000000\nnotexp;native 1000000\n"
+
+def test_query_profiles(mocker):
+    query = graphqueries.fragments_query(first = 3)
+    evaluated, compiled = Profiler(), Profiler(allocations = True)
+    ProfilingEval(evaluated)(query.body, env.DefaultEnv())
+    ProfilingCompiler(compiled).compile_func(query)()
+    pic = "tests.core.graphqueries.get_profile_pic"
+    for profiler in (evaluated, compiled):
+        assert profiler.funcs[pic].count == 6
+        assert profiler.funcs["tests.core.graphqueries.get_user"].count == 1
+        # Self times add up to the time of the root
+        root = profiler.stats_for(query.body)
+        assert abs(sum(profiler.stacks.values()) - root.total) < 1e-6
+        assert all(line.startswith("set user") for line in profiler.collapsed())
+
+    report = evaluated.report(query.body)
+    first_line = report.split("\n")[0]
+    assert "] new " in first_line
+    assert first_line.endswith(f"# {evaluated.stats_for(query.body).summary()}")
+    assert f"{pic}: 6x" in report
+    assert "blocks" in compiled.report()
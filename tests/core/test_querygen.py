@@ -0,0 +1,72 @@
+import pytest
+from modelzero.core import codegen, querygen
+from modelzero.core.exprs import Expr, Func
+from modelzero.core.queries import Query
+from tests.core import graphqueries
+
+@pytest.mark.parametrize("name", list(graphqueries.QUERIES.keys()))
+def test_queries_match_dfseval(mocker, name):
+    def generated(query):
+        compiled = querygen.compile_query(query)
+        assert compiled.source is not None
+        return compiled()
+    graphqueries.check_matches_dfseval(name, generated)
+
+def test_query_inputs(mocker):
+    query = Query(user = graphqueries.User).select("id", "name")
+    compiled = querygen.compile_query(query)
+    user = graphqueries.make_user(7)
+    assert compiled(user = user).to_dict() == dict(id = "7", name = "User 7")
+    assert compiled(user = None).to_dict() == dict(id = None, name = None)
+    with pytest.raises(Exception):
+        compiled()
+
+def test_fingerprint_is_structural(mocker):
+    q1 = graphqueries.fragments_query(first = 3)
+    q2 = graphqueries.fragments_query(first = 3)
+    q3 = graphqueries.fragments_query(first = 5)
+    c1, c2 = querygen.compile_query(q1), querygen.compile_query(q2)
+    assert c1.fingerprint == c2.fingerprint
+    assert c1.fingerprint != querygen.compile_query(q3).fingerprint
+    assert graphqueries.as_json(c2()) == graphqueries.as_json(c1())
+
+def test_disk_cache(mocker, tmp_path):
+    query = graphqueries.type_conditions_query()
+    mocker.patch.dict(querygen._codes, clear = True)
+    compile_code = mocker.spy(codegen.Source, "compile_code")
+    first = querygen.compile_query(query, cache_dir = str(tmp_path))
+    assert compile_code.call_count == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # A new process would only have the disk cache
+    querygen._codes.clear()
+    second = querygen.compile_query(graphqueries.type_conditions_query(), cache_dir = str(tmp_path))
+    assert compile_code.call_count == 1
+    assert second.fingerprint == first.fingerprint
+    assert graphqueries.as_json(second()) == graphqueries.as_json(first())
+
+def test_fallback_to_closures(mocker):
+    inner = Query(user = graphqueries.User).select("id")
+    # Calls to computed functions cannot be generated
+    func = Func("dynamic", params = ["user"],
+                body = Expr.as_call(Expr.as_var("f"), user = Expr.as_var("user")))
+    body = Expr.as_let(f = Expr(func = inner))
+    body.let.set_body(Expr.as_call(func, user = Expr.as_var("u")))
+    outer = Func("outer", params = ["u"], body = body)
+    compiled = querygen.compile_query(outer)
+    assert compiled.source is None
+    assert compiled(u = graphqueries.make_user(2)).id == "2"
+
+def test_keyword_field_names(mocker):
+    from modelzero.core.records import Record, Field
+    from modelzero.core.types import Type, MZTypes
+    Klass = type("Klass", (Record,), {"__compiled__": True, "name": Field(MZTypes.String),
+                                      "class": Field(MZTypes.Int, optional = True)})
+    record = Klass(name = "a", **{"class": "3"})
+    assert getattr(record, "class") == 3
+    assert record.to_dict() == {"name": "a", "class": 3}
+
+    query = Query(k = Type.as_record_type(Klass)).select(("from", Expr.as_getter(Expr.as_var("k"), "class")))
+    compiled = querygen.compile_query(query)
+    assert compiled.source is not None
+    assert getattr(compiled(k = record), "from") == 3
@@ -0,0 +1,156 @@
+import pickle
+from modelzero.core import errors
+from modelzero.core.records import Record, Field, SlotValues
+from modelzero.core.types import MZTypes, Type
+from modelzero.common.fields import ListField
+from modelzero.core.entities import Entity
+
+class Point(Record):
+    __compact__ = True
+    x = Field(MZTypes.Int)
+    y = Field(MZTypes.Int, default = 7)
+
+class Point3(Point):
+    z = Field(MZTypes.Int, optional = True)
+
+class CompactEntity(Entity):
+    __compact__ = True
+    is_active = Field(MZTypes.Bool, default = True, optional = True)
+    name = Field(MZTypes.String)
+
+def test_compact_record_fields(mocker):
+    p = Point(x = "3")
+    assert p.x == 3
+    assert p.y == 7
+    assert "x" in p and "y" not in p
+    assert not hasattr(p, "__dict__")
+    assert Point.__dictoffset__ == 0
+    assert isinstance(p.__field_values__, SlotValues)
+    assert dict(p.__field_values__) == {"x": 3}
+
+    p.y = "8"
+    assert p.y == 8
+    del p.y
+    assert p.y == 7 and "y" not in p
+    del p.y
+
+    assert Point(x = 1) == Point(x = 1)
+    assert Point(x = 1) != Point(x = 2)
+
+def test_compact_record_inheritance(mocker):
+    p = Point3(x = 1, z = 2)
+    assert list(Point3.__record_metadata__.fieldnames) == ["x", "y", "z"]
+    assert Point3.__slots__ == ("z",)
+    assert dict(p.__field_values__) == {"x": 1, "z": 2}
+
+    e = CompactEntity(name = "hello", __key__ = 42)
+    assert e.getkey() == CompactEntity.Key(42)
+    assert not hasattr(e, "__dict__")
+    assert e.is_active is True
+    assert e.validate() is e
+    e2 = pickle.loads(pickle.dumps(e))
+    assert e2.getkey() == e.getkey()
+    assert dict(e2.__field_values__) == dict(e.__field_values__)
+
+def test_compact_record_rejects_late_fields(mocker):
+    try:
+        Point.register_field("w", Field(MZTypes.Int))
+        assert False, "Should not be able to add fields to compact records"
+    except Exception as exc:
+        assert "compact" in str(exc)
+
+class CompiledRecord(Record):
+    __compiled__ = True
+    x = Field(MZTypes.Int)
+    y = Field(MZTypes.String, default = "d", validators = [str.upper])
+    z = Field(MZTypes.Int, optional = True)
+
+class CompiledEntity(CompactEntity):
+    __compiled__ = True
+    age = Field(MZTypes.Int, optional = True)
+
+def test_compiled_record_methods(mocker):
+    assert CompiledRecord.__init__.__generated__
+    r = CompiledRecord(x = "3", y = "abc")
+    assert dict(r.__field_values__) == {"x": 3, "y": "ABC"}
+    assert r.to_dict() == {"x": 3, "y": "ABC", "z": None}
+    assert r == CompiledRecord(x = 3, y = "ABC")
+    assert r != CompiledRecord(x = 3)
+    assert r.validate() is r
+
+    try:
+        CompiledRecord(y = "a").validate()
+        assert False, "Validation should have failed"
+    except errors.ValidationError as ve:
+        assert list(ve.data.keys()) == ["x"]
+
+def test_compiled_compact_entity(mocker):
+    e = CompiledEntity(name = "hello", age = "4", __key__ = 42)
+    assert e.getkey() == CompiledEntity.Key(42)
+    assert e.age == 4
+    assert e.to_dict()["name"] == "hello"
+
+def test_compiled_record_late_fields(mocker):
+    class Late(Record):
+        __compiled__ = True
+        a = Field(MZTypes.Int)
+    Late.register_field("b", Field(MZTypes.Int))
+    assert Late(a = 1, b = "2").to_dict() == {"a": 1, "b": 2}
+
+def test_dirty_field_tracking(mocker):
+    r = CompiledRecord(x = 1, y = "a")
+    assert r.dirty_fields is None
+    r.z = 3
+    assert r.dirty_fields is None
+    r.mark_clean()
+    assert r.dirty_fields == set()
+    r.y = "b"
+    r.setfield("z", 4)
+    assert r.dirty_fields == {"y", "z"}
+    del r.x
+    assert r.dirty_fields == {"x", "y", "z"}
+
+    p = Point(x = 1).mark_clean()
+    p.y = 2
+    del p.x
+    assert p.dirty_fields == {"x", "y"}
+
+class Holder(Entity):
+    point = Field(Type.as_record_type(Point), optional = True)
+    tags = ListField(MZTypes.String, optional = True)
+    name = Field(MZTypes.String, optional = True)
+
+def test_changed_fields(mocker):
+    h = Holder(point = Point(x = 1), name = "a", __key__ = 1)
+    assert h.changed_fields is None
+    h.mark_clean()
+    # Records, lists and maps can be changed in place so are always written
+    assert h.changed_fields == {"point"}
+    h.name = "b"
+    h.tags = ["t"]
+    assert h.changed_fields == {"point", "tags", "name"}
+
+    # A new key needs the whole entity written
+    h.mark_clean()
+    h.setkey(1)
+    assert h.dirty_fields == set()
+    h.setkey(2)
+    assert h.dirty_fields is None and h.changed_fields is None
+
+def test_lazy_record(mocker):
+    r = CompiledRecord.lazy({"x": "3", "y": "abc", "other": 1})
+    assert set(r.__field_values__.pending) == {"x", "y"}
+    assert r.x == 3
+    assert r.__field_values__.pending == {"y"}
+    assert r.to_dict() == {"x": 3, "y": "ABC", "z": None}
+    assert r == CompiledRecord(x = 3, y = "ABC")
+
+    r = CompiledRecord.lazy({"x": "bad", "y": "abc"})
+    assert r.y == "ABC"
+    try:
+        r.x
+        assert False, "Invalid values should fail when read"
+    except ValueError: pass
+
+    p = Point.lazy({"x": "4"})
+    assert p.x == 4 and p.y == 7
@@ -0,0 +1,43 @@
+from modelzero.core import exprs, types
+from modelzero.core.exprs import Expr
+from modelzero.core.queries import Query
+from modelzero.core.types import MZTypes
+from tests.core import graphqueries
+
+def test_types_cached_per_query(mocker):
+    field_path = mocker.spy(types.Type, "type_for_field_path")
+    birthday = Expr.as_getter(Expr.as_var("user"), "birthday")
+    query = Query(user = graphqueries.User).select(
+            ("month", Expr.as_getter(birthday, "month")),
+            ("day", Expr.as_getter(birthday, "day")),
+            ("year", Expr.as_getter(birthday, "year")))
+    fields = query.return_type.record_class.__record_metadata__
+    assert fields["month"].logical_type == MZTypes.Int
+    # The shared birthday getter is only inferred once
+    assert field_path.call_count == 4
+    expr_types = {}
+    type_infer = exprs.TypeInfer(expr_types)
+    assert type_infer(birthday, [query]) is type_infer(birthday, [query])
+    assert field_path.call_count == 5 and expr_types[id(birthday)][0] is birthday
+
+def test_shared_nodes_typed_per_query(mocker):
+    p = Expr.as_var("p")
+    users = Query(p = graphqueries.User).select(("who", p))
+    pages = Query(p = graphqueries.Page).select(("who", p))
+    assert users.return_type.record_class.__record_metadata__["who"].logical_type == graphqueries.User
+    assert pages.return_type.record_class.__record_metadata__["who"].logical_type == graphqueries.Page
+
+def test_rebuild_clears_types(mocker):
+    field_path = mocker.spy(types.Type, "type_for_field_path")
+    name = Expr.as_getter(Expr.as_var("user"), "name")
+    query = Query(user = graphqueries.User).select(("name", name))
+    assert query.return_type.record_class.__record_metadata__["name"].logical_type == MZTypes.String
+    assert field_path.call_count == 1
+    # Types of earlier commands stay valid as commands are added
+    query.select("id")
+    assert set(query.return_type.record_class.__record_metadata__.fieldnames) == {"name", "id"}
+    assert field_path.call_count == 2
+    query.remove_command(1)
+    fields = query.return_type.record_class.__record_metadata__
+    assert set(fields.fieldnames) == {"name"}
+    assert field_path.call_count == 3
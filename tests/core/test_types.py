@@ -0,0 +1,93 @@
+import typing
+from modelzero.core.records import Record, Field
+from modelzero.core.types import Type, MZTypes, ensure_type
+
+class Node(Record):
+    name = Field(MZTypes.String, optional = True)
+
+def test_types_are_interned(mocker):
+    assert MZTypes.List[MZTypes.Int] is MZTypes.List[MZTypes.Int]
+    assert MZTypes.Map[MZTypes.String, Node] is MZTypes.Map[MZTypes.String, Node]
+    assert MZTypes.List[MZTypes.Int] != MZTypes.List[MZTypes.Long]
+    assert Type.as_record_type(Node) is ensure_type(Node)
+    assert Type.as_type_ref("a.B") is Type.as_type_ref("a.B")
+    optional = Type.as_optional_type(MZTypes.Int)
+    assert Type.as_optional_type(optional) is optional
+    assert {MZTypes.List[MZTypes.Int]: 1}[MZTypes.List[MZTypes.Int]] == 1
+
+    # Sum types are mutable so are not shared
+    assert Type.as_sum_type(None, MZTypes.Int) != Type.as_sum_type(None, MZTypes.Int)
+
+def test_ensure_type_memoized(mocker):
+    assert ensure_type(typing.List[int]) is MZTypes.List[MZTypes.Int]
+    assert ensure_type(typing.Optional[str]) is Type.as_optional_type(MZTypes.String)
+    assert ensure_type(typing.List[int]) is ensure_type(typing.List[int])
+
+def test_ensure_type_does_not_keep_records_alive(mocker):
+    import gc, weakref
+    Temp = type("Temp", (Record,), {"a": Field(MZTypes.Int)})
+    assert ensure_type(Temp).record_class is Temp
+    ref = weakref.ref(Temp)
+    del Temp
+    gc.collect()
+    assert ref() is None
+
+def test_logical_type_cached(mocker):
+    field = Node.__record_metadata__["name"]
+    assert field.logical_type is field.logical_type
+    assert field.logical_type is Type.as_optional_type(MZTypes.String)
+    field = Field(MZTypes.Int)
+    assert field.logical_type is MZTypes.Int
+    field.optional = True
+    assert field.logical_type is Type.as_optional_type(MZTypes.Int)
+
+class Page(Record):
+    title = Field(MZTypes.String)
+    owner = Field(ensure_type(Node))
+
+class User(Record):
+    title = Field(MZTypes.String)
+    name = Field(MZTypes.String)
+
+    @property
+    def age(self) -> int:
+        return 3
+
+def test_field_path_resolution_cached(mocker):
+    page_or_user = Type.as_sum_type("PageOrUser", Page, User)
+    page_type = ensure_type(Page)
+    assert page_type.type_for_field_path("owner", "name") is Type.as_optional_type(MZTypes.String)
+    assert ensure_type(User).type_for_field_path("age") is MZTypes.Int
+    assert page_or_user.type_for_field_path("title") is MZTypes.String
+
+    spy = mocker.spy(page_or_user.sum_type, "_child_in_all_variants")
+    for i in range(3):
+        assert page_or_user.sum_type.child_if_exists_in_all_variants("title") is MZTypes.String
+        assert page_or_user.sum_type.child_if_exists_in_all_variants("name") is None
+    assert spy.call_count == 1
+
+    # Failures are cached too but raised as new exceptions
+    raised = []
+    for i in range(2):
+        try:
+            page_type.type_for_field_path("missing")
+            assert False
+        except Exception as exc:
+            assert "missing" in str(exc)
+            raised.append(exc)
+    assert raised[0] is not raised[1]
+
+    # Fields added to other records leave cached resolutions alone
+    assert page_type.type_for_field_path("title") is MZTypes.String
+    spy = mocker.spy(page_type, "_type_for_field_path")
+    Node.register_field("other", Field(MZTypes.Int, optional = True))
+    assert page_type.type_for_field_path("title") is MZTypes.String
+    assert spy.call_count == 0
+    # but not to records along the path
+    assert page_type.type_for_field_path("owner", "other") is Type.as_optional_type(MZTypes.Int)
+
+    # Adding fields invalidates cached resolutions
+    Page.register_field("name", Field(MZTypes.String))
+    assert page_or_user.sum_type.child_if_exists_in_all_variants("name") is MZTypes.String
+    Page.register_field("missing", Field(MZTypes.Int))
+    assert page_type.type_for_field_path("missing") is MZTypes.Int